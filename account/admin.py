@@ -4,5 +4,6 @@ from .models import Profile
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
-    list_display = ['user', 'date_of_birth', 'photo']
+    list_display = ['user', 'date_of_birth', 'photo', 'followers_count',
+                    'following_count', 'posts_count']
     raw_id_fields = ['user']
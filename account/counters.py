@@ -0,0 +1,32 @@
+"""
+Denormalized profile counters: Profile.followers_count, following_count
+and posts_count.
+
+Like Image.total_likes, they are only ever changed with single-column
+delta updates, so concurrent follows of the same user cannot overwrite
+each other. Contact and Image signals keep them current; code that
+bypasses signals (bulk_create, queryset.update) must call
+adjust_profile_counts() itself.
+"""
+from django.db.models import F
+from django.db.models.functions import Greatest
+from .models import Profile
+
+
+def adjust_profile_counts(user_id, **deltas):
+    """Apply {counter field: delta} to a user's profile in one UPDATE"""
+    adjust_many_profile_counts([user_id], **deltas)
+
+
+def adjust_many_profile_counts(user_ids, **deltas):
+    """Apply the same {counter field: delta} to several profiles at once"""
+    updates = {}
+    for field, delta in deltas.items():
+        if delta:
+            total = F(field) + delta
+            if delta < 0:
+                # never go below zero if a counter had already drifted
+                total = Greatest(total, 0)
+            updates[field] = total
+    if updates and user_ids:
+        Profile.objects.filter(user_id__in=user_ids).update(**updates)
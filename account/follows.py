@@ -0,0 +1,84 @@
+"""
+Following and unfollowing several users at once.
+
+New contacts are written with one bulk insert, which does not send the
+Contact signals, so the profile counters and the follow graph sets are
+updated here, once per call. Removed contacts go through
+QuerySet.delete(), whose signals update them row by row. Both run with
+the follower's profile row locked, so the rows read as followed are the
+ones inserted or deleted and the counters move by exactly that much.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from actions.utils import create_action
+from images import timeline
+from . import graph
+from .counters import adjust_profile_counts, adjust_many_profile_counts
+from .models import Contact, Profile
+
+
+def _lock_follower(user):
+    """Serialize the follow changes of one follower until commit"""
+    list(Profile.objects.select_for_update().filter(user=user)
+         .values_list("id", flat=True))
+
+
+def _followed_ids(user, user_ids):
+    return set(
+        Contact.objects.filter(user_from=user, user_to_id__in=user_ids)
+        .values_list("user_to_id", flat=True)
+    )
+
+
+def follow_users(user, user_ids):
+    """
+    Make user follow every active user in user_ids. Returns
+    {user id: following} for the users that exist.
+    """
+    targets = set(
+        User.objects.filter(id__in=user_ids, is_active=True)
+        .exclude(id=user.id).values_list("id", flat=True)
+    )
+    with transaction.atomic():
+        _lock_follower(user)
+        # the self-follow is checked along with the targets
+        followed = _followed_ids(user, targets | {user.id})
+        new_ids = sorted(targets - followed)
+        if user.id not in followed:
+            new_ids.append(user.id)
+        # every row is inserted, or the unique constraint fails the call
+        Contact.objects.bulk_create(
+            [Contact(user_from=user, user_to_id=i) for i in new_ids]
+        )
+        adjust_profile_counts(user.id, following_count=len(new_ids))
+        adjust_many_profile_counts(new_ids, followers_count=1)
+    transaction.on_commit(lambda: graph.follow(user.id, *new_ids))
+
+    new_ids = [i for i in new_ids if i != user.id]
+    if len(new_ids) == 1:
+        create_action(user, "is following", User.objects.get(id=new_ids[0]))
+    elif new_ids:
+        # one entry in the activity stream for the whole batch
+        create_action(user, f"is following {len(new_ids)} new people")
+    timeline.backfill(user.id, *new_ids)
+    return {i: True for i in targets}
+
+
+def unfollow_users(user, user_ids):
+    """
+    Make user stop following every user in user_ids except themselves.
+    Returns {user id: following} for the users that exist.
+    """
+    targets = set(
+        User.objects.filter(id__in=user_ids).exclude(id=user.id)
+        .values_list("id", flat=True)
+    )
+    with transaction.atomic():
+        _lock_follower(user)
+        contacts = Contact.objects.filter(user_from=user,
+                                          user_to_id__in=targets)
+        removed_ids = list(contacts.values_list("user_to_id", flat=True))
+        # the signals adjust the counters and the graph of each row
+        contacts.delete()
+    timeline.purge(user.id, *removed_ids)
+    return {i: False for i in targets}
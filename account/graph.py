@@ -0,0 +1,233 @@
+"""
+The follow graph mirrored into Redis sets.
+
+Every user has a set at following:<user id> with the ids of the users they
+follow and one at followers:<user id> with the ids of their followers, so
+membership checks, mutuals and "not following back" are single set
+commands instead of joins over Contact. Like the liked sets in
+images.likes, sets are loaded from the database on first use and marked
+with the member 0 (never a user id); a set without the marker is
+incomplete and is reloaded before it is trusted. Loads only add members,
+so follows applied while the database was read are kept, and unfollows
+drop the marker as well so that a load racing with them is redone.
+
+Only the sets a query reads are loaded. Another user's follower set can
+be huge, so followed_by_count() answers from the database while it is
+not loaded and has it loaded in the background.
+
+Contact signals keep the sets in sync, code that bypasses them
+(bulk_create, queryset.update) must call follow() and unfollow() itself.
+The rebuild_follow_graph command resyncs every set from the database.
+"""
+from collections import defaultdict
+import redis
+from bookmarks.celery import delay_on_commit
+from bookmarks.redis_client import r, background_r, execute_or_buffer
+from .models import Contact
+
+
+GRAPH_TIMEOUT = 7 * 24 * 3600
+LOADED = 0
+LOAD_LOCK_TIMEOUT = 60
+FOLLOWING, FOLLOWERS = "following", "followers"
+
+
+def following_key(user_id):
+    return f"following:{user_id}"
+
+
+def followers_key(user_id):
+    return f"followers:{user_id}"
+
+
+def loading_key(kind, user_id):
+    return f"graph:loading:{kind}:{user_id}"
+
+
+def _ids(members):
+    return {int(member) for member in members} - {LOADED}
+
+
+# set kind -> (key function, Contact field of the set's owner, of members)
+SETS = {
+    FOLLOWING: (following_key, "user_from_id", "user_to_id"),
+    FOLLOWERS: (followers_key, "user_to_id", "user_from_id"),
+}
+
+
+class NotLoaded(Exception):
+    """A set that must not be loaded on the request path is not loaded"""
+
+
+def load(sets, client=r):
+    """Merge the database's contacts into the (kind, user id) sets"""
+    by_kind = defaultdict(list)
+    for kind, user_id in sets:
+        by_kind[kind].append(user_id)
+    pipe = client.pipeline()
+    for kind, user_ids in by_kind.items():
+        key, owner, member = SETS[kind]
+        members = defaultdict(list)
+        for owner_id, member_id in Contact.objects.filter(
+            **{f"{owner}__in": user_ids}
+        ).values_list(owner, member).order_by():
+            members[owner_id].append(member_id)
+        for user_id in user_ids:
+            pipe.sadd(key(user_id), LOADED, *members[user_id])
+            pipe.expire(key(user_id), GRAPH_TIMEOUT)
+    pipe.execute()
+
+
+def rebuild(user_ids, batch_size=1000):
+    """Resync the sets of user_ids from the database, in batches"""
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        sets = [(kind, user_id) for user_id in batch for kind in SETS]
+        # stale members are only dropped by starting over, sets deleted
+        # before they are loaded again are loaded on demand meanwhile
+        background_r.delete(*[SETS[kind][0](user_id)
+                              for kind, user_id in sets])
+        load(sets, background_r)
+    return len(user_ids)
+
+
+def _query(sets, command, load_later=()):
+    """
+    Queue command(pipe) behind checks that the (kind, user id) sets it
+    reads are loaded and return its reply, in one round trip unless sets
+    must be loaded. Sets in load_later are loaded by a background task
+    instead and NotLoaded is raised until they are.
+    """
+    pipe = r.pipeline()
+    for kind, user_id in sets:
+        pipe.sismember(SETS[kind][0](user_id), LOADED)
+    command(pipe)
+    *loaded, reply = pipe.execute()
+    missing = [s for s, is_loaded in zip(sets, loaded) if not is_loaded]
+    if not missing:
+        return reply
+    later = [s for s in missing if s in load_later]
+    if later:
+        _load_in_background(later)
+        raise NotLoaded(later)
+    load(missing)
+    pipe = r.pipeline()
+    command(pipe)
+    return pipe.execute()[0]
+
+
+def _load_in_background(sets):
+    # tasks.py imports this module
+    from .tasks import load_follow_sets
+
+    # one load per set at a time, however many requests find it missing
+    pipe = r.pipeline(transaction=False)
+    for kind, user_id in sets:
+        pipe.set(loading_key(kind, user_id), 1, nx=True,
+                 ex=LOAD_LOCK_TIMEOUT)
+    queued = [s for s, new in zip(sets, pipe.execute()) if new]
+    if queued:
+        delay_on_commit(load_follow_sets, queued)
+
+
+def follow(user_from_id, *user_to_ids):
+    _update(user_from_id, user_to_ids, True)
+
+
+def unfollow(user_from_id, *user_to_ids):
+    _update(user_from_id, user_to_ids, False)
+
+
+def _update(user_from_id, user_to_ids, following):
+    if not user_to_ids:
+        return
+    changes = [(following_key(user_from_id), user_to_ids)] + [
+        (followers_key(user_to_id), [user_from_id])
+        for user_to_id in user_to_ids
+    ]
+
+    def queue(pipe):
+        for key, members in changes:
+            if following:
+                pipe.sadd(key, *members)
+            else:
+                # a load that read the database before this unfollow could
+                # put the member back: the set is reloaded instead
+                pipe.srem(key, LOADED, *members)
+            # sets created here lack the marker and expire like loaded ones
+            pipe.expire(key, GRAPH_TIMEOUT)
+
+    execute_or_buffer(r, queue)
+
+
+def following_among(user_id, user_ids):
+    """Return the subset of user_ids that the user follows"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+    try:
+        members = _query(
+            [(FOLLOWING, user_id)],
+            lambda pipe: pipe.smismember(following_key(user_id), user_ids),
+        )
+    except redis.RedisError:
+        return set(
+            Contact.objects.filter(user_from_id=user_id,
+                                   user_to_id__in=user_ids)
+            .values_list("user_to_id", flat=True)
+        )
+    return {i for i, following in zip(user_ids, members) if following}
+
+
+def is_following(user_from_id, user_to_id):
+    return user_to_id in following_among(user_from_id, [user_to_id])
+
+
+def mutual_ids(user_id):
+    """Ids of the users who follow user_id back, excluding themselves"""
+    try:
+        members = _query(
+            [(FOLLOWING, user_id), (FOLLOWERS, user_id)],
+            lambda pipe: pipe.sinter(following_key(user_id),
+                                     followers_key(user_id)),
+        )
+    except redis.RedisError:
+        members = Contact.objects.filter(
+            user_from_id=user_id,
+            user_to__rel_from_set__user_to_id=user_id,
+        ).values_list("user_to_id", flat=True)
+    return _ids(members) - {user_id}
+
+
+def not_following_back_ids(user_id):
+    """Ids of the users user_id follows who do not follow them back"""
+    try:
+        members = _query(
+            [(FOLLOWING, user_id), (FOLLOWERS, user_id)],
+            lambda pipe: pipe.sdiff(following_key(user_id),
+                                    followers_key(user_id)),
+        )
+    except redis.RedisError:
+        members = Contact.objects.filter(user_from_id=user_id).exclude(
+            user_to__rel_from_set__user_to_id=user_id,
+        ).values_list("user_to_id", flat=True)
+    return _ids(members)
+
+
+def followed_by_count(viewer_id, user_id):
+    """How many of the users viewer_id follows also follow user_id"""
+    followers = (FOLLOWERS, user_id)
+    try:
+        members = _query(
+            [(FOLLOWING, viewer_id), followers],
+            lambda pipe: pipe.sinter(following_key(viewer_id),
+                                     followers_key(user_id)),
+            load_later={followers},
+        )
+    except (redis.RedisError, NotLoaded):
+        members = Contact.objects.filter(
+            user_from_id=viewer_id,
+            user_to__rel_from_set__user_to_id=user_id,
+        ).values_list("user_to_id", flat=True)
+    return len(_ids(members) - {viewer_id, user_id})
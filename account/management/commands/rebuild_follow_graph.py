@@ -0,0 +1,15 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from account import graph
+
+
+class Command(BaseCommand):
+    help = "Resync the follow graph sets in Redis from the Contact table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user_ids = User.objects.order_by("id").values_list("id", flat=True)
+        total = graph.rebuild(user_ids, options["batch_size"])
+        self.stdout.write(f"Rebuilt the follow graph of {total} users")
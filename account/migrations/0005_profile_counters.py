@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_for(model, field):
+    # number of `model` rows whose `field` is the profile's user
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef("user_id")})
+        .order_by().values(field).annotate(total=Count("pk"))
+        .values("total")
+    ), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    User = apps.get_model("auth", "User")
+    Profile = apps.get_model("account", "Profile")
+    Contact = apps.get_model("account", "Contact")
+    Image = apps.get_model("images", "Image")
+    # the counters live on profiles, make sure every user has one
+    Profile.objects.bulk_create([
+        Profile(user_id=user_id) for user_id in
+        User.objects.filter(profile__isnull=True).values_list("id", flat=True)
+    ])
+    Profile.objects.update(
+        followers_count=count_for(Contact, "user_to"),
+        following_count=count_for(Contact, "user_from"),
+        posts_count=count_for(Image, "user"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_profile_bio'),
+        ('images', '0017_image_unique_viewers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
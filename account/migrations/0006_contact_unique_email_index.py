@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:50
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_for(model, field):
+    # number of `model` rows whose `field` is the profile's user
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef("user_id")})
+        .order_by().values(field).annotate(total=Count("pk"))
+        .values("total")
+    ), 0)
+
+
+def remove_duplicate_contacts(apps, schema_editor):
+    Contact = apps.get_model("account", "Contact")
+    Profile = apps.get_model("account", "Profile")
+    duplicates = (
+        Contact.objects.values("user_from", "user_to").order_by()
+        .annotate(total=Count("id"), first=Min("id"))
+        .filter(total__gt=1)
+    )
+    removed = 0
+    for pair in duplicates:
+        removed += Contact.objects.filter(
+            user_from=pair["user_from"], user_to=pair["user_to"]
+        ).exclude(id=pair["first"]).delete()[0]
+    if removed:
+        # the profile counters counted the duplicates too
+        Profile.objects.update(
+            followers_count=count_for(Contact, "user_to"),
+            following_count=count_for(Contact, "user_from"),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0005_profile_counters'),
+        # auth_user must not be rebuilt after the email index is added
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_contacts,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='contact',
+            constraint=models.UniqueConstraint(fields=('user_from', 'user_to'), name='unique_contact'),
+        ),
+        # EmailAuthBackend looks users up by email
+        migrations.RunSQL(
+            'CREATE INDEX account_user_email_idx ON auth_user (email)',
+            'DROP INDEX account_user_email_idx',
+        ),
+    ]
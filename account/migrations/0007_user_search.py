@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_search_table(apps, schema_editor):
+    # other databases search usernames with icontains, see account.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE account_usersearch "
+        "USING fts5(username, tokenize='trigram')"
+    )
+    schema_editor.execute(
+        "INSERT INTO account_usersearch (rowid, username) "
+        "SELECT id, lower(username) FROM auth_user WHERE is_active"
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE account_usersearch")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0006_contact_unique_email_index'),
+    ]
+
+    operations = [
+        # exact and prefix username lookups
+        migrations.RunSQL(
+            'CREATE INDEX account_user_username_lower_idx '
+            'ON auth_user (lower(username))',
+            'DROP INDEX account_user_username_lower_idx',
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
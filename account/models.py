@@ -9,6 +9,10 @@ class Profile(models.Model):
     date_of_birth = models.DateField(blank=True, null=True)
     bio = models.TextField(blank=True)
     photo = models.ImageField(upload_to="users/%Y/%m/%d/", blank=True)
+    # maintained by account.counters
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"Profile of {self.user.username}"
@@ -27,6 +31,11 @@ class Contact(models.Model):
         indexes = [
             models.Index(fields=["-created"]),
         ]
+        constraints = [
+            # also the index for "does a follow b" lookups
+            models.UniqueConstraint(fields=["user_from", "user_to"],
+                                    name="unique_contact"),
+        ]
         ordering = ["-created"]
 
     def __str__(self):
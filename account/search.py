@@ -0,0 +1,133 @@
+"""
+Username search for the people directory and its autocomplete.
+
+Results are ranked exact match first, then prefix matches, then other
+substring matches, alphabetically within each group:
+
+- exact and prefix matches are range lookups on the lower(username)
+  expression index of auth_user;
+- substrings of three characters or more come from account_usersearch,
+  an SQLite FTS5 table with the trigram tokenizer holding the lowercased
+  username of every active user under their id. User signals keep it in
+  sync, rebuild_index() refills it.
+
+On other databases the substring step falls back to icontains. Results
+for queries of up to USER_SEARCH_CACHED_LENGTH characters, the ones most
+typed and most expensive, are cached for USER_SEARCH_CACHE_TIMEOUT.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.functions import Lower
+from bookmarks.redis_client import UNAVAILABLE
+
+
+SEARCH_TABLE = "account_usersearch"
+# the trigram tokenizer cannot match anything shorter
+TRIGRAM = 3
+
+
+def _fts():
+    return connection.vendor == "sqlite"
+
+
+def index_user(user):
+    """Add, update or remove a user's entry in the search table"""
+    if not _fts():
+        return
+    with connection.cursor() as cursor:
+        if user.is_active:
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, username) "
+                "VALUES (%s, %s)",
+                [user.id, user.username.lower()],
+            )
+        else:
+            unindex_user(user.id)
+
+
+def unindex_user(user_id):
+    if not _fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+                       [user_id])
+
+
+def rebuild_index():
+    """Refill the search table from auth_user"""
+    if not _fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, username) "
+            "SELECT id, lower(username) FROM auth_user WHERE is_active"
+        )
+
+
+def _substring_ids(query, limit):
+    """Ids of up to `limit` users whose username contains query"""
+    if len(query) < TRIGRAM:
+        return []
+    if not _fts():
+        return list(
+            User.objects.filter(username__icontains=query, is_active=True)
+            .order_by("username").values_list("id", flat=True)[:limit]
+        )
+    phrase = '"{}"'.format(query.replace('"', '""'))
+    with connection.cursor() as cursor:
+        # matches come back in rowid order, taking the first ones avoids
+        # sorting every match of a common trigram
+        cursor.execute(
+            f"SELECT rowid FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s LIMIT %s",
+            [phrase, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _search_ids(query, limit):
+    users = User.objects.filter(is_active=True).annotate(
+        name=Lower("username")
+    )
+    ids = list(
+        users.filter(name__gte=query, name__lt=query + "\U0010ffff")
+        .order_by("name").values_list("id", "name")[:limit]
+    )
+    # the exact match sorts first among the prefix matches
+    ranked = [user_id for user_id, _ in ids]
+    if len(ranked) < limit:
+        substring = set(_substring_ids(query, limit + len(ranked)))
+        substring.difference_update(ranked)
+        ranked += list(
+            users.filter(id__in=substring)
+            .order_by("name").values_list("id", flat=True)
+        )
+    return ranked[:limit]
+
+
+def search_users(query, limit=10):
+    """Active users matching query, best matches first"""
+    query = query.strip().lower()
+    if not query:
+        return []
+    key = f"user_search:{limit}:{query}"
+    cached = len(query) <= settings.USER_SEARCH_CACHED_LENGTH
+    ids = None
+    if cached:
+        try:
+            ids = cache.get(key)
+        except UNAVAILABLE:
+            # search uncached until the cache is back
+            cached = False
+    if ids is None:
+        ids = _search_ids(query, limit)
+        if cached:
+            try:
+                cache.set(key, ids, settings.USER_SEARCH_CACHE_TIMEOUT)
+            except UNAVAILABLE:
+                pass
+    users = User.objects.select_related("profile").in_bulk(ids)
+    return [users[user_id] for user_id in ids if user_id in users]
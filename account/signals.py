@@ -1,10 +1,45 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Profile
+from . import graph, search
+from .counters import adjust_profile_counts
+from .models import Profile, Contact
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        Profile.objects.create(user=instance)
+        Profile.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def index_user(sender, instance, update_fields=None, **kwargs):
+    # logging in only touches last_login, which is not searched
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    search.index_user(instance)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def unindex_user(sender, instance, **kwargs):
+    search.unindex_user(instance.id)
+
+
+@receiver(post_save, sender=Contact)
+def contact_created(sender, instance, created, **kwargs):
+    if created:
+        adjust_profile_counts(instance.user_from_id, following_count=1)
+        adjust_profile_counts(instance.user_to_id, followers_count=1)
+        transaction.on_commit(
+            lambda: graph.follow(instance.user_from_id, instance.user_to_id)
+        )
+
+
+@receiver(post_delete, sender=Contact)
+def contact_deleted(sender, instance, **kwargs):
+    adjust_profile_counts(instance.user_from_id, following_count=-1)
+    adjust_profile_counts(instance.user_to_id, followers_count=-1)
+    transaction.on_commit(
+        lambda: graph.unfollow(instance.user_from_id, instance.user_to_id)
+    )
@@ -0,0 +1,118 @@
+"""
+Friend-of-friend user suggestions, computed offline.
+
+compute_suggestions() loads every Contact into a SciPy CSR adjacency
+matrix A, where A[i, j] = 1 when user i follows user j. Row i of A @ A
+counts the paths i -> followed user -> candidate, i.e. how many of the
+people i follows also follow the candidate. Candidates who posted in the
+last SUGGESTION_ACTIVITY_DAYS get their mutual count boosted, and the top
+SUGGESTIONS_PER_USER candidates a user does not follow yet are stored in
+a Redis list at suggestions:<user id> that the home page reads.
+"""
+from datetime import timedelta
+import numpy as np
+import redis
+from scipy import sparse
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count
+from django.utils import timezone
+from bookmarks.redis_client import r, background_r
+from images.models import Image
+from .models import Contact
+
+
+SUGGESTIONS_TIMEOUT = 2 * 24 * 3600
+# rows of A @ A computed at once, bounds the memory used by popular users
+BATCH_SIZE = 1000
+
+
+def suggestions_key(user_id):
+    return f"suggestions:{user_id}"
+
+
+def suggested_user_ids(user_id):
+    """Precomputed suggestions for a user, best first, [] if there are none"""
+    try:
+        return [int(i) for i in r.lrange(suggestions_key(user_id), 0, -1)]
+    except redis.RedisError:
+        return []
+
+
+def _index(user_ids, ids):
+    """Positions of ids in the sorted user_ids array, -1 if missing"""
+    positions = np.searchsorted(user_ids, ids)
+    positions[positions == len(user_ids)] = 0
+    return np.where(user_ids[positions] == ids, positions, -1)
+
+
+def _adjacency(user_ids):
+    contacts = np.array(
+        Contact.objects.values_list("user_from_id", "user_to_id").order_by(),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    rows = _index(user_ids, contacts[:, 0])
+    cols = _index(user_ids, contacts[:, 1])
+    # drop self-follows and contacts with inactive users
+    keep = (rows >= 0) & (cols >= 0) & (rows != cols)
+    size = len(user_ids)
+    adjacency = sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=np.float32), (rows[keep], cols[keep])),
+        shape=(size, size),
+    )
+    # duplicate contacts are summed on construction, count each once
+    adjacency.data[:] = 1
+    return adjacency
+
+
+def _activity(user_ids):
+    """1 + weight * log1p(recent posts) for every user"""
+    since = timezone.now() - timedelta(days=settings.SUGGESTION_ACTIVITY_DAYS)
+    recent = np.array(
+        Image.objects.filter(created__gte=since)
+        .values_list("user_id").annotate(total=Count("id")).order_by(),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    positions = _index(user_ids, recent[:, 0])
+    found = positions >= 0
+    posts = np.zeros(len(user_ids), dtype=np.float32)
+    posts[positions[found]] = recent[found, 1]
+    return 1 + settings.SUGGESTION_ACTIVITY_WEIGHT * np.log1p(posts)
+
+
+def compute_suggestions(batch_size=BATCH_SIZE):
+    """Store the suggestions of every active user, returns the user count"""
+    user_ids = np.array(
+        User.objects.filter(is_active=True).order_by("id")
+        .values_list("id", flat=True),
+        dtype=np.int64,
+    )
+    if not len(user_ids):
+        return 0
+    adjacency = _adjacency(user_ids)
+    # scale every candidate column by its activity weight once
+    weighted = (adjacency @ sparse.diags(_activity(user_ids))).tocsr()
+    limit = settings.SUGGESTIONS_PER_USER
+
+    for start in range(0, len(user_ids), batch_size):
+        scores = (adjacency[start:start + batch_size] @ weighted).tocsr()
+        pipe = background_r.pipeline(transaction=False)
+        for row in range(scores.shape[0]):
+            user = start + row
+            span = slice(scores.indptr[row], scores.indptr[row + 1])
+            candidates = scores.indices[span]
+            values = scores.data[span]
+            followed = adjacency.indices[
+                adjacency.indptr[user]:adjacency.indptr[user + 1]
+            ]
+            keep = (candidates != user) & ~np.isin(candidates, followed)
+            candidates, values = candidates[keep], values[keep]
+            # best first, ties broken by the newest account
+            best = np.lexsort((-candidates, -values))[:limit]
+            key = suggestions_key(int(user_ids[user]))
+            pipe.delete(key)
+            if len(best):
+                pipe.rpush(key, *user_ids[candidates[best]].tolist())
+                pipe.expire(key, SUGGESTIONS_TIMEOUT)
+        pipe.execute()
+    return len(user_ids)
@@ -0,0 +1,19 @@
+from celery import shared_task
+from bookmarks.redis_client import background_r
+from . import graph
+from .suggestions import compute_suggestions as compute
+
+
+@shared_task
+def compute_suggestions():
+    users = compute()
+    return f"Suggestions computed for {users} users."
+
+
+@shared_task(ignore_result=True)
+def load_follow_sets(sets):
+    """Load follow graph sets the request path left unloaded"""
+    sets = [tuple(s) for s in sets]
+    graph.load(sets, background_r)
+    background_r.delete(*[graph.loading_key(*s) for s in sets])
+    return f"{len(sets)} follow sets loaded."
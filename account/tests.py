@@ -1,3 +1,329 @@
-from django.test import TestCase
+import re
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from bookmarks.tests import (
+    UNREACHABLE_CACHES, MemoryRedisTestCase, down_redis, use_redis,
+)
+from images.models import Image
+from . import graph
+from .authentication import EmailAuthBackend
+from .follows import follow_users, unfollow_users
+from .models import Contact, Profile
+from .search import rebuild_index
+from .suggestions import (
+    compute_suggestions, suggested_user_ids, suggestions_key,
+)
+from .tasks import load_follow_sets
 
-# Create your tests here.
+
+# "SCAN <table>" alone reads every row; "SCAN <table> USING INDEX" walks
+# an index in order and "SEARCH" seeks into one
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+@skipUnless(connection.vendor == "sqlite", "uses SQLite's EXPLAIN QUERY PLAN")
+@override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+})
+class QueryPlanTestCase(MemoryRedisTestCase):
+    """
+    Fails when a request's queries make SQLite scan a whole table.
+    Subclasses seed data in setUpTestData and call assertNoFullScans().
+    """
+
+    def full_scans(self, queries):
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query["sql"]
+                if not sql.startswith(("SELECT", "UPDATE", "DELETE")):
+                    continue
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                for row in cursor.fetchall():
+                    match = FULL_SCAN.match(row[-1])
+                    if match:
+                        scans.append(f"{match[1]}: {sql}")
+        return scans
+
+    def assertNoFullScans(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+        self.assertEqual(self.full_scans(context.captured_queries), [])
+        return result
+
+
+class AccountQueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([
+            User(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(50)
+        ])
+        cls.user = cls.users[0]
+        cls.user.set_password("secret")
+        cls.user.save()
+        Contact.objects.bulk_create([
+            Contact(user_from=user_from, user_to=user_to)
+            for user_from in cls.users[:10]
+            for user_to in cls.users[::3]
+        ])
+        # bulk_create does not send the signals that index users
+        rebuild_index()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_email_login(self):
+        backend = EmailAuthBackend()
+        user = self.assertNoFullScans(backend.authenticate, None,
+                                      "user0@example.com", "secret")
+        self.assertEqual(user, self.user)
+
+    def test_user_detail(self):
+        url = reverse("user_detail", args=["user3"])
+        response = self.assertNoFullScans(self.client.get, url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_follow_lists(self):
+        for url in [reverse("user_followers", args=["user3"]),
+                    reverse("user_following", args=["user3"]),
+                    reverse("not_following_back")]:
+            with self.subTest(url=url):
+                response = self.assertNoFullScans(self.client.get, url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_follow(self):
+        for action in ["follow", "unfollow"]:
+            with self.subTest(action=action):
+                response = self.assertNoFullScans(
+                    self.client.post, reverse("user_follow"),
+                    {"id": self.users[1].id, "action": action},
+                )
+                self.assertEqual(response.json()["status"], "ok")
+        response = self.assertNoFullScans(
+            self.client.post, reverse("user_follow_bulk"),
+            {"ids": [user.id for user in self.users[1:20]],
+             "action": "follow"},
+        )
+        self.assertEqual(response.json()["status"], "ok")
+
+    def test_user_search(self):
+        url = reverse("user_list")
+        for query, expected in [
+            ("User1", ["user1"] + [f"user1{i}" for i in range(9)]),
+            ("er4", ["user4"] + [f"user4{i}" for i in range(9)]),
+            ("nobody", []),
+        ]:
+            with self.subTest(query=query):
+                response = self.assertNoFullScans(
+                    self.client.get, url, {"q": query, "ajax": 1}
+                )
+                self.assertEqual(
+                    [user["username"] for user in response.json()], expected
+                )
+
+
+class BulkFollowTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, *cls.others = [
+            User.objects.create(username=f"user{i}") for i in range(4)
+        ]
+
+    def assertCounts(self, following, followers):
+        profiles = Profile.objects.in_bulk(
+            [self.user.id] + [user.id for user in self.others],
+            field_name="user_id",
+        )
+        self.assertEqual(profiles[self.user.id].following_count, following)
+        self.assertEqual(
+            [profiles[user.id].followers_count for user in self.others],
+            followers,
+        )
+
+    def test_counters_follow_rows(self):
+        first, second, third = self.others
+        for _ in range(2):
+            follow_users(self.user, [first.id, second.id])
+        # the self-follow counts as well
+        self.assertCounts(3, [1, 1, 0])
+        follow_users(self.user, [second.id, third.id])
+        self.assertCounts(4, [1, 1, 1])
+        for _ in range(2):
+            unfollow_users(self.user, [first.id, second.id, self.user.id])
+        self.assertCounts(2, [0, 0, 1])
+        self.assertEqual(Contact.objects.filter(user_from=self.user).count(), 2)
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+})
+class ProfileCounterTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, cls.star, cls.fan = [
+            User.objects.create(username=f"user{i}") for i in range(3)
+        ]
+
+    def counts(self, user):
+        """(posts, followers, following) as stored on the profile"""
+        return Profile.objects.filter(user=user).values_list(
+            "posts_count", "followers_count", "following_count"
+        ).get()
+
+    def test_signals_keep_counts(self):
+        contact = Contact.objects.create(user_from=self.viewer,
+                                         user_to=self.star)
+        Contact.objects.create(user_from=self.fan, user_to=self.star)
+        image = Image.objects.create(user=self.star, title="Post")
+        self.assertEqual(self.counts(self.star), (1, 2, 0))
+        self.assertEqual(self.counts(self.viewer), (0, 0, 1))
+        contact.delete()
+        image.delete()
+        self.assertEqual(self.counts(self.star), (0, 1, 0))
+        self.assertEqual(self.counts(self.viewer), (0, 0, 0))
+
+    def test_profile_page_reads_counters(self):
+        Contact.objects.create(user_from=self.viewer, user_to=self.star)
+        # shown as stored, not counted again
+        Profile.objects.filter(user=self.star).update(posts_count=7)
+        self.client.force_login(self.viewer)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("user_detail",
+                                               args=[self.star.username]))
+        self.assertFalse([query["sql"] for query in queries.captured_queries
+                          if "COUNT(" in query["sql"]])
+        self.assertContains(response, "<strong>7</strong>")
+        self.assertTrue(response.context["is_following"])
+
+
+class SuggestionTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create(username=f"user{i}") for i in range(7)]
+        cls.me, first, second, cls.both, cls.active, cls.quiet, gone = users
+        gone.is_active = False
+        gone.save()
+        Profile.objects.update(photo="users/photo.png")
+        Contact.objects.bulk_create([
+            Contact(user_from=user_from, user_to=user_to)
+            for user_from, followed in [
+                (cls.me, [first, second]),
+                (first, [cls.both, cls.active, cls.me]),
+                (second, [cls.both, cls.quiet, gone]),
+            ]
+            for user_to in followed
+        ])
+        Image.objects.create(user=cls.active, title="Post")
+
+    def test_friends_of_friends(self):
+        # suggestions a user does not get any more are dropped
+        self.redis.rpush(suggestions_key(self.quiet.id), self.me.id)
+        for batch_size in [1000, 2]:
+            with self.subTest(batch_size=batch_size):
+                self.assertEqual(compute_suggestions(batch_size), 6)
+                # two mutual follows first, then the recent poster ahead of
+                # the newer account
+                self.assertEqual(
+                    suggested_user_ids(self.me.id),
+                    [self.both.id, self.active.id, self.quiet.id],
+                )
+                self.assertEqual(suggested_user_ids(self.quiet.id), [])
+
+    def test_home_page(self):
+        compute_suggestions()
+        # followed since the last run
+        Contact.objects.create(user_from=self.me, user_to=self.active)
+        self.client.force_login(self.me)
+        response = self.client.get(reverse("home"))
+        self.assertEqual(
+            [user.id for user in response.context["suggested_users"]],
+            [self.both.id, self.quiet.id],
+        )
+
+
+@override_settings(CACHES=UNREACHABLE_CACHES)
+class UserSearchCacheDownTests(MemoryRedisTestCase):
+    def test_autocomplete(self):
+        user = User.objects.create(username="alice")
+        self.client.force_login(user)
+        response = self.client.get(reverse("user_list"),
+                                   {"q": "al", "ajax": 1})
+        self.assertEqual([u["username"] for u in response.json()], ["alice"])
+
+
+class FollowGraphTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, cls.star, *cls.fans = [
+            User.objects.create(username=f"user{i}") for i in range(5)
+        ]
+        Contact.objects.bulk_create(
+            [Contact(user_from=fan, user_to=cls.star) for fan in cls.fans]
+            + [Contact(user_from=cls.viewer, user_to=cls.fans[0]),
+               Contact(user_from=cls.star, user_to=cls.viewer)]
+        )
+
+    def loaded(self, key):
+        return self.redis.sismember(key, graph.LOADED)
+
+    def test_queries_load_their_sets(self):
+        self.assertEqual(graph.following_among(self.viewer.id,
+                                               [self.star.id, self.fans[0].id]),
+                         {self.fans[0].id})
+        self.assertTrue(self.loaded(graph.following_key(self.viewer.id)))
+        self.assertFalse(self.loaded(graph.followers_key(self.viewer.id)))
+        self.assertEqual(graph.mutual_ids(self.star.id), set())
+        self.assertEqual(graph.not_following_back_ids(self.star.id),
+                         {self.viewer.id})
+
+    def test_load_keeps_concurrent_follows(self):
+        other = self.fans[1]
+        # followed while the set was being loaded, not in the database
+        graph.follow(self.viewer.id, other.id)
+        self.assertEqual(
+            graph.following_among(self.viewer.id, [other.id, self.star.id]),
+            {other.id},
+        )
+
+    def test_unfollow_forces_reload(self):
+        fan = self.fans[0]
+        self.assertTrue(graph.is_following(self.viewer.id, fan.id))
+        Contact.objects.filter(user_from=self.viewer, user_to=fan).delete()
+        graph.unfollow(self.viewer.id, fan.id)
+        self.assertFalse(self.loaded(graph.following_key(self.viewer.id)))
+        self.assertFalse(graph.is_following(self.viewer.id, fan.id))
+
+    @mock.patch.object(load_follow_sets, "apply_async")
+    def test_profile_follower_set_loaded_later(self, load_later):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(2):
+                # answered from the database
+                self.assertEqual(
+                    graph.followed_by_count(self.viewer.id, self.star.id), 1
+                )
+        followers = [graph.FOLLOWERS, self.star.id]
+        load_later.assert_called_once_with(([tuple(followers)],),
+                                           retry=False)
+        self.assertFalse(self.loaded(graph.followers_key(self.star.id)))
+
+        load_follow_sets([followers])
+        self.assertTrue(self.loaded(graph.followers_key(self.star.id)))
+        Contact.objects.filter(user_to=self.star).delete()
+        # answered from the loaded sets now
+        self.assertEqual(
+            graph.followed_by_count(self.viewer.id, self.star.id), 1
+        )
+
+    def test_redis_down(self):
+        self.enterContext(use_redis(down_redis()))
+        self.assertTrue(graph.is_following(self.viewer.id, self.fans[0].id))
+        self.assertEqual(graph.mutual_ids(self.star.id), set())
+        self.assertEqual(
+            graph.followed_by_count(self.viewer.id, self.star.id), 1
+        )
@@ -1,19 +1,11 @@
 from django.urls import path, include
 from . import views
-<<<<<<< HEAD
 from django.contrib.auth import views as auth_views
 
-=======
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
 
 urlpatterns = [
     # previous login view
     # path('login/', views.user_login, name='login'),
-<<<<<<< HEAD
-=======
-    # from django.contrib.auth import views as auth_views
-
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
 
     # path('login/', auth_views.LoginView.as_view(), name='login'),
     # path('logout/', auth_views.LogoutView.as_view(), name='logout'),
@@ -27,7 +19,6 @@ urlpatterns = [
     #      name='password_change_done'),
 
     # reset password urls
-<<<<<<< HEAD
     path('password-reset/',
          auth_views.PasswordResetView.as_view(),
          name='password_reset'),
@@ -40,20 +31,6 @@ urlpatterns = [
     path('password-reset/complete/',
          auth_views.PasswordResetCompleteView.as_view(),
          name='password_reset_complete'),
-=======
-    # path('password-reset/',
-    #      auth_views.PasswordResetView.as_view(),
-    #      name='password_reset'),
-    # path('password-reset/done/',
-    #      auth_views.PasswordResetDoneView.as_view(),
-    #      name='password_reset_done'),
-    # path('password-reset/<uidb64>/<token>/',
-    #      auth_views.PasswordResetConfirmView.as_view(),
-    #      name='password_reset_confirm'),
-    # path('password-reset/complete/',
-    #      auth_views.PasswordResetCompleteView.as_view(),
-    #      name='password_reset_complete'),
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
 
     path('', include('django.contrib.auth.urls')),
     # path('', views.dashboard, name='dashboard'),
@@ -69,6 +46,8 @@ urlpatterns = [
          name='not_following_back'),
     path('users/', views.user_list, name='user_list'),
     path('users/follow/', views.user_follow, name='user_follow'),
+    path('users/follow/bulk/', views.user_follow_bulk,
+         name='user_follow_bulk'),
     path('users/<username>/', views.user_detail, name='user_detail'),
     path('upload/', views.upload_story, name='upload_story'),
 
@@ -7,22 +7,24 @@ from django.contrib import messages
 from django.contrib.auth.models import User
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
-<<<<<<< HEAD
-from .forms import LoginForm, UserRegistrationForm, UserEditForm, ProfileEditForm
-=======
 from .forms import LoginForm, UserRegistrationForm, UserEditForm, \
     ProfileEditForm
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
 from .models import Profile
 from .models import Contact
-from actions.utils import create_action
-from actions.models import Action
+from . import graph
+from .follows import follow_users, unfollow_users
+from .search import search_users
+from .suggestions import suggested_user_ids
+from actions.utils import create_action, stream_actions
 from django.core.paginator import Paginator
-from images.models import Image
-from django.template.loader import render_to_string
-from django.db.models import Case, When, BooleanField
+from images.feed import home_page, load_page_images, attach_liked_by_me, \
+    attach_card_context
+from images.cards import render_cards
 from images.models import Story, StoryImage
-import random
+
+
+# most users one bulk follow request may follow or unfollow
+BULK_FOLLOW_LIMIT = 100
 
 
 def user_login(request):
@@ -48,148 +50,47 @@ def user_login(request):
 
 @login_required
 def dashboard(request):
-    # Display all actions by default
-    actions = Action.objects.exclude(user=request.user)
-    following_ids = request.user.following.values_list("id", flat=True)
-    if following_ids:
-        # If user is following others, retrieve only their actions
-        actions = actions.filter(user_id__in=following_ids)
-    actions = actions.select_related("user", "user__profile").prefetch_related(
-        "target"
-    )[:10]
+    actions = stream_actions(request.user)
+    # targets are rendered from Action.target_snapshot
+    actions = actions.select_related("user", "user__profile")[:10]
     return render(
-<<<<<<< HEAD
-        request, "account/dashboard.html", {"section": "dashboard", "actions": actions}
-=======
         request, "account/dashboard.html",
         {"section": "dashboard", "actions": actions}
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
     )
 
 
 @login_required
 def home(request):
     user = request.user
-    page = int(request.GET.get("page", 1))
-<<<<<<< HEAD
-    is_initial_load = page == 1 and request.headers.get("x-requested-with") != "XMLHttpRequest"
-=======
-    show_followed = request.GET.get("followed", "1") == "1"
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
 
     # Get followed users (excluding self)
     followed_users = list(
         user.following.exclude(id=user.id).values_list("id", flat=True)
     )
-<<<<<<< HEAD
-
-    # Session keys for shuffled image IDs
-    session_key = "random_image_ids_combined"
-
-    if is_initial_load or session_key not in request.session:
-        # Followed posts
-        followed_images = list(
-            Image.objects.filter(user__in=followed_users).values_list("id", flat=True)
-        )
-        random.shuffle(followed_images)
 
-        # Suggested posts (not followed and not self)
-        suggested_images = list(
-            Image.objects.exclude(user=user)
-            .exclude(user__in=followed_users)
-            .values_list("id", flat=True)
-        )
-        random.shuffle(suggested_images)
-
-        # Combine followed first, then suggested
-        all_image_ids = followed_images + suggested_images
-        request.session[session_key] = all_image_ids
+    # Followed posts first, then suggested ones. Further pages are loaded
+    # from feed_api with the page's cursor, nothing is stored in the session.
+    page_obj = home_page(user, followed_users)
+    images = load_page_images(page_obj, followed_users)
+    attach_liked_by_me(images, user)
+    render_cards(images, request, attach_card_context)
+
+    # Suggested users for top bar, computed nightly from the follow graph
+    suggested_ids = suggested_user_ids(user.id)
+    if suggested_ids:
+        found = User.objects.select_related("profile").in_bulk(suggested_ids)
+        followed = set(followed_users)
+        suggested_users = [
+            found[i] for i in suggested_ids
+            if i in found and i not in followed
+        ]
     else:
-        all_image_ids = request.session.get(session_key, [])
-
-    # Paginate 5 per scroll
-    paginator = Paginator(all_image_ids, 5)
-=======
-    is_new_user = len(followed_users) == 0
-
-    if is_new_user:
-        show_followed = False
-
-    key = "random_image_ids_followed" if show_followed else "random_image_ids_others"
-    is_initial_load = page == 1 and request.headers.get("x-requested-with") != "XMLHttpRequest"
-
-    # Fresh shuffle on first load or if session key is missing
-    if is_initial_load or key not in request.session:
-        if show_followed:
-            base_queryset = Image.objects.filter(user__in=followed_users)
-            suggested = False
-        else:
-            base_queryset = Image.objects.exclude(user=user).exclude(user__in=followed_users)
-            suggested = True
-
-        all_ids = list(base_queryset.values_list("id", flat=True))
-        random.shuffle(all_ids)
-        request.session[key] = all_ids
-    else:
-        all_ids = request.session.get(key, [])
-        suggested = not show_followed
-
-    # Paginate 5 per scroll
-    paginator = Paginator(all_ids, 5)
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
-    page_obj = paginator.get_page(page)
-    page_id_list = list(page_obj.object_list)
-
-    # Fetch and annotate image objects
-    images = (
-        Image.objects.filter(id__in=page_id_list, user__isnull=False)
-        .select_related("user", "user__profile")
-        .annotate(
-            is_following=Case(
-                When(user__in=followed_users, then=True),
-                default=False,
-                output_field=BooleanField(),
-            )
-        )
-    )
-
-    # Maintain shuffled order
-    images_dict = {img.id: img for img in images}
-    images = [images_dict[img_id] for img_id in page_id_list if img_id in images_dict]
-
-<<<<<<< HEAD
-    # AJAX response for infinite scroll
-    if request.headers.get("x-requested-with") == "XMLHttpRequest":
-        html = render_to_string(
-            "images/image/list_images.html",
-            {"page_obj": page_obj, "images": images, "suggested": False},
-=======
-    # AJAX infinite scroll response
-    if request.headers.get("x-requested-with") == "XMLHttpRequest":
-        html = render_to_string(
-            "images/image/list_images.html",
-            {"page_obj": page_obj, "images": images, "suggested": suggested},
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
-            request=request,
+        # new users have no suggestions until the next run
+        suggested_users = (
+            User.objects.exclude(id=user.id)
+            .exclude(id__in=followed_users)
+            .select_related("profile")[:100]
         )
-        return JsonResponse({
-            "html": html,
-            "has_more": page_obj.has_next(),
-<<<<<<< HEAD
-        })
-
-    # Suggested users for top bar
-=======
-            "next_followed": "1" if show_followed else "0",
-        })
-
-    # Suggested users for sidebar or top bar
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
-    suggested_users = (
-        User.objects.exclude(id=user.id)
-        .exclude(id__in=followed_users)
-        .select_related("profile")[:100]
-    )
 
     return render(
         request,
@@ -198,19 +99,11 @@ def home(request):
             "page_obj": page_obj,
             "images": images,
             "suggested_users": suggested_users,
-<<<<<<< HEAD
             "suggested": False,
-=======
-            "suggested": suggested,
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
         },
     )
 
 
-<<<<<<< HEAD
-
-=======
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
 def register(request):
     if request.method == "POST":
         user_form = UserRegistrationForm(request.POST)
@@ -221,8 +114,8 @@ def register(request):
             new_user.set_password(user_form.cleaned_data["password"])
             # Save the User object
             new_user.save()
-            # Create the user profile
-            Profile.objects.create(user=new_user)
+            # The profile is created by a post_save signal
+            Profile.objects.get_or_create(user=new_user)
             create_action(new_user, "has created an account")
             Contact.objects.get_or_create(user_from=new_user, user_to=new_user)
             return redirect("my_profile")
@@ -262,7 +155,6 @@ def user_list(request):
     ajax = request.GET.get("ajax")
     users = []
     searched = False
-<<<<<<< HEAD
     error = None
     suggestions = []
 
@@ -275,43 +167,20 @@ def user_list(request):
 
     if query:
         searched = True
-        try:
-            # Try exact match first
-            user = User.objects.get(username__iexact=query)
-            users = [user]
-        except User.DoesNotExist:
-            error = "User not found"
-            # Fuzzy match for similar usernames
-            suggestions = list(
-                User.objects.filter(username__icontains=query)
-                .exclude(username__iexact=query)
-                .order_by("username")[:10]
+        # exact match first, then prefix and substring matches
+        results = search_users(query)
+        if ajax:
+            return JsonResponse(
+                [{"username": u.username} for u in results],
+                safe=False
             )
-
-    # AJAX response: return exact or suggested users
-    if ajax:
-        results = users if users else suggestions
-        return JsonResponse(
-            [{"username": u.username} for u in results],
-            safe=False
-        )
-=======
-
-    if query is not None:
-        query = query.strip()
-        searched = True
-        if query:
-            try:
-                user = User.objects.get(username__iexact=query)
-                users = [user]
-            except User.DoesNotExist:
-                users = []
+        if results and results[0].username.lower() == query.lower():
+            users = results[:1]
         else:
-            users = []  # Empty input still counts as "searched"
-
-    if ajax:
-        return JsonResponse([{"username": u.username} for u in users], safe=False)
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
+            error = "User not found"
+            suggestions = results
+    elif ajax:
+        return JsonResponse([], safe=False)
 
     return render(
         request,
@@ -320,20 +189,27 @@ def user_list(request):
             "users": users,
             "query": query,
             "searched": searched,
-<<<<<<< HEAD
             "error": error,
             "suggestions": suggestions,
-=======
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
         },
     )
 
 
 @login_required
 def user_detail(request, username):
-    user = get_object_or_404(User, username=username, is_active=True)
+    user = get_object_or_404(
+        User.objects.select_related("profile"),
+        username=username, is_active=True,
+    )
     return render(
-        request, "account/user/detail.html", {"section": "people", "user": user}
+        request, "account/user/detail.html",
+        {
+            "section": "people",
+            "user": user,
+            "is_following": graph.is_following(request.user.id, user.id),
+            "followed_by_count": graph.followed_by_count(request.user.id,
+                                                         user.id),
+        }
     )
 
 
@@ -349,90 +225,92 @@ def my_profile(request):
 def user_follow(request):
     user_id = request.POST.get("id")
     action = request.POST.get("action")
-    if user_id and action:
-        try:
-            user = User.objects.get(id=user_id)
-            if action == "follow":
-                Contact.objects.get_or_create(user_from=request.user, user_to=user)
-                create_action(request.user, "is following", user)
-            else:
-                # Prevent users from unfollowing themselves
-                if user != request.user:
-                    Contact.objects.filter(
-                        user_from=request.user, user_to=user
-                    ).delete()
-
-            # Always ensure self-follow
-            Contact.objects.get_or_create(user_from=request.user, user_to=request.user)
-
+    if user_id and user_id.isdigit() and action:
+        user_id = int(user_id)
+        if user_id == request.user.id:
+            # nothing to do, users always follow themselves
+            return JsonResponse({"status": "ok"})
+        if action == "follow":
+            states = follow_users(request.user, [user_id])
+        else:
+            states = unfollow_users(request.user, [user_id])
+        if user_id in states:
             return JsonResponse({"status": "ok"})
-        except User.DoesNotExist:
-            return JsonResponse({"status": "error"})
     return JsonResponse({"status": "error"})
 
 
+@require_POST
 @login_required
-def user_followers(request, username):
-    user = get_object_or_404(User, username=username, is_active=True)
-    followers = user.followers.all()  # This is a QuerySet of User instances
+def user_follow_bulk(request):
+    """
+    Follow or unfollow every user in the `ids` list at once. Responds with
+    the resulting state of each id: "following", "not_following", or
+    "not_found" for ids that are not active users.
+    """
+    action = request.POST.get("action")
+    ids = request.POST.getlist("ids")
+    if (action not in ("follow", "unfollow") or not ids
+            or len(ids) > BULK_FOLLOW_LIMIT
+            or not all(i.isdigit() for i in ids)):
+        return JsonResponse({"status": "error"})
+    ids = [int(i) for i in ids]
+    if action == "follow":
+        states = follow_users(request.user, ids)
+    else:
+        states = unfollow_users(request.user, ids)
+    # users always follow themselves
+    states[request.user.id] = True
+    return JsonResponse({
+        "status": "ok",
+        "users": {
+            i: ("not_found" if i not in states
+                else "following" if states[i] else "not_following")
+            for i in ids
+        },
+    })
 
-    paginator = Paginator(followers, 10)  # Show 10 users per page
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
 
+def follow_list(request, people, section, title):
+    paginator = Paginator(people.select_related("profile"), 10)
+    page_obj = paginator.get_page(request.GET.get("page"))
+    # one set lookup for the follow buttons of the whole page
+    followed_ids = graph.following_among(
+        request.user.id, [person.id for person in page_obj]
+    )
     return render(
         request,
         "account/user/follow_list.html",
         {
-            "section": "followers",
-            "title": f"{user.username}'s followers",
+            "section": section,
+            "title": title,
             "people": page_obj,
+            "followed_ids": followed_ids,
         },
     )
 
 
 @login_required
-def user_following(request, username):
+def user_followers(request, username):
     user = get_object_or_404(User, username=username, is_active=True)
-    following = user.following.all()  # This is a QuerySet of User instances
+    return follow_list(request, user.followers.all(), "followers",
+                       f"{user.username}'s followers")
 
-    paginator = Paginator(following, 10)  # Show 10 users per page
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
 
-    return render(
-        request,
-        "account/user/follow_list.html",
-        {
-            "section": "following",
-            "title": f"{user.username} is following",
-            "people": page_obj,
-        },
-    )
+@login_required
+def user_following(request, username):
+    user = get_object_or_404(User, username=username, is_active=True)
+    return follow_list(request, user.following.all(), "following",
+                       f"{user.username} is following")
 
 
 @login_required
 def not_following_back(request):
-    user = request.user
-    following = user.following.all()  # People I follow
-    followers = user.followers.all()  # People who follow me
-
     # Users I follow who do not follow me back
-    non_mutual = following.exclude(id__in=followers.values_list("id", flat=True))
-
-    paginator = Paginator(non_mutual, 10)  # Add pagination
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
-
-    return render(
-        request,
-        "account/user/follow_list.html",
-        {
-            "section": "not_following_back",
-            "title": "You're following but not followed back",
-            "people": page_obj,
-        },
-    )
+    non_mutual = User.objects.filter(
+        id__in=graph.not_following_back_ids(request.user.id)
+    ).order_by("username")
+    return follow_list(request, non_mutual, "not_following_back",
+                       "You're following but not followed back")
 
 
 @login_required
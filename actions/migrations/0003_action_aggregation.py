@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actions', '0002_action_target_snapshot'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='actor_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='bucket',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='action',
+            constraint=models.UniqueConstraint(condition=models.Q(('bucket__isnull', False)), fields=('verb', 'target_ct', 'target_id', 'bucket'), name='unique_action_bucket'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_actors(apps, schema_editor):
+    Action = apps.get_model("actions", "Action")
+    ActionActor = apps.get_model("actions", "ActionActor")
+    # only the capped actor_ids list is known for existing rows
+    aggregates = Action.objects.filter(bucket__isnull=False)
+    for action_id, actor_ids in aggregates.values_list("id", "actor_ids"):
+        ActionActor.objects.bulk_create([
+            ActionActor(action_id=action_id, user_id=user_id)
+            for user_id in actor_ids
+        ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actions', '0003_action_aggregation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActionActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actors', to='actions.action')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('action', 'user'), name='unique_action_actor')],
+            },
+        ),
+        migrations.RunPython(backfill_actors, migrations.RunPython.noop),
+    ]
@@ -18,10 +18,44 @@ class Action(models.Model):
     )
     target_id = models.PositiveIntegerField(null=True, blank=True)
     target = GenericForeignKey("target_ct", "target_id")
+    # see actions/snapshots.py
+    target_snapshot = models.JSONField(default=dict, blank=True)
+    # Verbs in ACTION_AGGREGATION_WINDOWS fold every actor on the same
+    # target within a time bucket into one row: `user` is the latest
+    # actor and actor_ids the most recent ones, newest first. Every actor
+    # of the row has an ActionActor, actor_count is how many there are.
+    bucket = models.DateTimeField(null=True, blank=True)
+    actor_count = models.PositiveIntegerField(default=1)
+    actor_ids = models.JSONField(default=list, blank=True)
 
     class Meta:
         indexes = [
             models.Index(fields=["-created"]),
             models.Index(fields=["target_ct", "target_id"]),
+            models.Index(fields=["user", "-created"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["verb", "target_ct", "target_id", "bucket"],
+                condition=models.Q(bucket__isnull=False),
+                name="unique_action_bucket",
+            ),
         ]
         ordering = ["-created"]
+
+
+class ActionActor(models.Model):
+    """One of the users folded into an aggregate action"""
+    action = models.ForeignKey(
+        Action, related_name="actors", on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(
+        "auth.User", related_name="+", on_delete=models.CASCADE
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["action", "user"], name="unique_action_actor"
+            ),
+        ]
@@ -0,0 +1,132 @@
+"""
+Keeping the Action table small.
+
+collapse_superseded() removes actions that no longer describe anything:
+likes that were taken back, follows that were undone, and older copies
+of an action repeated on the same target. archive_old_actions() moves
+actions older than ACTION_RETENTION_DAYS out of the table, appending
+them to gzip-compressed JSON Lines files in ACTION_ARCHIVE_DIR (or just
+deleting them if it is None). Both work in small chunks so they never
+hold long locks on the table.
+"""
+import gzip
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from account.models import Contact
+from images.models import Image
+from .models import Action
+
+
+BATCH_SIZE = 1000
+ARCHIVE_FIELDS = ("id", "user_id", "verb", "created", "target_ct_id",
+                  "target_id", "target_snapshot", "bucket", "actor_count",
+                  "actor_ids")
+
+
+def _delete_in_batches(queryset, batch_size):
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Action.objects.filter(id__in=ids).delete()[0]
+
+
+def superseded_actions():
+    """Actions whose like or follow is gone, or that were repeated later"""
+    image_ct = ContentType.objects.get_for_model(Image)
+    user_ct = ContentType.objects.get_for_model(User)
+    Like = Image.users_like.through
+    # aggregate rows stand for many actors and are left alone
+    single = Action.objects.filter(bucket__isnull=True)
+    unliked = single.filter(
+        verb="likes", target_ct=image_ct
+    ).exclude(
+        Exists(Like.objects.filter(image_id=OuterRef("target_id"),
+                                   user_id=OuterRef("user_id")))
+    )
+    unfollowed = single.filter(
+        verb="is following", target_ct=user_ct
+    ).exclude(
+        Exists(Contact.objects.filter(user_from_id=OuterRef("user_id"),
+                                      user_to_id=OuterRef("target_id")))
+    )
+    repeated = single.filter(
+        target_ct__isnull=False
+    ).filter(
+        Exists(single.filter(
+            user_id=OuterRef("user_id"),
+            verb=OuterRef("verb"),
+            target_ct_id=OuterRef("target_ct_id"),
+            target_id=OuterRef("target_id"),
+            id__gt=OuterRef("id"),
+        ))
+    )
+    return [unliked, unfollowed, repeated]
+
+
+def collapse_superseded(batch_size=BATCH_SIZE):
+    """Delete superseded actions, returning how many were removed"""
+    return sum(
+        _delete_in_batches(queryset, batch_size)
+        for queryset in superseded_actions()
+    )
+
+
+def _fsync_dir(path):
+    """Persist a new file's directory entry"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def archive_old_actions(batch_size=BATCH_SIZE, now=None):
+    """
+    Archive and delete actions older than ACTION_RETENTION_DAYS, returning
+    how many were removed. Each run writes its own archive file.
+    """
+    now = now or timezone.now()
+    old = Action.objects.filter(
+        created__lt=now - timedelta(days=settings.ACTION_RETENTION_DAYS)
+    ).order_by("id")
+    if settings.ACTION_ARCHIVE_DIR is None:
+        return _delete_in_batches(old, batch_size)
+
+    archive_dir = Path(settings.ACTION_ARCHIVE_DIR)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"actions-{now:%Y%m%d-%H%M%S}.jsonl.gz"
+    archived = 0
+    archive = None
+    try:
+        while True:
+            rows = list(old.values(*ARCHIVE_FIELDS)[:batch_size])
+            if not rows:
+                return archived
+            if archive is None:
+                archive = gzip.open(path, "at", encoding="utf-8")
+                _fsync_dir(archive_dir)
+            for row in rows:
+                archive.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
+            # rows are only deleted once they are on disk: flush() ends the
+            # compressed block, fsync() waits for the disk to have it
+            archive.flush()
+            os.fsync(archive.fileno())
+            with transaction.atomic():
+                Action.objects.filter(
+                    id__in=[row["id"] for row in rows]
+                ).delete()
+            archived += len(rows)
+    finally:
+        if archive is not None:
+            archive.close()
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from account.models import Profile
+from bookmarks.celery import delay_on_commit
+from images.models import Image
+from .tasks import refresh_action_snapshots, refresh_user_action_snapshots
+
+
+def _refresh(model, target_id):
+    ct_id = ContentType.objects.get_for_model(model).id
+    delay_on_commit(refresh_action_snapshots, ct_id, [target_id])
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, created, **kwargs):
+    if not created:
+        _refresh(Image, instance.id)
+
+
+@receiver(post_delete, sender=Image)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def target_deleted(sender, instance, **kwargs):
+    _refresh(sender, instance.id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # logging in only touches last_login, which snapshots do not show
+    if created or (update_fields and set(update_fields) <= {"last_login"}):
+        return
+    delay_on_commit(refresh_user_action_snapshots, instance.id)
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, **kwargs):
+    _refresh(User, instance.user_id)
@@ -0,0 +1,109 @@
+"""
+Compact copies of action targets, stored on Action.target_snapshot so the
+activity stream renders without loading the targets:
+
+    {"title": ..., "url": ..., "thumbnail": ..., "username": ...}
+
+username is the target's owner (the user itself for follows). Snapshots
+are refreshed in the background when a target changes, see signals.py.
+Actions created during a request do not wait for a thumbnail to be made,
+see lazy_snapshot().
+"""
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from easy_thumbnails.exceptions import InvalidImageFormatError
+from easy_thumbnails.files import get_thumbnailer
+from bookmarks.celery import delay_on_commit
+from .models import Action
+
+
+THUMBNAIL_OPTIONS = {"size": (80, 80), "crop": "100%"}
+
+
+def _source(target):
+    """The image field a target's thumbnail is made from"""
+    if isinstance(target, User):
+        profile = getattr(target, "profile", None)
+        return profile.photo if profile else None
+    return getattr(target, "image", None)
+
+
+def _thumbnail(field, generate=True):
+    if not field:
+        return None
+    try:
+        thumbnail = get_thumbnailer(field).get_thumbnail(THUMBNAIL_OPTIONS,
+                                                         generate=generate)
+    except (InvalidImageFormatError, OSError):
+        return None
+    return thumbnail.url if thumbnail else None
+
+
+def target_snapshot(target, generate=True):
+    """
+    Return the snapshot of an action target, {} for no target. With
+    generate=False a thumbnail that does not exist yet is left out.
+    """
+    if target is None:
+        return {}
+    thumbnail = _thumbnail(_source(target), generate)
+    if isinstance(target, User):
+        return {
+            "title": target.username,
+            "url": str(target.get_absolute_url()),
+            "thumbnail": thumbnail,
+            "username": target.username,
+        }
+    owner = getattr(target, "user", None)
+    return {
+        "title": str(target),
+        "url": target.get_absolute_url(),
+        "thumbnail": thumbnail,
+        "username": owner.username if owner else None,
+    }
+
+
+def lazy_snapshot(target):
+    """
+    Snapshot a target without making its thumbnail. A missing thumbnail
+    is made by refresh_action_snapshots once the action is committed.
+    """
+    # tasks.py imports this module
+    from .tasks import refresh_action_snapshots
+
+    snapshot = target_snapshot(target, generate=False)
+    if target is not None and snapshot["thumbnail"] is None \
+            and _source(target):
+        target_ct = ContentType.objects.get_for_model(target)
+        delay_on_commit(refresh_action_snapshots, target_ct.id, [target.id])
+    return snapshot
+
+
+def load_snapshots(target_ct, target_ids):
+    """Return {target id: snapshot} for the existing targets of a type"""
+    model = target_ct.model_class()
+    queryset = model.objects.all()
+    if model is User:
+        queryset = queryset.select_related("profile")
+    elif any(f.name == "user" for f in model._meta.get_fields()):
+        queryset = queryset.select_related("user")
+    return {
+        target_id: target_snapshot(target)
+        for target_id, target in queryset.in_bulk(target_ids).items()
+    }
+
+
+def refresh_snapshots(target_ct, target_ids):
+    """
+    Rewrite the snapshots of actions on the given targets, and delete the
+    actions whose target no longer exists. Returns actions updated.
+    """
+    snapshots = load_snapshots(target_ct, target_ids)
+    actions = Action.objects.filter(target_ct=target_ct)
+    actions.filter(target_id__in=set(target_ids) - snapshots.keys()).delete()
+    updated = 0
+    for target_id, snapshot in snapshots.items():
+        updated += actions.filter(target_id=target_id).update(
+            target_snapshot=snapshot
+        )
+    return updated
@@ -0,0 +1,65 @@
+from celery import shared_task
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from images.models import Image
+from .models import Action
+from .retention import archive_old_actions, collapse_superseded
+from .snapshots import refresh_snapshots
+from .utils import flush_actions as flush
+
+
+@shared_task
+def flush_actions():
+    written = flush()
+    return f"{written} queued actions written."
+
+
+@shared_task(ignore_result=True)
+def refresh_action_snapshots(target_ct_id, target_ids):
+    target_ct = ContentType.objects.get_for_id(target_ct_id)
+    updated = refresh_snapshots(target_ct, target_ids)
+    return f"{updated} action snapshots refreshed."
+
+
+@shared_task(ignore_result=True)
+def refresh_user_action_snapshots(user_id):
+    """A user's snapshots and those of their images show their username"""
+    updated = refresh_snapshots(ContentType.objects.get_for_model(User),
+                                [user_id])
+    image_ct = ContentType.objects.get_for_model(Image)
+    image_ids = list(
+        Action.objects.filter(
+            target_ct=image_ct,
+            target_id__in=Image.objects.filter(user_id=user_id).values("id"),
+        ).values_list("target_id", flat=True).distinct()
+    )
+    if image_ids:
+        updated += refresh_snapshots(image_ct, image_ids)
+    return f"{updated} action snapshots refreshed."
+
+
+@shared_task
+def backfill_action_snapshots(batch_size=1000):
+    """Snapshot the targets of actions created before snapshots existed"""
+    updated = 0
+    while True:
+        missing = list(
+            Action.objects.filter(target_snapshot={}, target_ct__isnull=False)
+            .values_list("target_ct_id", "target_id")[:batch_size]
+        )
+        if not missing:
+            return f"{updated} action snapshots backfilled."
+        targets = {}
+        for target_ct_id, target_id in missing:
+            targets.setdefault(target_ct_id, set()).add(target_id)
+        for target_ct_id, target_ids in targets.items():
+            updated += refresh_snapshots(
+                ContentType.objects.get_for_id(target_ct_id), target_ids
+            )
+
+
+@shared_task
+def apply_action_retention():
+    collapsed = collapse_superseded()
+    archived = archive_old_actions()
+    return f"{collapsed} superseded and {archived} old actions removed."
@@ -1,3 +1,195 @@
-from django.test import TestCase
+from datetime import timedelta
+import gzip
+from io import BytesIO
+import json
+from pathlib import Path
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image as PILImage
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from account.models import Contact
+from bookmarks.tests import MemoryRedisTestCase, down_redis, use_redis
+from images.models import Image
+from . import retention
+from .models import Action
+from .tasks import refresh_action_snapshots
+from .utils import (
+    create_action, flush_actions, save_actions, stream_actions,
+)
 
-# Create your tests here.
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SnapshotTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="user")
+        photo = BytesIO()
+        PILImage.new("RGB", (100, 100)).save(photo, "PNG")
+        cls.image = Image.objects.create(
+            user=cls.user, title="Photo",
+            image=ContentFile(photo.getvalue(), "photo.png"),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @mock.patch.object(refresh_action_snapshots, "apply_async")
+    def test_thumbnail_made_after_commit(self, refresh):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(create_action(self.user, "likes", self.image))
+        action = Action.objects.get()
+        self.assertIsNone(action.target_snapshot["thumbnail"])
+        refresh.assert_not_called()
+
+        image_ct = ContentType.objects.get_for_model(Image)
+        for callback in callbacks:
+            callback()
+        refresh.assert_called_once_with((image_ct.id, [self.image.id]),
+                                        retry=False)
+        refresh_action_snapshots(image_ct.id, [self.image.id])
+        action.refresh_from_db()
+        self.assertTrue(action.target_snapshot["thumbnail"])
+
+
+class DeduplicationTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="user")
+        cls.images = [
+            Image.objects.create(user=cls.user, title=f"Image {i}")
+            for i in range(2)
+        ]
+
+    def create(self, image):
+        with CaptureQueriesContext(connection) as queries:
+            created = create_action(self.user, "bookmarked image", image)
+        self.assertFalse([
+            query["sql"] for query in queries.captured_queries
+            if query["sql"].startswith("SELECT")
+            and "actions_action" in query["sql"]
+        ])
+        return created
+
+    def test_similar_actions_skipped(self):
+        first, second = self.images
+        self.assertTrue(self.create(first))
+        self.assertFalse(self.create(first))
+        self.assertTrue(self.create(second))
+        self.assertEqual(Action.objects.count(), 2)
+
+    def test_database_check_while_redis_is_down(self):
+        self.enterContext(use_redis(down_redis()))
+        first, second = self.images
+        self.assertTrue(create_action(self.user, "bookmarked image", first))
+        self.assertFalse(create_action(self.user, "bookmarked image", first))
+        self.assertTrue(create_action(self.user, "bookmarked image", second))
+        self.assertEqual(Action.objects.count(), 2)
+
+    @override_settings(ACTIONS_WRITE_BEHIND=True)
+    def test_write_behind(self):
+        first, second = self.images
+        ContentType.objects.get_for_model(Image)
+        with self.assertNumQueries(0):
+            self.assertTrue(create_action(self.user, "bookmarked image",
+                                          first))
+            self.assertFalse(create_action(self.user, "bookmarked image",
+                                           first))
+        self.assertTrue(create_action(self.user, "bookmarked image", second))
+        second.delete()
+        self.assertFalse(Action.objects.exists())
+        # the deleted image's action is dropped
+        self.assertEqual(flush_actions(), 2)
+        action = Action.objects.get()
+        self.assertEqual((action.target, action.target_snapshot["title"]),
+                         (first, "Image 0"))
+
+
+@override_settings(ACTION_AGGREGATE_ACTORS=1)
+class AggregationTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, cls.author, *cls.actors = [
+            User.objects.create(username=f"user{i}") for i in range(5)
+        ]
+        Contact.objects.create(user_from=cls.viewer, user_to=cls.actors[0])
+        cls.image = Image.objects.create(user=cls.author, title="Post")
+
+    def like(self, *users):
+        for user in users:
+            save_actions([Action(user=user, verb="likes", target=self.image)])
+
+    def test_actors_counted_once(self):
+        first, second, third = self.actors
+        self.like(first, second, third, first, second)
+        action = Action.objects.get()
+        self.assertEqual(action.actor_count, 3)
+        self.assertEqual(action.actor_ids, [third.id])
+        self.assertEqual(action.actors.count(), 3)
+
+    def test_followed_actor_in_stream(self):
+        first, second, third = self.actors
+        self.like(first, second)
+        [action] = stream_actions(self.viewer)
+        self.assertEqual(action.user, second)
+        self.assertEqual(action.actor_count, 2)
+
+        # nobody the viewer follows is in the bucket
+        Contact.objects.filter(user_from=self.viewer).update(user_to=third)
+        self.assertQuerySetEqual(stream_actions(self.viewer), [])
+        # the latest actor's own stream still shows the others
+        self.assertQuerySetEqual(stream_actions(second), [action])
+
+
+class ArchiveTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="user")
+        cls.actions = Action.objects.bulk_create([
+            Action(user=cls.user, verb=f"verb {i}") for i in range(5)
+        ])
+        Action.objects.filter(id__in=[a.id for a in cls.actions[:3]]).update(
+            created=timezone.now() - timedelta(days=100)
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.archive_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.archive_dir, ignore_errors=True)
+        self.enterContext(override_settings(ACTION_RETENTION_DAYS=90,
+                                            ACTION_ARCHIVE_DIR=self.archive_dir))
+
+    def test_archive_then_delete(self):
+        fsync = self.enterContext(mock.patch.object(
+            retention.os, "fsync", wraps=retention.os.fsync
+        ))
+        self.assertEqual(retention.archive_old_actions(batch_size=2), 3)
+        # the directory, then once per batch before its delete
+        self.assertEqual(fsync.call_count, 3)
+        [path] = self.archive_dir.iterdir()
+        with gzip.open(path, "rt", encoding="utf-8") as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual([row["verb"] for row in rows],
+                         ["verb 0", "verb 1", "verb 2"])
+        self.assertQuerySetEqual(
+            Action.objects.order_by("id").values_list("verb", flat=True),
+            ["verb 3", "verb 4"],
+        )
+
+    def test_failed_write_keeps_rows(self):
+        self.enterContext(mock.patch.object(retention.os, "fsync",
+                                            side_effect=OSError("disk full")))
+        with self.assertRaises(OSError):
+            retention.archive_old_actions()
+        self.assertEqual(Action.objects.count(), 5)
@@ -1,24 +1,210 @@
+from collections import defaultdict
 import datetime
+import json
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Q
 from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
-from .models import Action
+from bookmarks.redis_client import (
+    UNAVAILABLE, r, background_r, execute_or_buffer,
+)
+from .models import Action, ActionActor
+from .snapshots import lazy_snapshot, load_snapshots
+
+
+QUEUE_KEY = "actions:queue"
+FLUSH_BATCH_SIZE = 500
 
 
 def create_action(user, verb, target=None):
-    # check for any similar action made in the last minute
-    now = timezone.now()
-    last_minute = now - datetime.timedelta(seconds=60)
+    target_ct = ContentType.objects.get_for_model(target) if target else None
+    # skip similar actions made in the last minute
+    key = "action:{}:{}:{}:{}".format(
+        user.id, verb,
+        target_ct.id if target_ct else "",
+        target.id if target else "",
+    )
+    try:
+        if not r.set(key, 1, nx=True, ex=60):
+            return False
+    except UNAVAILABLE:
+        return _create_unless_recent(user, verb, target, target_ct)
+
+    if settings.ACTIONS_WRITE_BEHIND:
+        # inserted in bulk by flush_actions
+        payload = json.dumps({
+            "user": user.id,
+            "verb": verb,
+            "target_ct": target_ct.id if target_ct else None,
+            "target_id": target.id if target else None,
+        })
+        execute_or_buffer(r, lambda pipe: pipe.rpush(QUEUE_KEY, payload))
+    else:
+        save_actions([Action(user=user, verb=verb, target=target,
+                             target_snapshot=lazy_snapshot(target))])
+    return True
+
+
+def _create_unless_recent(user, verb, target, target_ct):
+    """The database check used while Redis is unavailable"""
+    last_minute = timezone.now() - datetime.timedelta(seconds=60)
     similar_actions = Action.objects.filter(
         user_id=user.id, verb=verb, created__gte=last_minute
     )
     if target:
-        target_ct = ContentType.objects.get_for_model(target)
         similar_actions = similar_actions.filter(
             target_ct=target_ct, target_id=target.id
         )
-    if not similar_actions:
-        # no existing actions found
-        action = Action(user=user, verb=verb, target=target)
-        action.save()
-        return True
-    return False
+    if similar_actions.exists():
+        return False
+    save_actions([Action(user=user, verb=verb, target=target,
+                         target_snapshot=lazy_snapshot(target))])
+    return True
+
+
+def stream_actions(user):
+    """
+    The actions shown in a user's activity stream: those of the users they
+    follow, or everyone else's if they follow nobody. Aggregate rows name
+    their latest actor and are shown if any of their actors qualifies.
+    """
+    actions = Action.objects.exclude(user=user, actor_count=1)
+    following_ids = list(
+        user.following.exclude(id=user.id).values_list("id", flat=True)
+    )
+    if following_ids:
+        actions = actions.filter(
+            Q(user_id__in=following_ids) | Exists(ActionActor.objects.filter(
+                action=OuterRef("pk"), user_id__in=following_ids
+            ))
+        )
+    return actions
+
+
+def bucket_start(now, window):
+    """Start of the `window`-second aggregation bucket containing `now`"""
+    seconds = int(now.timestamp()) // window * window
+    return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+
+
+def save_actions(actions):
+    """
+    Save new, unsaved actions, oldest first. Actions with a target and a
+    verb in ACTION_AGGREGATION_WINDOWS are folded into their bucket's
+    aggregate row, the others are inserted with one bulk query.
+    """
+    now = timezone.now()
+    windows = settings.ACTION_AGGREGATION_WINDOWS
+    plain = []
+    groups = defaultdict(list)
+    for action in actions:
+        if action.verb in windows and action.target_id is not None:
+            bucket = bucket_start(now, windows[action.verb])
+            groups[action.verb, action.target_ct_id, action.target_id,
+                   bucket].append(action)
+        else:
+            plain.append(action)
+    Action.objects.bulk_create(plain)
+    for key, grouped in groups.items():
+        _aggregate(key, grouped)
+
+
+def _aggregate(key, actions):
+    verb, target_ct_id, target_id, bucket = key
+    limit = settings.ACTION_AGGREGATE_ACTORS
+    # newest first, each actor once
+    actor_ids = list(dict.fromkeys(
+        action.user_id for action in reversed(actions)
+    ))
+    latest = actions[-1]
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                aggregate = Action.objects.select_for_update().filter(
+                    verb=verb, target_ct_id=target_ct_id,
+                    target_id=target_id, bucket=bucket,
+                ).first()
+                if aggregate is None:
+                    latest.bucket = bucket
+                    latest.actor_ids = actor_ids[:limit]
+                    latest.actor_count = len(actor_ids)
+                    latest.save()
+                    _add_actors(latest.pk, actor_ids)
+                    return
+                # every actor of the row, also those off the capped list
+                known = set(
+                    aggregate.actors.filter(user_id__in=actor_ids)
+                    .values_list("user_id", flat=True)
+                )
+                new_ids = [i for i in actor_ids if i not in known]
+                if not new_ids:
+                    return
+                _add_actors(aggregate.pk, new_ids)
+                Action.objects.filter(pk=aggregate.pk).update(
+                    user_id=latest.user_id,
+                    created=timezone.now(),
+                    actor_count=F("actor_count") + len(new_ids),
+                    actor_ids=(new_ids + aggregate.actor_ids)[:limit],
+                    target_snapshot=latest.target_snapshot,
+                )
+                return
+        except IntegrityError:
+            if attempt:
+                raise
+            # another writer created the bucket's row or added one of the
+            # actors first, fold into it
+
+
+def _add_actors(action_id, user_ids):
+    ActionActor.objects.bulk_create([
+        ActionActor(action_id=action_id, user_id=user_id)
+        for user_id in user_ids
+    ])
+
+
+def flush_actions():
+    """
+    Insert queued actions in batches, returning how many were written.
+    Their created time is the time of the flush, a few seconds late.
+    """
+    written = 0
+    while True:
+        payloads = background_r.lpop(QUEUE_KEY, FLUSH_BATCH_SIZE)
+        if not payloads:
+            return written
+        try:
+            save_actions(_build_actions(payloads))
+        except Exception:
+            # back to the front of the queue for the next run
+            background_r.lpush(QUEUE_KEY, *reversed(payloads))
+            raise
+        written += len(payloads)
+
+
+def _build_actions(payloads):
+    """Queued actions with their target snapshots, skipping lost targets"""
+    queued = [json.loads(payload) for payload in payloads]
+    target_ids = defaultdict(set)
+    for data in queued:
+        if data["target_ct"]:
+            target_ids[data["target_ct"]].add(data["target_id"])
+    snapshots = {
+        ct_id: load_snapshots(ContentType.objects.get_for_id(ct_id), ids)
+        for ct_id, ids in target_ids.items()
+    }
+    actions = []
+    for data in queued:
+        snapshot = {}
+        if data["target_ct"]:
+            snapshot = snapshots[data["target_ct"]].get(data["target_id"])
+            if snapshot is None:
+                continue
+        actions.append(Action(
+            user_id=data["user"],
+            verb=data["verb"],
+            target_ct_id=data["target_ct"],
+            target_id=data["target_id"],
+            target_snapshot=snapshot,
+        ))
+    return actions
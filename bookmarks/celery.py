@@ -1,6 +1,8 @@
+import logging
 import os
 from celery import Celery
 from celery.schedules import crontab
+from django.db import transaction
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "your_project.settings")
 
@@ -10,9 +12,56 @@ app.autodiscover_tasks()
 
 app.conf.timezone = 'Africa/Nairobi'
 
+logger = logging.getLogger(__name__)
+
 app.conf.beat_schedule = {
     'delete-expired-stories-every-hour': {
         'task': 'stories.tasks.delete_expired_stories',
         'schedule': crontab(minute=0, hour='*'),
     },
+    'flush-pending-likes': {
+        'task': 'images.tasks.flush_pending_likes',
+        'schedule': 10.0,
+    },
+    'flush-image-views': {
+        'task': 'images.tasks.flush_image_views',
+        'schedule': 30.0,
+    },
+    'refresh-leaderboards': {
+        'task': 'images.tasks.refresh_leaderboards',
+        'schedule': 60.0,
+    },
+    'flush-actions': {
+        'task': 'actions.tasks.flush_actions',
+        'schedule': 5.0,
+    },
+    'apply-action-retention-daily': {
+        'task': 'actions.tasks.apply_action_retention',
+        'schedule': crontab(minute=30, hour=3),
+    },
+    'rollup-unique-viewers-daily': {
+        'task': 'images.tasks.rollup_unique_viewers',
+        'schedule': crontab(minute=15, hour=0),
+    },
+    'compute-user-suggestions-daily': {
+        'task': 'account.tasks.compute_suggestions',
+        'schedule': crontab(minute=0, hour=4),
+    },
 }
+
+
+def delay_on_commit(task, *args):
+    """
+    Queue task(*args) once the current transaction commits. It is published
+    once, without retries, and the broker settings give up on a connection
+    after a second, so a broker outage costs a request about that long.
+    Failing to queue the task is logged instead of failing the request.
+    Tasks queued this way set ignore_result, publishing them does not touch
+    the result backend.
+    """
+    def enqueue():
+        try:
+            task.apply_async(args, retry=False)
+        except Exception:
+            logger.exception("Could not queue %s%r", task.name, args)
+    transaction.on_commit(enqueue)
@@ -0,0 +1,251 @@
+"""
+Shared Redis access for views, signals and tasks.
+
+Import `r` for request-path work and `background_r` for Celery tasks.
+Each has its own bounded connection pool and circuit, and fails fast
+instead of hanging when Redis is slow or down:
+
+- every command has REDIS_SOCKET_TIMEOUT (REDIS_BACKGROUND_SOCKET_TIMEOUT
+  for background work) and waits at most REDIS_POOL_TIMEOUT for a free
+  connection;
+- after REDIS_BREAKER_THRESHOLD consecutive connection errors the client's
+  circuit opens and calls raise CircuitOpen straight away, until a trial
+  call succeeds after REDIS_BREAKER_COOLDOWN seconds;
+- execute_or_buffer() queues writes in a local buffer while Redis is
+  unavailable, and the buffer is replayed after the next successful call.
+
+Code falling back to the database catches UNAVAILABLE, the errors of a
+Redis that is down or too slow to answer.
+
+With REDIS_IN_MEMORY set, both clients are a pure-Python stand-in
+(bookmarks.redis_memory) so tests and local runs need no Redis server.
+"""
+from collections import defaultdict, deque
+import logging
+import threading
+import time
+import redis
+from django.conf import settings
+from .redis_memory import MemoryRedis
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(redis.ConnectionError):
+    """Redis is considered down, the command was not sent"""
+
+
+# TimeoutError is not a ConnectionError, and the short socket timeouts
+# make it the most common failure
+UNAVAILABLE = (redis.ConnectionError, redis.TimeoutError)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            # half-open: let this call through as a trial, hold the others
+            self.opened_at = time.monotonic()
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold and self.opened_at is None:
+                logger.warning("Redis circuit opened after %d failures",
+                               self.failures)
+                self.opened_at = time.monotonic()
+
+
+# redis-py argument order for the counter commands the buffer coalesces
+_COUNTERS = {
+    "incr": lambda key, amount=1: ((key, None), amount),
+    "incrby": lambda key, amount=1: ((key, None), amount),
+    "hincrby": lambda key, field, amount=1: ((key, field), amount),
+    "zincrby": lambda key, amount, member: ((key, member), amount),
+}
+# replies are lost while Redis is down, so there is no point keeping these
+_READS = {"get", "mget", "exists", "hget", "hmget", "hgetall", "smembers",
+          "sismember", "smismember", "zscore", "zrange", "pfcount"}
+
+
+class LocalBuffer:
+    """
+    Writes made while Redis is unavailable. Counter increments are summed
+    per key so an outage costs constant memory per counter; other writes
+    are kept in order, up to REDIS_BUFFER_SIZE of them. Reads are dropped.
+    """
+
+    def __init__(self, max_size):
+        self.counters = defaultdict(int)
+        self.commands = deque(maxlen=max_size)
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        def queue(*args):
+            with self.lock:
+                if name in _READS:
+                    pass
+                elif name in _COUNTERS:
+                    (key, member), amount = _COUNTERS[name](*args)
+                    self.counters[name, key, member] += amount
+                else:
+                    self.commands.append((name, args))
+            return self
+        return queue
+
+    def __len__(self):
+        return len(self.counters) + len(self.commands)
+
+    def replay(self, client):
+        with self.lock:
+            counters, self.counters = self.counters, defaultdict(int)
+            commands, self.commands = (
+                list(self.commands), deque(maxlen=self.commands.maxlen)
+            )
+        pipe = client.pipeline(transaction=False)
+        for (name, key, member), amount in counters.items():
+            if name == "hincrby":
+                pipe.hincrby(key, member, amount)
+            elif name == "zincrby":
+                pipe.zincrby(key, amount, member)
+            else:
+                pipe.incrby(key, amount)
+        for name, args in commands:
+            getattr(pipe, name)(*args)
+        try:
+            pipe.execute()
+        except UNAVAILABLE:
+            self.restore(counters, commands)
+            raise
+        return len(counters) + len(commands)
+
+    def restore(self, counters, commands):
+        """Put back writes that could not be replayed, ahead of newer ones"""
+        with self.lock:
+            for counter, amount in counters.items():
+                self.counters[counter] += amount
+            newer = list(self.commands)
+            self.commands.clear()
+            self.commands.extend(commands + newer)
+
+
+class GuardedRedis:
+    """Redis client wrapper that routes every round trip via a breaker"""
+
+    def __init__(self, client, breaker, buffer):
+        self.client = client
+        self.breaker = breaker
+        self.buffer = buffer
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self.call(attr, *args, **kwargs)
+        return call
+
+    def pipeline(self, transaction=True):
+        return GuardedPipeline(self.client.pipeline(transaction), self)
+
+    def call(self, func, *args, **kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpen("Redis circuit is open")
+        try:
+            result = func(*args, **kwargs)
+        except UNAVAILABLE:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        # writes may have been buffered without the circuit ever opening
+        if len(self.buffer):
+            self.replay()
+        return result
+
+    def replay(self):
+        try:
+            replayed = self.buffer.replay(self.client)
+        except redis.RedisError:
+            logger.exception("Could not replay buffered Redis writes")
+        else:
+            logger.info("Replayed %d buffered Redis writes", replayed)
+
+
+class GuardedPipeline:
+    """Commands are queued locally, execute() is the only round trip"""
+
+    def __init__(self, pipe, guarded):
+        self.pipe = pipe
+        self.guarded = guarded
+
+    def __getattr__(self, name):
+        return getattr(self.pipe, name)
+
+    def execute(self, raise_on_error=True):
+        return self.guarded.call(self.pipe.execute, raise_on_error)
+
+
+def execute_or_buffer(client, queue):
+    """
+    Call queue(pipeline) and execute it, returning the results. If Redis
+    is unavailable, queue(local buffer) instead and return None: the
+    writes are replayed when Redis is back. Only use this for writes whose
+    results the caller can do without. A pipeline that timed out may have
+    run anyway, in which case its writes are applied twice.
+    """
+    pipe = client.pipeline(transaction=False)
+    queue(pipe)
+    try:
+        return pipe.execute()
+    except UNAVAILABLE:
+        queue(client.buffer)
+        return None
+
+
+_memory = MemoryRedis()
+
+
+def _connect(socket_timeout):
+    if settings.REDIS_IN_MEMORY:
+        return _memory
+    pool = redis.BlockingConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def _guarded(socket_timeout):
+    return GuardedRedis(
+        _connect(socket_timeout),
+        CircuitBreaker(settings.REDIS_BREAKER_THRESHOLD,
+                       settings.REDIS_BREAKER_COOLDOWN),
+        LocalBuffer(settings.REDIS_BUFFER_SIZE),
+    )
+
+
+r = _guarded(settings.REDIS_SOCKET_TIMEOUT)
+background_r = _guarded(settings.REDIS_BACKGROUND_SOCKET_TIMEOUT)
@@ -0,0 +1,538 @@
+"""
+Pure-Python stand-in for the parts of the Redis API this project uses.
+
+Replies have the same types redis-py returns without decode_responses
+(bytes for values and members, floats for scores), so code runs unchanged
+against it. Data lives in process memory and is not shared between
+processes; it is meant for tests and local runs, not production.
+"""
+from fnmatch import fnmatchcase
+import random
+import threading
+import time
+import redis
+
+
+def _b(value):
+    """Encode a value the way redis-py does"""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, float):
+        return repr(value).encode()
+    return str(value).encode()
+
+
+def _score(value):
+    value = _b(value)
+    if value in (b"+inf", b"inf"):
+        return float("inf")
+    if value == b"-inf":
+        return float("-inf")
+    return float(value.lstrip(b"("))
+
+
+def _slice(items, start, end):
+    """Redis inclusive start/end indexes, negative counting from the end"""
+    size = len(items)
+    start = max(start + size if start < 0 else start, 0)
+    end = end + size if end < 0 else end
+    return items[start:end + 1]
+
+
+class MemoryRedis:
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.RLock()
+
+    # keys
+
+    def _live(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _get(self, key, kind):
+        key = _b(key)
+        if not self._live(key):
+            return None
+        value = self.data[key]
+        if type(value) is not kind:
+            raise redis.ResponseError(
+                "WRONGTYPE Operation against a key holding the wrong kind "
+                "of value"
+            )
+        return value
+
+    def _get_or_create(self, key, kind):
+        value = self._get(key, kind)
+        if value is None:
+            value = self.data[_b(key)] = kind()
+        return value
+
+    def _cleanup(self, key):
+        key = _b(key)
+        if key in self.data and not self.data[key] and \
+                not isinstance(self.data[key], bytes):
+            del self.data[key]
+            self.expires.pop(key, None)
+
+    def exists(self, *keys):
+        with self.lock:
+            return sum(self._live(_b(key)) for key in keys)
+
+    def delete(self, *keys):
+        with self.lock:
+            deleted = 0
+            for key in map(_b, keys):
+                if self._live(key):
+                    del self.data[key]
+                    self.expires.pop(key, None)
+                    deleted += 1
+            return deleted
+
+    def expire(self, key, seconds):
+        with self.lock:
+            key = _b(key)
+            if not self._live(key):
+                return False
+            self.expires[key] = time.monotonic() + seconds
+            return True
+
+    def ttl(self, key):
+        with self.lock:
+            key = _b(key)
+            if not self._live(key):
+                return -2
+            if key not in self.expires:
+                return -1
+            return int(self.expires[key] - time.monotonic())
+
+    def rename(self, src, dst):
+        with self.lock:
+            src, dst = _b(src), _b(dst)
+            if not self._live(src):
+                raise redis.ResponseError("no such key")
+            self.data[dst] = self.data.pop(src)
+            self.expires.pop(dst, None)
+            if src in self.expires:
+                self.expires[dst] = self.expires.pop(src)
+            return True
+
+    def renamenx(self, src, dst):
+        with self.lock:
+            if not self._live(_b(src)):
+                raise redis.ResponseError("no such key")
+            if self._live(_b(dst)):
+                return False
+            return self.rename(src, dst)
+
+    def keys(self, pattern="*"):
+        with self.lock:
+            pattern = _b(pattern).decode()
+            return [
+                key for key in list(self.data)
+                if self._live(key) and fnmatchcase(key.decode(), pattern)
+            ]
+
+    def scan_iter(self, match=None, count=None, _type=None):
+        yield from self.keys(match or "*")
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+            self.expires.clear()
+            return True
+
+    flushall = flushdb
+
+    # strings
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key, bytes)
+
+    def mget(self, keys, *args):
+        keys = [keys] if isinstance(keys, (str, bytes)) else list(keys)
+        with self.lock:
+            return [self._get(key, bytes) for key in keys + list(args)]
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        with self.lock:
+            key = _b(key)
+            if (nx and self._live(key)) or (xx and not self._live(key)):
+                return None
+            self.data[key] = _b(value)
+            self.expires.pop(key, None)
+            if ex is not None:
+                self.expires[key] = time.monotonic() + ex
+            elif px is not None:
+                self.expires[key] = time.monotonic() + px / 1000
+            return True
+
+    def incrby(self, key, amount=1):
+        with self.lock:
+            value = int(self._get(key, bytes) or 0) + amount
+            self.data[_b(key)] = _b(value)
+            return value
+
+    incr = incrby
+
+    def decr(self, key, amount=1):
+        return self.incrby(key, -amount)
+
+    # hashes
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self.lock:
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            hash_ = self._get_or_create(name, dict)
+            added = 0
+            for field, value in items.items():
+                added += _b(field) not in hash_
+                hash_[_b(field)] = _b(value)
+            return added
+
+    def hget(self, name, key):
+        with self.lock:
+            return (self._get(name, dict) or {}).get(_b(key))
+
+    def hmget(self, name, keys, *args):
+        keys = [keys] if isinstance(keys, (str, bytes, int)) else list(keys)
+        with self.lock:
+            hash_ = self._get(name, dict) or {}
+            return [hash_.get(_b(key)) for key in keys + list(args)]
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self._get(name, dict) or {})
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            hash_ = self._get_or_create(name, dict)
+            value = int(hash_.get(_b(key), 0)) + amount
+            hash_[_b(key)] = _b(value)
+            return value
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            hash_ = self._get(name, dict) or {}
+            deleted = sum(hash_.pop(_b(key), None) is not None
+                          for key in keys)
+            self._cleanup(name)
+            return deleted
+
+    def hlen(self, name):
+        with self.lock:
+            return len(self._get(name, dict) or {})
+
+    # sets
+
+    def sadd(self, name, *values):
+        with self.lock:
+            members = self._get_or_create(name, set)
+            added = {_b(value) for value in values} - members
+            members |= added
+            return len(added)
+
+    def srem(self, name, *values):
+        with self.lock:
+            members = self._get(name, set) or set()
+            removed = {_b(value) for value in values} & members
+            members -= removed
+            self._cleanup(name)
+            return len(removed)
+
+    def smembers(self, name):
+        with self.lock:
+            return set(self._get(name, set) or ())
+
+    def sismember(self, name, value):
+        with self.lock:
+            return _b(value) in (self._get(name, set) or ())
+
+    def smismember(self, name, values, *args):
+        values = [values] if isinstance(values, (str, bytes, int)) \
+            else list(values)
+        with self.lock:
+            members = self._get(name, set) or ()
+            return [_b(value) in members for value in values + list(args)]
+
+    def sscan_iter(self, name, match=None, count=None):
+        pattern = _b(match or "*").decode()
+        yield from [
+            member for member in self.smembers(name)
+            if fnmatchcase(member.decode(), pattern)
+        ]
+
+    def scard(self, name):
+        with self.lock:
+            return len(self._get(name, set) or ())
+
+    def spop(self, name, count=None):
+        with self.lock:
+            members = self._get(name, set) or set()
+            chosen = random.sample(sorted(members),
+                                   min(count or 1, len(members)))
+            members -= set(chosen)
+            self._cleanup(name)
+            if count is None:
+                return chosen[0] if chosen else None
+            return chosen
+
+    def _sets(self, keys, args):
+        keys = [keys] if isinstance(keys, (str, bytes)) else list(keys)
+        return [set(self._get(key, set) or ()) for key in keys + list(args)]
+
+    def sdiff(self, keys, *args):
+        with self.lock:
+            first, *others = self._sets(keys, args)
+            return first.difference(*others)
+
+    def sinter(self, keys, *args):
+        with self.lock:
+            first, *others = self._sets(keys, args)
+            return first.intersection(*others)
+
+    def sunion(self, keys, *args):
+        with self.lock:
+            return set().union(*self._sets(keys, args))
+
+    # lists
+
+    def rpush(self, name, *values):
+        with self.lock:
+            items = self._get_or_create(name, list)
+            items.extend(_b(value) for value in values)
+            return len(items)
+
+    def lpush(self, name, *values):
+        with self.lock:
+            items = self._get_or_create(name, list)
+            items[:0] = [_b(value) for value in reversed(values)]
+            return len(items)
+
+    def lpop(self, name, count=None):
+        with self.lock:
+            items = self._get(name, list) or []
+            popped = items[:count or 1]
+            del items[:count or 1]
+            self._cleanup(name)
+            if count is None:
+                return popped[0] if popped else None
+            return popped or None
+
+    def llen(self, name):
+        with self.lock:
+            return len(self._get(name, list) or ())
+
+    def lrange(self, name, start, end):
+        with self.lock:
+            return _slice(list(self._get(name, list) or ()), start, end)
+
+    # sorted sets
+
+    def zadd(self, name, mapping, nx=False, xx=False, gt=False, lt=False):
+        with self.lock:
+            zset = self._get_or_create(name, ZSet)
+            added = 0
+            for member, score in mapping.items():
+                member, score = _b(member), float(score)
+                if member in zset:
+                    if nx or (gt and score <= zset[member]) or \
+                            (lt and score >= zset[member]):
+                        continue
+                elif xx:
+                    continue
+                else:
+                    added += 1
+                zset[member] = score
+            self._cleanup(name)
+            return added
+
+    def zincrby(self, name, amount, value):
+        with self.lock:
+            zset = self._get_or_create(name, ZSet)
+            zset[_b(value)] = zset.get(_b(value), 0.0) + amount
+            return zset[_b(value)]
+
+    def zrem(self, name, *values):
+        with self.lock:
+            zset = self._get(name, ZSet) or ZSet()
+            removed = sum(zset.pop(_b(value), None) is not None
+                          for value in values)
+            self._cleanup(name)
+            return removed
+
+    def zscore(self, name, value):
+        with self.lock:
+            return (self._get(name, ZSet) or {}).get(_b(value))
+
+    def zmscore(self, key, members):
+        with self.lock:
+            zset = self._get(key, ZSet) or {}
+            return [zset.get(_b(member)) for member in members]
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self._get(name, ZSet) or ())
+
+    def _sorted(self, name, desc=False):
+        zset = self._get(name, ZSet) or {}
+        return sorted(zset.items(), key=lambda item: (item[1], item[0]),
+                      reverse=desc)
+
+    @staticmethod
+    def _reply(items, withscores):
+        if withscores:
+            return [(member, score) for member, score in items]
+        return [member for member, _ in items]
+
+    def zrange(self, name, start, end, desc=False, withscores=False,
+               byscore=False, offset=None, num=None):
+        with self.lock:
+            if byscore:
+                items = self._by_score(name, start, end, desc)
+                if offset is not None:
+                    items = items[offset:offset + num]
+            else:
+                items = _slice(self._sorted(name, desc), start, end)
+            return self._reply(items, withscores)
+
+    def zrevrange(self, name, start, end, withscores=False):
+        return self.zrange(name, start, end, desc=True,
+                           withscores=withscores)
+
+    def _by_score(self, name, low, high, desc):
+        def above(score, bound):
+            bound_b = _b(bound)
+            return score > _score(bound_b) if bound_b.startswith(b"(") \
+                else score >= _score(bound_b)
+
+        def below(score, bound):
+            bound_b = _b(bound)
+            return score < _score(bound_b) if bound_b.startswith(b"(") \
+                else score <= _score(bound_b)
+
+        return [
+            item for item in self._sorted(name, desc)
+            if above(item[1], low) and below(item[1], high)
+        ]
+
+    def zrangebyscore(self, name, min, max, start=None, num=None,
+                      withscores=False):
+        with self.lock:
+            items = self._by_score(name, min, max, False)
+            if start is not None:
+                items = items[start:start + num]
+            return self._reply(items, withscores)
+
+    def zrevrangebyscore(self, name, max, min, start=None, num=None,
+                         withscores=False):
+        with self.lock:
+            items = self._by_score(name, min, max, True)
+            if start is not None:
+                items = items[start:start + num]
+            return self._reply(items, withscores)
+
+    def zremrangebyrank(self, name, min, max):
+        with self.lock:
+            zset = self._get(name, ZSet) or ZSet()
+            removed = _slice(self._sorted(name), min, max)
+            for member, _ in removed:
+                del zset[member]
+            self._cleanup(name)
+            return len(removed)
+
+    def zunionstore(self, dest, keys, aggregate=None):
+        weights = keys if isinstance(keys, dict) else dict.fromkeys(keys, 1)
+        combine = {None: sum, "SUM": sum, "MIN": min, "MAX": max}[
+            aggregate and aggregate.upper()
+        ]
+        with self.lock:
+            scores = {}
+            for key, weight in weights.items():
+                for member, score in (self._get(key, ZSet) or {}).items():
+                    scores.setdefault(member, []).append(score * weight)
+            union = ZSet(
+                (member, combine(values)) for member, values in scores.items()
+            )
+            self.delete(dest)
+            if union:
+                self.data[_b(dest)] = union
+            return len(union)
+
+    # HyperLogLogs, kept exact
+
+    def pfadd(self, name, *values):
+        with self.lock:
+            members = self._get_or_create(name, HyperLogLog)
+            before = len(members)
+            members.update(_b(value) for value in values)
+            return int(len(members) != before or not values)
+
+    def pfcount(self, *sources):
+        with self.lock:
+            return len(HyperLogLog().union(
+                *[self._get(key, HyperLogLog) or () for key in sources]
+            ))
+
+    def pfmerge(self, dest, *sources):
+        with self.lock:
+            merged = HyperLogLog().union(
+                *[self._get(key, HyperLogLog) or ()
+                  for key in (dest, *sources)]
+            )
+            self.data[_b(dest)] = HyperLogLog(merged)
+            return True
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def ping(self):
+        return True
+
+
+class ZSet(dict):
+    pass
+
+
+class HyperLogLog(set):
+    pass
+
+
+class MemoryPipeline:
+    """Queues calls and runs them in order on execute()"""
+
+    def __init__(self, client):
+        self.client = client
+        self.queue = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.queue.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self, raise_on_error=True):
+        results = []
+        with self.client.lock:
+            for method, args, kwargs in self.queue:
+                try:
+                    results.append(method(*args, **kwargs))
+                except redis.ResponseError as e:
+                    if raise_on_error:
+                        self.queue = []
+                        raise
+                    results.append(e)
+        self.queue = []
+        return results
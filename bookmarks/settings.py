@@ -13,10 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import mimetypes
 from pathlib import Path
 from django.urls import reverse_lazy
-<<<<<<< HEAD
 from decouple import config
-=======
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -73,6 +70,86 @@ REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 REDIS_DB = 0
 
+# Shared client, see bookmarks/redis_client.py. Timeouts are in seconds.
+REDIS_MAX_CONNECTIONS = 50
+REDIS_POOL_TIMEOUT = 0.1
+REDIS_CONNECT_TIMEOUT = 0.2
+REDIS_SOCKET_TIMEOUT = 0.2
+REDIS_BACKGROUND_SOCKET_TIMEOUT = 5
+REDIS_BREAKER_THRESHOLD = 5
+REDIS_BREAKER_COOLDOWN = 10
+REDIS_BUFFER_SIZE = 10000
+# Use an in-process stand-in instead of a Redis server
+REDIS_IN_MEMORY = config('REDIS_IN_MEMORY', default=False, cast=bool)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/1',
+        'OPTIONS': {
+            'socket_timeout': REDIS_SOCKET_TIMEOUT,
+            'socket_connect_timeout': REDIS_CONNECT_TIMEOUT,
+        },
+    }
+}
+
+# Rendered feed cards are invalidated by version, this only evicts cold ones
+FEED_CARD_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Home feed ordering: 'shuffle', 'timeline' or 'ranked'
+HOME_FEED_MODE = 'shuffle'
+# Seconds a user's first feed page keeps its order, so it can be revalidated
+FEED_SHUFFLE_PERIOD = 60 * 60
+
+# Ranked feed scoring
+FEED_RANKING_WEIGHTS = {
+    'recency': 1.0,
+    'likes': 0.3,
+    'views': 0.1,
+    'affinity': 1.5,
+}
+FEED_RANKING_HALF_LIFE_HOURS = 48
+FEED_RANKING_CANDIDATES = 200000
+FEED_RANKING_CACHE_SECONDS = 60
+# ids of shown images kept in the ranked feed cursor, see images/feed.py
+FEED_RANKING_SEEN_LIMIT = 200
+
+# Follower timelines
+TIMELINE_LENGTH = 800
+TIMELINE_FANOUT_LIMIT = 5000
+
+# Username search results cached for queries up to this many characters
+USER_SEARCH_CACHED_LENGTH = 3
+USER_SEARCH_CACHE_TIMEOUT = 60
+
+# Friend-of-friend user suggestions (account.tasks.compute_suggestions):
+# candidates who posted in the last SUGGESTION_ACTIVITY_DAYS have their
+# mutual count multiplied by 1 + weight * log(1 + recent posts)
+SUGGESTIONS_PER_USER = 20
+SUGGESTION_ACTIVITY_DAYS = 14
+SUGGESTION_ACTIVITY_WEIGHT = 0.5
+
+# Buffer likes in Redis and write them in bulk every few seconds
+# (images.tasks.flush_pending_likes) instead of on every request
+LIKES_WRITE_BEHIND = False
+
+# Queue activity stream actions in Redis and insert them in batches
+# (actions.tasks.flush_actions) instead of on every request
+ACTIONS_WRITE_BEHIND = False
+
+# Likes and follows of the same target within an hour are stored as one
+# action listing up to ACTION_AGGREGATE_ACTORS recent actors
+ACTION_AGGREGATION_WINDOWS = {
+    'likes': 60 * 60,
+    'is following': 60 * 60,
+}
+ACTION_AGGREGATE_ACTORS = 10
+
+# Actions older than this are moved to gzipped JSON Lines files in
+# ACTION_ARCHIVE_DIR every night, or deleted if it is None
+ACTION_RETENTION_DAYS = 90
+ACTION_ARCHIVE_DIR = BASE_DIR / 'archive' / 'actions'
+
 ROOT_URLCONF = 'bookmarks.urls'
 
 TEMPLATES = [
@@ -97,6 +174,11 @@ LOGOUT_REDIRECT_URL = 'login'
 # Celery settings
 CELERY_BROKER_URL = "redis://redis:6379/0"
 CELERY_RESULT_BACKEND = "redis://redis:6379/0"
+# requests queue tasks with bookmarks.celery.delay_on_commit, which must
+# give up quickly while the broker is down instead of retrying
+CELERY_BROKER_CONNECTION_TIMEOUT = 1
+CELERY_BROKER_TRANSPORT_OPTIONS = {"socket_connect_timeout": 1,
+                                   "max_retries": 0}
 
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -110,13 +192,8 @@ AUTHENTICATION_BACKENDS = [
     'social_core.backends.google.GoogleOAuth2',
 ]
 
-<<<<<<< HEAD
 SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = config('SOCIAL_AUTH_GOOGLE_OAUTH2_KEY')
 SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = config('SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET')
-=======
-SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = '834014884051-5ete3phku05310rpan9f6uutgaj0dbes.apps.googleusercontent.com'  # Google Client ID
-SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = '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'  # Google Client Secret
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
 SOCIAL_AUTH_REDIRECT_IS_HTTPS = True
 
 SOCIAL_AUTH_PIPELINE = [
@@ -195,12 +272,9 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
-<<<<<<< HEAD
 
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
-=======
->>>>>>> 967e6de772d5851103f357be2a9c8386b7957e87
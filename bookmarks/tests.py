@@ -0,0 +1,143 @@
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+import redis
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+from .redis_client import (
+    CircuitBreaker, CircuitOpen, GuardedRedis, LocalBuffer, background_r,
+    execute_or_buffer, r,
+)
+from .redis_memory import MemoryRedis
+
+
+# a cache nobody listens on, the Redis cache backend fails right away
+UNREACHABLE_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://127.0.0.1:1/1",
+    }
+}
+
+
+class FlakyRedis(MemoryRedis):
+    """In-memory Redis whose commands raise `error` while it is set"""
+
+    error = None
+
+    def __getattribute__(self, name):
+        attr = super().__getattribute__(name)
+        if name.startswith("_") or name == "pipeline" or not callable(attr):
+            return attr
+
+        def command(*args, **kwargs):
+            error = super(FlakyRedis, self).__getattribute__("error")
+            if error:
+                raise error
+            return attr(*args, **kwargs)
+        return command
+
+
+def down_redis():
+    client = FlakyRedis()
+    client.error = redis.ConnectionError("Connection refused")
+    return client
+
+
+@contextmanager
+def use_redis(client):
+    """Point the shared clients at `client`, with fresh breakers and buffers"""
+    with ExitStack() as stack:
+        for guarded in (r, background_r):
+            stack.enter_context(mock.patch.multiple(
+                guarded,
+                client=client,
+                breaker=CircuitBreaker(settings.REDIS_BREAKER_THRESHOLD,
+                                       settings.REDIS_BREAKER_COOLDOWN),
+                buffer=LocalBuffer(settings.REDIS_BUFFER_SIZE),
+            ))
+        yield client
+
+
+class MemoryRedisTestCase(TestCase):
+    """
+    TestCase on an in-memory Redis: one while the class's test data is
+    created, then a fresh one, self.redis, for every test.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.enterClassContext(use_redis(MemoryRedis()))
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        self.redis = self.enterContext(use_redis(MemoryRedis()))
+
+
+class GuardedRedisTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = FlakyRedis()
+        self.client = GuardedRedis(self.redis, CircuitBreaker(3, 60),
+                                   LocalBuffer(100))
+
+    def buffer_writes(self):
+        for _ in range(2):
+            result = execute_or_buffer(self.client, lambda pipe: (
+                pipe.incrby("hits", 2).hset("states", "1", "liked")
+            ))
+            self.assertIsNone(result)
+
+    def test_buffer_sums_counters_and_drops_reads(self):
+        buffer = LocalBuffer(100)
+        buffer.incrby("hits", 2).incrby("hits", 3).get("hits")
+        buffer.hincrby("likes", "delta", -1).sadd("liked", 1)
+        self.assertEqual(len(buffer), 3)
+        buffer.replay(self.redis)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.redis.get("hits"), b"5")
+        self.assertEqual(self.redis.hget("likes", "delta"), b"-1")
+        self.assertTrue(self.redis.sismember("liked", 1))
+
+    def test_timeouts_are_buffered(self):
+        self.redis.error = redis.TimeoutError("Timeout reading from socket")
+        self.buffer_writes()
+        # the increments are summed, the hsets kept in order
+        self.assertEqual(len(self.client.buffer), 3)
+        self.assertNotIn(b"hits", self.redis.data)
+
+    def test_replay_before_the_circuit_opens(self):
+        self.redis.error = redis.ConnectionError("Connection refused")
+        self.buffer_writes()
+        self.assertIsNone(self.client.breaker.opened_at)
+        self.redis.error = None
+        self.assertIsNone(self.client.get("other"))
+        self.assertEqual(len(self.client.buffer), 0)
+        self.assertEqual(self.redis.get("hits"), b"4")
+        self.assertEqual(self.redis.hget("states", "1"), b"liked")
+
+    def test_circuit_opens_and_closes(self):
+        self.redis.error = redis.ConnectionError("Connection refused")
+        for _ in range(3):
+            with self.assertRaises(redis.ConnectionError):
+                self.client.get("hits")
+        self.redis.error = None
+        with self.assertRaises(CircuitOpen):
+            self.client.get("hits")
+        self.buffer_writes()
+        # the cooldown is over, the trial call closes the circuit
+        self.client.breaker.opened_at -= 60
+        self.client.get("hits")
+        self.assertIsNone(self.client.breaker.opened_at)
+        self.assertEqual(self.redis.get("hits"), b"4")
+
+    def test_failed_replay_keeps_writes(self):
+        buffer = LocalBuffer(100)
+        buffer.incrby("hits", 2).rpush("queue", "a")
+        self.redis.error = redis.TimeoutError("Timeout reading from socket")
+        with self.assertRaises(redis.TimeoutError):
+            buffer.replay(self.redis)
+        buffer.incrby("hits", 1).rpush("queue", "b")
+        self.redis.error = None
+        self.assertEqual(buffer.replay(self.redis), 3)
+        self.assertEqual(self.redis.get("hits"), b"3")
+        self.assertEqual(self.redis.lrange("queue", 0, -1), [b"a", b"b"])
@@ -1,9 +1,17 @@
 from django.contrib import admin
 
+from .likes import remove_likes, Like
 from .models import Image
 
 
 @admin.register(Image)
 class ImageAdmin(admin.ModelAdmin):
-    list_display = ['title', 'slug', 'image', 'created', 'autoplay']
+    list_display = ['title', 'slug', 'image', 'created', 'autoplay',
+                    'total_likes', 'total_views']
     list_filter = ['autoplay', 'created']
+    actions = ['clear_likes']
+
+    @admin.action(description='Remove all likes from selected images')
+    def clear_likes(self, request, queryset):
+        removed = remove_likes(Like.objects.filter(image__in=queryset))
+        self.message_user(request, f'{removed} likes removed.')
@@ -0,0 +1,151 @@
+"""
+Rendered feed cards, cached per image version.
+
+A card is rendered once without any viewer state and cached under the
+image's version and its author's version. Signals bump those versions
+whenever something shown on the card changes, so cached cards are
+invalidated exactly instead of expiring on a timer. The viewer-dependent
+bits are left as <!--viewer:...--> placeholders and filled in on every
+request.
+
+Versions live in Redis behind the shared client. Bumps made while Redis
+is unavailable are buffered and applied once it is back, so saves never
+fail on them, and cards are rendered uncached until then.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from bookmarks.redis_client import UNAVAILABLE, r, execute_or_buffer
+
+
+CARD_TEMPLATE = "images/image/feed_card.html"
+
+
+def _version_key(kind, object_id):
+    return f"feed_card_version:{kind}:{object_id}"
+
+
+def bump_image_version(*image_ids):
+    _bump([_version_key("image", image_id) for image_id in image_ids])
+
+
+def bump_user_version(user_id):
+    _bump([_version_key("user", user_id)])
+
+
+def _bump(keys):
+    if not keys:
+        return
+
+    def queue(pipe):
+        for key in keys:
+            pipe.incr(key)
+    execute_or_buffer(r, queue)
+
+
+def card_keys(images):
+    """
+    Return {image id: cache key} for the current version of each card, or
+    None if the versions cannot be read.
+    """
+    version_keys = {}
+    for image in images:
+        version_keys[image.id] = (
+            _version_key("image", image.id),
+            _version_key("user", image.user_id),
+        )
+    wanted = list({key for pair in version_keys.values() for key in pair})
+    try:
+        versions = dict(zip(wanted, r.mget(wanted)))
+        unknown = [key for key, version in versions.items() if version is None]
+        if unknown:
+            # any new value invalidates cards cached under a lost version
+            pipe = r.pipeline(transaction=False)
+            for key in unknown:
+                pipe.set(key, time.time_ns(), nx=True)
+            pipe.mget(unknown)
+            versions.update(zip(unknown, pipe.execute()[-1]))
+    except UNAVAILABLE:
+        return None
+    return {
+        image_id: f"feed_card:{image_id}:{int(versions[image_key])}"
+                  f":{int(versions[user_key])}"
+        for image_id, (image_key, user_key) in version_keys.items()
+    }
+
+
+def cached_cards(images, keys, build):
+    """
+    Return {image id: card}, read from the cache under keys ({image id:
+    key}, None to bypass the cache). Missing cards are made with
+    build(missing_images), which returns them in order, and cached.
+    """
+    cards = {}
+    if keys:
+        try:
+            found = cache.get_many(keys.values())
+        except UNAVAILABLE:
+            keys = None
+        else:
+            cards = {image_id: found[key] for image_id, key in keys.items()
+                     if key in found}
+    missing = [image for image in images if image.id not in cards]
+    if missing:
+        built = dict(zip([image.id for image in missing], build(missing)))
+        if keys:
+            try:
+                cache.set_many(
+                    {keys[image_id]: card for image_id, card in built.items()},
+                    settings.FEED_CARD_CACHE_TIMEOUT,
+                )
+            except UNAVAILABLE:
+                pass
+        cards.update(built)
+    return cards
+
+
+def render_cards(images, request, load_context):
+    """
+    Set image.card_html on every image. Cards missing from the cache are
+    rendered after calling load_context(missing_images) and cached.
+    """
+    def render(missing):
+        load_context(missing)
+        return [render_to_string(CARD_TEMPLATE, {"image": image})
+                for image in missing]
+    cards = cached_cards(images, card_keys(images) if images else {}, render)
+
+    csrf_token = get_token(request)
+    for image in images:
+        html = cards[image.id]
+        liked = getattr(image, "liked_by_me", False)
+        html = (
+            html.replace("<!--viewer:like_action-->",
+                         "unlike" if liked else "like")
+            .replace("<!--viewer:like_icon-->", "fas" if liked else "far")
+            .replace("<!--viewer:follow-->", _follow_html(image, request.user))
+            .replace("<!--viewer:csrf-->", csrf_token)
+        )
+        image.card_html = mark_safe(html)
+    return images
+
+
+def _follow_html(image, user):
+    if image.user_id == user.id:
+        return ""
+    if getattr(image, "is_following", False):
+        return format_html(
+            '<button class="follow-btn" data-user-id="{}" '
+            'data-action="unfollow">Unfollow</button>',
+            image.user_id,
+        )
+    return format_html(
+        '<span class="suggested-label">Suggested</span>\n'
+        '        <button class="follow-btn" data-user-id="{}" '
+        'data-action="follow">Follow</button>',
+        image.user_id,
+    )
@@ -0,0 +1,457 @@
+import random
+import time
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from easy_thumbnails.files import get_thumbnailer
+from django.db.models import BigIntegerField, BooleanField, Case, Count, \
+    ExpressionWrapper, F, IntegerField, Min, Q, Value, When, Window
+from django.db.models.functions import RowNumber
+from .models import Image, Comment
+from . import timeline
+from .cards import cached_cards
+from .likes import liked_image_ids, pending_likes
+from .ranking import FeedRanker
+
+
+FEED_PAGE_SIZE = 5
+EXPLORE_PAGE_SIZE = 50
+COMMENT_PREVIEW_SIZE = 3
+
+# Prime moduli for the per-user shuffle. Image ids are hashed with
+# x = (id * a + b) % P followed by (x * x + c) % Q, which the database can
+# sort on directly, so any page of the shuffled order is computed without
+# materialising the full id list. Both steps stay below 2**63.
+SHUFFLE_MODULI = (2147483647, 2147483659)
+
+CURSOR_SALT = "images.feed.cursor"
+
+
+def encode_cursor(state):
+    """Serialize feed position into an opaque, signed token"""
+    return signing.dumps(state, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token):
+    """Return the feed position stored in a cursor, or None if invalid"""
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+
+
+def period_start():
+    """Start of the current FEED_SHUFFLE_PERIOD, in seconds since the epoch"""
+    period = settings.FEED_SHUFFLE_PERIOD
+    return time.time() // period * period
+
+
+def new_seed(user_id):
+    """
+    Shuffle seed of a user's first page. It only changes every
+    FEED_SHUFFLE_PERIOD, so reloading the first page gives the same order
+    and clients can revalidate it with its ETag.
+    """
+    rng = random.Random(f"{user_id}:{period_start()}")
+    p, q = SHUFFLE_MODULI
+    return [rng.randint(1, p - 1), rng.randint(0, p - 1),
+            rng.randint(0, q - 1)]
+
+
+def shuffle_key(seed):
+    a, b, c = seed
+    p, q = SHUFFLE_MODULI
+    x = (F("id") * a + b) % p
+    return ExpressionWrapper((x * x + c) % q, output_field=BigIntegerField())
+
+
+class FeedPage:
+    """A page of feed items and the cursor pointing at the next page"""
+
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next()
+
+
+def _shuffled_rows(queryset, seed, after, limit):
+    """Return (shuffle_key, id) pairs of queryset that follow `after`"""
+    queryset = queryset.annotate(shuffle_key=shuffle_key(seed))
+    if after is not None:
+        # Hash collisions are possible, so ties are broken on id
+        after_key, after_id = after
+        queryset = queryset.filter(
+            Q(shuffle_key__gt=after_key)
+            | Q(shuffle_key=after_key, id__gt=after_id)
+        )
+    return list(
+        queryset.order_by("shuffle_key", "id")
+        .values_list("shuffle_key", "id")[:limit]
+    )
+
+
+def _suggested_images(user, followed_ids):
+    return Image.objects.exclude(user=user).exclude(user__in=followed_ids)
+
+
+def _page(state, entries, per_page):
+    """Build a FeedPage from (phase, position, image_id) entries"""
+    next_cursor = None
+    if len(entries) > per_page:
+        last_phase, last_position, _ = entries[per_page - 1]
+        next_cursor = encode_cursor(
+            dict(state, phase=last_phase, after=last_position)
+        )
+    return FeedPage([image_id for _, _, image_id in entries[:per_page]],
+                    next_cursor)
+
+
+def shuffled_page(user, followed_ids, state, per_page=FEED_PAGE_SIZE):
+    """
+    Return a FeedPage of image ids: posts from followed users first, then
+    suggested posts, each in a random order fixed by the cursor's seed.
+    """
+    phases = [
+        Image.objects.filter(user__in=followed_ids),
+        _suggested_images(user, followed_ids),
+    ]
+
+    # Fetch one extra row to know whether there is a next page
+    entries = []
+    phase, after = state["phase"], state["after"]
+    while phase < len(phases) and len(entries) <= per_page:
+        rows = _shuffled_rows(phases[phase], state["seed"], after,
+                              per_page + 1 - len(entries))
+        entries.extend((phase, [k, image_id], image_id)
+                       for k, image_id in rows)
+        phase, after = phase + 1, None
+    return _page(state, entries, per_page)
+
+
+def timeline_page(user, followed_ids, state, per_page=FEED_PAGE_SIZE):
+    """
+    Return a FeedPage with the followed users' timeline, newest first,
+    followed by shuffled suggested posts.
+    """
+    entries = []
+    after = state["after"]
+    if state["phase"] == 0:
+        ids = timeline.read(user.id, followed_ids, before=after,
+                            count=per_page + 1)
+        entries = [(0, image_id, image_id) for image_id in ids]
+        after = None
+    if len(entries) <= per_page:
+        rows = _shuffled_rows(_suggested_images(user, followed_ids),
+                              state["seed"], after,
+                              per_page + 1 - len(entries))
+        entries.extend((1, [k, image_id], image_id) for k, image_id in rows)
+    return _page(state, entries, per_page)
+
+
+def ranked_page(user, followed_ids, state, per_page=FEED_PAGE_SIZE):
+    """
+    Return a FeedPage of images ordered by FeedRanker score. Scores are
+    computed against the start of the period the first page was requested
+    in, so recency does not shift between pages or first page reloads.
+
+    Likes, views and new posts still change scores whenever the candidate
+    arrays are refreshed, so a score position alone would repeat or skip
+    images that moved across it. The cursor lists the images shown so far
+    instead and each page is the best of the rest. Past
+    FEED_RANKING_SEEN_LIMIT shown images the list stops growing and later
+    pages also continue below the last score.
+    """
+    state.setdefault("now", period_start())
+    seen = state.setdefault("seen", [])
+    deep = len(seen) >= settings.FEED_RANKING_SEEN_LIMIT
+    rows = FeedRanker().rank(user, followed_ids, state["now"],
+                             after=state["after"] if deep else None,
+                             exclude=seen, limit=per_page + 1)
+    if not deep:
+        state["seen"] = seen + [image_id for _, image_id in rows[:per_page]]
+    entries = [(0, [score, image_id], image_id) for score, image_id in rows]
+    return _page(state, entries, per_page)
+
+
+FEED_MODES = {
+    "shuffle": shuffled_page,
+    "timeline": timeline_page,
+    "ranked": ranked_page,
+}
+
+
+def home_page(user, followed_ids, cursor=None, per_page=FEED_PAGE_SIZE):
+    """Return the FeedPage for the home feed at the given cursor"""
+    state = decode_cursor(cursor)
+    if not state or state.get("mode") not in FEED_MODES:
+        state = {
+            "mode": settings.HOME_FEED_MODE,
+            "seed": new_seed(user.id),
+            "phase": 0,
+            "after": None,
+        }
+    return FEED_MODES[state["mode"]](user, followed_ids, state, per_page)
+
+
+def load_page_images(page, followed_ids):
+    """
+    Return the images of a home FeedPage in feed order, with their author
+    and profile, annotated with is_following.
+    """
+    images = (
+        Image.objects.filter(id__in=page.object_list, user__isnull=False)
+        .select_related("user", "user__profile")
+        .annotate(
+            is_following=Case(
+                When(user__in=followed_ids, then=True),
+                default=False,
+                output_field=BooleanField(),
+            )
+        )
+    )
+    images_dict = {image.id: image for image in images}
+    return [images_dict[image_id] for image_id in page.object_list
+            if image_id in images_dict]
+
+
+CARD_FIELDS = (
+    "id", "title", "description", "url", "thumbnail", "video", "autoplay",
+    "created", "author", "likes", "liked", "first_liker", "comments",
+    "comment_count",
+)
+
+
+def serialize_card(image, fields=None):
+    """
+    Return the JSON-ready card for an image loaded with load_page_images
+    and attach_social_context, limited to `fields` when given.
+    """
+    wanted = set(fields or CARD_FIELDS)
+    card = {}
+    if "id" in wanted:
+        card["id"] = image.id
+    if "title" in wanted:
+        card["title"] = image.title
+    if "description" in wanted:
+        card["description"] = image.description
+    if "url" in wanted:
+        card["url"] = image.get_absolute_url()
+    if "thumbnail" in wanted:
+        card["thumbnail"] = (
+            get_thumbnailer(image.image).get_thumbnail(
+                {"size": (1080, 1080)}
+            ).url
+            if image.image else None
+        )
+    if "video" in wanted:
+        card["video"] = image.video.url if image.video else None
+    if "autoplay" in wanted:
+        card["autoplay"] = image.autoplay
+    if "created" in wanted:
+        card["created"] = image.created.isoformat()
+    if "author" in wanted:
+        profile = image.user.profile
+        card["author"] = {
+            "id": image.user_id,
+            "username": image.user.username,
+            "url": reverse("user_detail", args=[image.user.username]),
+            "photo": profile.photo.url if profile.photo else None,
+            "following": image.is_following,
+        }
+    if "likes" in wanted:
+        card["likes"] = image.like_count
+    if "liked" in wanted:
+        card["liked"] = image.liked_by_me
+    if "first_liker" in wanted:
+        card["first_liker"] = (
+            image.first_liker.username if image.first_liker else None
+        )
+    if "comments" in wanted:
+        card["comments"] = [
+            {"user": comment.user.username, "text": comment.text}
+            for comment in image.comment_preview
+        ]
+    if "comment_count" in wanted:
+        card["comment_count"] = image.comment_count
+    return card
+
+
+def serialize_cards(images, keys, fields=None):
+    """
+    Return the JSON cards of images loaded with load_page_images and
+    attach_liked_by_me. The viewer-independent part of every card is
+    cached under its card key in keys (None to bypass the cache).
+    """
+    if keys:
+        keys = {image_id: f"{key}:json" for image_id, key in keys.items()}
+
+    def serialize(missing):
+        attach_card_context(missing)
+        return [serialize_card(image) for image in missing]
+    cached = cached_cards(images, keys, serialize)
+
+    wanted = set(fields or CARD_FIELDS)
+    cards = []
+    for image in images:
+        card = dict(cached[image.id], liked=image.liked_by_me)
+        card["author"] = dict(card["author"], following=image.is_following)
+        cards.append({name: value for name, value in card.items()
+                      if name in wanted})
+    return cards
+
+
+def _older_than(queryset, position):
+    """Filter queryset to rows after `position` in (-created, -id) order"""
+    if position is None:
+        return queryset
+    _, created, image_id = position
+    return queryset.filter(
+        Q(created__lt=created) | Q(created=created, id__lt=image_id)
+    )
+
+
+def explore_page(followed_ids, cursor=None, per_page=EXPLORE_PAGE_SIZE):
+    """
+    Return a FeedPage of images from followed users, then everyone else,
+    newest first. Both groups come from a single UNION query ordered by
+    (priority, -created, -id), and the cursor holds the last position so
+    only one page of rows is ever fetched.
+    """
+    state = decode_cursor(cursor) or {}
+    after = state.get("after")
+    priority = after[0] if after else 0
+
+    groups = [
+        Image.objects.filter(user__in=followed_ids),
+        Image.objects.exclude(user__in=followed_ids),
+    ]
+    parts = [
+        _older_than(group, after if level == priority else None)
+        .annotate(priority=Value(level, output_field=IntegerField()))
+        .order_by()
+        for level, group in enumerate(groups)
+        if level >= priority
+    ]
+    queryset = parts[0].union(*parts[1:], all=True) if len(parts) > 1 \
+        else parts[0]
+    images = list(
+        queryset.order_by("priority", "-created", "-id")[: per_page + 1]
+    )
+
+    next_cursor = None
+    if len(images) > per_page:
+        last = images[per_page - 1]
+        next_cursor = encode_cursor({
+            "after": [last.priority, last.created.isoformat(), last.id]
+        })
+    return FeedPage(images[:per_page], next_cursor)
+
+
+def attach_social_context(images, user, comments=COMMENT_PREVIEW_SIZE):
+    """
+    Attach the per-card social data used by the feed templates in a fixed
+    number of queries, whatever the number of images:
+
+    - liked_by_me: whether `user` likes the image
+    - like_count: number of likes
+    - first_liker: the user who liked the image first, or None
+    - comment_preview: the latest `comments` comments, newest first
+    - comment_count: total number of comments
+    """
+    attach_liked_by_me(images, user)
+    return attach_card_context(images, comments)
+
+
+def attach_liked_by_me(images, user):
+    """Set image.liked_by_me on every image from the user's liked set"""
+    images = list(images)
+    liked = liked_image_ids(user.id, [image.id for image in images])
+    for image in images:
+        image.liked_by_me = image.id in liked
+    if settings.LIKES_WRITE_BEHIND:
+        # the viewer's own unflushed likes win over the database
+        pending = pending_likes([image.id for image in images], user.id)
+        for image in images:
+            state, _ = pending[image.id]
+            if state is not None:
+                image.liked_by_me = state
+    return images
+
+
+def attach_like_counts(images):
+    """Set image.like_count, including likes not flushed yet"""
+    images = list(images)
+    deltas = {}
+    if settings.LIKES_WRITE_BEHIND and images:
+        deltas = {
+            image_id: delta for image_id, (_, delta)
+            in pending_likes([image.id for image in images]).items()
+        }
+    for image in images:
+        image.like_count = max(image.total_likes + deltas.get(image.id, 0), 0)
+    return images
+
+
+def attach_card_context(images, comments=COMMENT_PREVIEW_SIZE):
+    """Attach the viewer-independent part of attach_social_context"""
+    images = list(images)
+    ids = [image.id for image in images]
+    if not ids:
+        return images
+    Like = Image.users_like.through
+
+    first_like_ids = (
+        Like.objects.filter(image_id__in=ids)
+        .values("image_id")
+        .annotate(first_id=Min("id"))
+        .values("first_id")
+    )
+    first_likers = {
+        like.image_id: like.user
+        for like in Like.objects.filter(id__in=first_like_ids)
+        .select_related("user")
+    }
+
+    previews = {}
+    latest = (
+        Comment.objects.filter(image_id__in=ids)
+        .annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=F("image_id"),
+                order_by=F("created").desc(),
+            )
+        )
+        .filter(position__lte=comments)
+        .select_related("user")
+        .order_by("image_id", "position")
+    )
+    for comment in latest:
+        previews.setdefault(comment.image_id, []).append(comment)
+
+    comment_counts = dict(
+        Comment.objects.filter(image_id__in=ids)
+        .values("image_id")
+        .annotate(total=Count("id"))
+        .values_list("image_id", "total")
+    )
+
+    attach_like_counts(images)
+    for image in images:
+        image.first_liker = first_likers.get(image.id)
+        image.comment_preview = previews.get(image.id, [])
+        image.comment_count = comment_counts.get(image.id, 0)
+    return images
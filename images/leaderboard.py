@@ -0,0 +1,137 @@
+"""
+Most viewed images per time window.
+
+Views are counted in hourly sorted sets (ranking:views:<YYYYMMDDHH>) that
+expire once no window needs them. refresh_leaderboards() merges the
+buckets of each window with ZUNIONSTORE, trims the result, and caches the
+top images with everything the ranking page shows, so serving the page
+is a single cache read. The all-time window comes from Image.total_views.
+
+Windows slide instead of starting on the hour: the bucket of the current
+hour is merged with as many full buckets before it as the window has, and
+the oldest of those is weighted by the share of its hour that is still
+inside the window. The "hour" board at 10:15 is 10:00's bucket plus three
+quarters of 09:00's, which assumes 09:00's views were evenly spread.
+"""
+from datetime import timedelta
+from django.core.cache import cache
+from django.utils import timezone
+from bookmarks.redis_client import UNAVAILABLE, r, background_r
+from .models import Image
+
+
+# window name -> number of hourly buckets
+WINDOWS = {"hour": 1, "day": 24, "week": 7 * 24}
+ALL_TIME = "all"
+LEADERBOARD_SIZE = 10
+# members kept in merged windows and in closed hourly buckets
+WINDOW_SIZE = 1000
+BUCKET_SIZE = 10000
+# one bucket more than the longest window, partly inside it
+BUCKET_TIMEOUT = (max(WINDOWS.values()) + 2) * 3600
+LEADERBOARD_TIMEOUT = 5 * 60
+
+
+def bucket_key(when):
+    return f"ranking:views:{when:%Y%m%d%H}"
+
+
+def window_key(window):
+    return f"ranking:views:window:{window}"
+
+
+def leaderboard_key(window):
+    return f"ranking:leaderboard:{window}"
+
+
+def track_view(pipe, image_id):
+    """Queue the commands counting a view of image_id on a pipeline"""
+    key = bucket_key(timezone.now())
+    pipe.zincrby(key, 1, image_id)
+    pipe.expire(key, BUCKET_TIMEOUT)
+
+
+def window_weights(window, now):
+    """Return {bucket key: weight} for the buckets making up a window"""
+    hours = WINDOWS[window]
+    weights = {bucket_key(now - timedelta(hours=h)): 1 for h in range(hours)}
+    elapsed = (now.minute * 60 + now.second) / 3600
+    if elapsed:
+        weights[bucket_key(now - timedelta(hours=hours))] = 1 - elapsed
+    return weights
+
+
+def _merge_window(client, window, now):
+    """Rebuild a window's sorted set and return its top image ids"""
+    key = window_key(window)
+    pipe = client.pipeline()
+    pipe.zunionstore(key, window_weights(window, now))
+    pipe.zremrangebyrank(key, 0, -WINDOW_SIZE - 1)
+    pipe.expire(key, LEADERBOARD_TIMEOUT)
+    pipe.zrange(key, 0, LEADERBOARD_SIZE - 1, desc=True, withscores=True)
+    ranked = pipe.execute()[-1]
+    return [(int(image_id), round(score)) for image_id, score in ranked]
+
+
+def _hydrate(ranked):
+    images = Image.objects.in_bulk([image_id for image_id, _ in ranked])
+    return [
+        {
+            "id": image_id,
+            "title": images[image_id].title,
+            "url": images[image_id].get_absolute_url(),
+            "views": views,
+        }
+        for image_id, views in ranked
+        if image_id in images
+    ]
+
+
+def _all_time():
+    return list(
+        Image.objects.order_by("-total_views")
+        .values_list("id", "total_views")[:LEADERBOARD_SIZE]
+    )
+
+
+def _build(window, now, client):
+    if window == ALL_TIME:
+        return _hydrate(_all_time())
+    return _hydrate(_merge_window(client, window, now))
+
+
+def build_leaderboard(window, now=None, client=r):
+    """Compute and cache the leaderboard for a window"""
+    entries = _build(window, now or timezone.now(), client)
+    cache.set(leaderboard_key(window), entries, LEADERBOARD_TIMEOUT)
+    return entries
+
+
+def get_leaderboard(window):
+    """Return the cached leaderboard for a window, building it if needed"""
+    try:
+        entries = cache.get(leaderboard_key(window))
+    except UNAVAILABLE:
+        entries = None
+    if entries is not None:
+        return entries
+    try:
+        entries = _build(window, timezone.now(), r)
+    except UNAVAILABLE:
+        # show the all-time board until Redis is back, uncached
+        return _hydrate(_all_time())
+    try:
+        cache.set(leaderboard_key(window), entries, LEADERBOARD_TIMEOUT)
+    except UNAVAILABLE:
+        pass
+    return entries
+
+
+def refresh_leaderboards():
+    """Rebuild every leaderboard and trim the previous hourly bucket"""
+    now = timezone.now()
+    # the previous hour is closed, keep its head for the longer windows
+    background_r.zremrangebyrank(bucket_key(now - timedelta(hours=1)),
+                                 0, -BUCKET_SIZE - 1)
+    for window in [*WINDOWS, ALL_TIME]:
+        build_leaderboard(window, now, background_r)
@@ -0,0 +1,331 @@
+"""
+Like bookkeeping for Image.total_likes.
+
+Counters are only ever changed with single-column delta updates, so
+concurrent likes on the same image cannot overwrite each other.
+
+With LIKES_WRITE_BEHIND enabled, likes and unlikes are recorded in Redis
+first and written to the database in bulk by flush_pending_likes(). Each
+image with unflushed likes has a hash at likes:pending:<image id> mapping
+user ids to "1" (like) or "0" (unlike), plus a "delta" field with the net
+change to its like count. While a flush runs, the hash is renamed to
+likes:flushing:<image id> so new likes keep going to a fresh hash.
+
+Every user also has a liked set at liked:<user id> with the ids of the
+images they like, so "did I like this" checks do not depend on how many
+likes an image has. Sets are loaded from the database on first use and
+marked with the member 0 (never an image id); a set without the marker
+is incomplete and is reloaded before it is trusted.
+"""
+from collections import Counter, defaultdict
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from actions.models import Action
+from actions.snapshots import load_snapshots
+from actions.utils import save_actions
+from bookmarks.redis_client import (
+    UNAVAILABLE, r, background_r, execute_or_buffer,
+)
+from .cards import bump_image_version
+from .models import Image
+
+
+Like = Image.users_like.through
+
+DIRTY_KEY = "likes:dirty"
+FLUSH_BATCH_SIZE = 500
+LIKED_SET_TIMEOUT = 7 * 24 * 3600
+LOADED = 0
+
+
+def pending_key(image_id):
+    return f"likes:pending:{image_id}"
+
+
+def flushing_key(image_id):
+    return f"likes:flushing:{image_id}"
+
+
+def liked_key(user_id):
+    return f"liked:{user_id}"
+
+
+def liked_image_ids(user_id, image_ids):
+    """Return the subset of image_ids that the user likes"""
+    image_ids = list(image_ids)
+    if not image_ids or not user_id:
+        return set()
+    key = liked_key(user_id)
+    try:
+        members = r.smismember(key, [LOADED] + image_ids)
+        if not members[0]:
+            members = [True] + _load_liked_set(user_id, image_ids)
+    except redis.RedisError:
+        # exact answer straight from the database
+        return set(
+            Like.objects.filter(user_id=user_id, image_id__in=image_ids)
+            .values_list("image_id", flat=True)
+        )
+    return {
+        image_id for image_id, liked in zip(image_ids, members[1:]) if liked
+    }
+
+
+def _load_liked_set(user_id, image_ids):
+    """
+    Merge the user's likes from the database into their liked set and mark
+    it loaded. Nothing is deleted first, so likes added to the set while
+    the database was read are kept. Unflushed likes of image_ids win over
+    the database, the others reach the set when they are flushed.
+    """
+    liked = set(
+        Like.objects.filter(user_id=user_id)
+        .values_list("image_id", flat=True)
+    )
+    unliked = set()
+    if settings.LIKES_WRITE_BEHIND:
+        for image_id, (state, _) in pending_likes(image_ids, user_id).items():
+            if state is not None:
+                (liked if state else unliked).add(image_id)
+        liked -= unliked
+    key = liked_key(user_id)
+    pipe = r.pipeline()
+    pipe.sadd(key, LOADED, *liked)
+    if unliked:
+        pipe.srem(key, *unliked)
+    pipe.expire(key, LIKED_SET_TIMEOUT)
+    pipe.smismember(key, image_ids)
+    return [bool(member) for member in pipe.execute()[-1]]
+
+
+def update_liked_sets(pairs, liked):
+    """
+    Add (liked=True) or remove (image id, user id) pairs in liked sets.
+    Call it once the likes are committed, or a concurrent load could read
+    the database before them.
+    """
+    by_user = defaultdict(list)
+    for image_id, user_id in pairs:
+        by_user[user_id].append(image_id)
+    if not by_user:
+        return
+
+    def queue(pipe):
+        for user_id, image_ids in by_user.items():
+            key = liked_key(user_id)
+            if liked:
+                pipe.sadd(key, *image_ids)
+            else:
+                # loads only add members, one that read the database before
+                # this unlike could put it back: drop the marker as well so
+                # the set is reloaded instead of trusted
+                pipe.srem(key, LOADED, *image_ids)
+            # sets created here lack the marker and expire like loaded ones
+            pipe.expire(key, LIKED_SET_TIMEOUT)
+
+    execute_or_buffer(r, queue)
+
+
+def adjust_total_likes(deltas):
+    """Apply {image id: delta} to total_likes, one UPDATE per delta value"""
+    by_delta = defaultdict(list)
+    for image_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(image_id)
+    for delta, image_ids in by_delta.items():
+        total = F("total_likes") + delta
+        if delta < 0:
+            # never go below zero if a counter had already drifted
+            total = Greatest(total, 0)
+        Image.objects.filter(id__in=image_ids).update(total_likes=total)
+
+
+def remove_likes(likes):
+    """
+    Delete a queryset of Like rows in bulk, for moderation or admin
+    clean-ups, and decrement the affected counters.
+    """
+    with transaction.atomic():
+        rows = list(likes.values_list("id", "image_id", "user_id"))
+        Like.objects.filter(id__in=[row[0] for row in rows]).delete()
+        removed = Counter(row[1] for row in rows)
+        adjust_total_likes(
+            {image_id: -total for image_id, total in removed.items()}
+        )
+    # bulk deletes do not send m2m_changed
+    update_liked_sets([row[1:] for row in rows], False)
+    bump_image_version(*removed)
+    return len(rows)
+
+
+def record_like(image_id, user_id, liked):
+    """
+    Buffer a like (liked=True) or unlike in Redis. Returns False when it
+    would not change anything, e.g. liking an image twice, and None when
+    Redis is unavailable and the caller should write to the database.
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.hget(pending_key(image_id), user_id)
+    pipe.hget(flushing_key(image_id), user_id)
+    try:
+        states = pipe.execute()
+    except UNAVAILABLE:
+        return None
+    state = next((s for s in states if s is not None), None)
+    if state is None:
+        current = Like.objects.filter(image_id=image_id,
+                                      user_id=user_id).exists()
+    else:
+        current = state == b"1"
+    if current == liked:
+        return False
+
+    pipe = r.pipeline()
+    pipe.hset(pending_key(image_id), user_id, int(liked))
+    pipe.hincrby(pending_key(image_id), "delta", 1 if liked else -1)
+    pipe.sadd(DIRTY_KEY, image_id)
+    try:
+        pipe.execute()
+    except UNAVAILABLE:
+        return None
+    update_liked_sets([(image_id, user_id)], liked)
+    return True
+
+
+def pending_likes(image_ids, user_id=None):
+    """
+    Return {image id: (liked, delta)} for the unflushed likes of the given
+    images. `liked` is the buffered like state of `user_id`, or None if
+    that user has nothing pending on the image. A flush drops its deltas
+    right after committing them, so they are only counted twice for that
+    one round trip.
+    """
+    image_ids = list(image_ids)
+    fields = ["delta"] if user_id is None else ["delta", user_id]
+    pipe = r.pipeline(transaction=False)
+    for image_id in image_ids:
+        pipe.hmget(pending_key(image_id), fields)
+        pipe.hmget(flushing_key(image_id), fields)
+    try:
+        replies = iter(pipe.execute())
+    except UNAVAILABLE:
+        return {image_id: (None, 0) for image_id in image_ids}
+    pending = {}
+    for image_id, current, flushing in zip(image_ids, replies, replies):
+        state = current[-1] if len(fields) > 1 else None
+        if state is None and len(fields) > 1:
+            state = flushing[-1]
+        pending[image_id] = (
+            None if state is None else state == b"1",
+            int(current[0] or 0) + int(flushing[0] or 0),
+        )
+    return pending
+
+
+def flush_pending_likes():
+    """Write buffered likes to the database, returning the number of images"""
+    flushed = 0
+    while True:
+        image_ids = [int(i) for i in background_r.spop(DIRTY_KEY, FLUSH_BATCH_SIZE)]
+        if not image_ids:
+            return flushed
+        try:
+            _flush(image_ids)
+        except Exception:
+            # the flushing hashes are kept and picked up by the next run
+            background_r.sadd(DIRTY_KEY, *image_ids)
+            raise
+        flushed += len(image_ids)
+
+
+def _flush(image_ids):
+    pipe = background_r.pipeline(transaction=False)
+    for image_id in image_ids:
+        # keeps a hash left over by a failed flush, it is processed first
+        pipe.renamenx(pending_key(image_id), flushing_key(image_id))
+    pipe.execute(raise_on_error=False)
+
+    pipe = background_r.pipeline(transaction=False)
+    for image_id in image_ids:
+        pipe.hgetall(flushing_key(image_id))
+    wanted = {}
+    for image_id, states in zip(image_ids, pipe.execute()):
+        for user_id, state in states.items():
+            if user_id != b"delta":
+                wanted[image_id, int(user_id)] = state == b"1"
+
+    changed = _write_likes(wanted) if wanted else []
+    # pending_likes() adds the flushing deltas to the database totals, drop
+    # them as soon as the new totals are visible and before cards are
+    # rendered again with them
+    background_r.delete(*[flushing_key(image_id) for image_id in image_ids])
+    bump_image_version(*changed)
+
+    # there may be more pending likes since the rename
+    pipe = background_r.pipeline(transaction=False)
+    for image_id in image_ids:
+        pipe.exists(pending_key(image_id))
+    leftover = [i for i, e in zip(image_ids, pipe.execute()) if e]
+    if leftover:
+        background_r.sadd(DIRTY_KEY, *leftover)
+
+
+def _write_likes(wanted):
+    """
+    Make the Like table match {(image id, user id): liked}, returning the
+    ids of the images whose like count changed.
+    """
+    image_ids = {image_id for image_id, _ in wanted}
+    user_ids = {user_id for _, user_id in wanted}
+    # likes on images or by users deleted in the meantime are dropped
+    image_ids = set(
+        Image.objects.filter(id__in=image_ids).values_list("id", flat=True)
+    )
+    user_ids = set(
+        User.objects.filter(id__in=user_ids).values_list("id", flat=True)
+    )
+    existing = {
+        (image_id, user_id): like_id
+        for like_id, image_id, user_id in Like.objects.filter(
+            image_id__in=image_ids, user_id__in=user_ids
+        ).values_list("id", "image_id", "user_id")
+    }
+    added = [
+        pair for pair, liked in wanted.items()
+        if liked and pair not in existing
+        and pair[0] in image_ids and pair[1] in user_ids
+    ]
+    removed = [
+        pair for pair, liked in wanted.items()
+        if not liked and pair in existing
+    ]
+
+    deltas = defaultdict(int)
+    for image_id, _ in added:
+        deltas[image_id] += 1
+    for image_id, _ in removed:
+        deltas[image_id] -= 1
+
+    image_ct = ContentType.objects.get_for_model(Image)
+    snapshots = load_snapshots(image_ct, {image_id for image_id, _ in added})
+    with transaction.atomic():
+        Like.objects.bulk_create(
+            [Like(image_id=i, user_id=u) for i, u in added],
+            ignore_conflicts=True,
+        )
+        Like.objects.filter(id__in=[existing[p] for p in removed]).delete()
+        adjust_total_likes(deltas)
+        save_actions([
+            Action(user_id=u, verb="likes", target_ct=image_ct, target_id=i,
+                   target_snapshot=snapshots[i])
+            for i, u in added
+        ])
+    # the sets already had these likes unless they were reloaded since
+    update_liked_sets(added, True)
+    update_liked_sets(removed, False)
+    return [image_id for image_id, delta in deltas.items() if delta]
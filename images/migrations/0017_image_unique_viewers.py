@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0016_image_total_views'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='unique_viewers',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['-unique_viewers'], name='images_imag_unique__b40d79_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+def dates_to_datetimes(apps, schema_editor):
+    # SQLite keeps the old 'YYYY-MM-DD' values, which do not parse as
+    # datetimes; other backends convert them when altering the column
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "UPDATE images_image SET created = created || ' 00:00:00' "
+            "WHERE length(created) = 10"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0017_image_unique_viewers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.RunPython(dates_to_datetimes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='storyimage',
+            name='image',
+            field=models.ImageField(db_index=True, upload_to='stories/%Y/%m/%d/'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', '-created'], name='images_imag_user_id_efc684_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+def create_search_table(apps, schema_editor):
+    # other databases search with icontains, see images.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE images_imagesearch "
+        "USING fts5(title, description, author, "
+        "tokenize='porter unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO images_imagesearch (rowid, title, description, author) "
+        "SELECT images_image.id, images_image.title, "
+        "images_image.description, auth_user.username || ' ' || "
+        "auth_user.first_name || ' ' || auth_user.last_name "
+        "FROM images_image "
+        "INNER JOIN auth_user ON auth_user.id = images_image.user_id"
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE images_imagesearch")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0018_image_created_datetime'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
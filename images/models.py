@@ -21,16 +21,22 @@ class Image(models.Model):
     image = models.ImageField(upload_to="images/%Y/%m/%d/")
     url = models.URLField(max_length=2000, blank=True)
     description = models.TextField(blank=True)
-    created = models.DateField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True)
     users_like = models.ManyToManyField(
         settings.AUTH_USER_MODEL, related_name="images_liked", blank=True
     )
     total_likes = models.PositiveIntegerField(default=0)
+    total_views = models.PositiveIntegerField(default=0)
+    unique_viewers = models.PositiveIntegerField(default=0)
 
     class Meta:
         indexes = [
             models.Index(fields=["-created"]),
+            # profile grids: a user's posts, newest first
+            models.Index(fields=["user", "-created"]),
             models.Index(fields=["-total_likes"]),
+            models.Index(fields=["-total_views"]),
+            models.Index(fields=["-unique_viewers"]),
         ]
         ordering = ["-created"]
 
@@ -86,7 +92,8 @@ class Story(models.Model):
 class StoryImage(models.Model):
     story = models.ForeignKey(Story, related_name='images',
                               on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='stories/%Y/%m/%d/')
+    # story views are logged by file path
+    image = models.ImageField(upload_to='stories/%Y/%m/%d/', db_index=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     viewers = models.ManyToManyField(settings.AUTH_USER_MODEL,
                                      related_name='viewed_stories', blank=True)
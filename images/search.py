@@ -0,0 +1,211 @@
+"""
+Full-text search over image titles, descriptions and author names.
+
+On SQLite the text lives in images_imagesearch, an FTS5 table holding the
+title, description and author ("username first_name last_name") of every
+image under its id. Image and User signals keep it in sync, and
+rebuild_index() refills it. Matches are ranked with BM25, titles weighing
+most. Titles and description snippets come back with the matched terms
+wrapped in <mark>.
+
+BM25 scores depend on the whole index, so they drift whenever images are
+added, edited or removed, and a (score, id) position from an earlier page
+would repeat or skip matches that moved across it. Like the ranked home
+feed, the cursor lists the ids shown so far and each page is the best of
+the other matches. Past SEARCH_SEEN_LIMIT ids the list stops growing and
+later pages continue below the last score, accepting the drift there.
+
+Other databases fall back to icontains lookups, newest first.
+"""
+import re
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from .feed import FeedPage, decode_cursor, encode_cursor, _older_than
+from .models import Image
+
+
+SEARCH_TABLE = "images_imagesearch"
+SEARCH_PAGE_SIZE = 30
+SEARCH_SEEN_LIMIT = 300
+# BM25 weights of the title, description and author columns
+WEIGHTS = (10.0, 2.0, 5.0)
+SNIPPET_TOKENS = 16
+# control characters cannot occur in the indexed text, they mark matches
+# until the text is escaped
+MARK_START, MARK_END = "\x02", "\x03"
+
+_INDEX_SQL = f"""
+    INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, title, description, author)
+    SELECT images_image.id, images_image.title, images_image.description,
+           auth_user.username || ' ' || auth_user.first_name || ' '
+           || auth_user.last_name
+    FROM images_image
+    INNER JOIN auth_user ON auth_user.id = images_image.user_id
+"""
+
+
+def _fts():
+    return connection.vendor == "sqlite"
+
+
+def index_image(image_id):
+    if _fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f"{_INDEX_SQL} WHERE images_image.id = %s",
+                           [image_id])
+
+
+def index_user_images(user_id):
+    """Reindex a user's images after their names changed"""
+    if _fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f"{_INDEX_SQL} WHERE images_image.user_id = %s",
+                           [user_id])
+
+
+def unindex_image(image_id):
+    if _fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+                           [image_id])
+
+
+def rebuild_index():
+    if _fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            cursor.execute(_INDEX_SQL)
+
+
+def match_expression(query):
+    """
+    FTS5 query matching every word of `query`, the last one as a prefix so
+    results show up while typing, or None if there are no words.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = ['"{}"'.format(word) for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _marked(text):
+    """Escape matched text, turning the match markers into <mark> tags"""
+    return mark_safe(
+        escape(text).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+    )
+
+
+def _ranked_ids(match, after, exclude, limit):
+    """
+    (score, id) pairs of the best matches after the `after` position,
+    leaving out the ids in `exclude`
+    """
+    weights = ", ".join(str(weight) for weight in WEIGHTS)
+    params = [match]
+    conditions = []
+    if exclude:
+        placeholders = ", ".join(["%s"] * len(exclude))
+        conditions.append(f"id NOT IN ({placeholders})")
+        params += exclude
+    if after is not None:
+        conditions.append("(score > %s OR (score = %s AND id > %s))")
+        params += [after[0], after[0], after[1]]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT score, id FROM ("
+            f"  SELECT bm25({SEARCH_TABLE}, {weights}) AS score, rowid AS id"
+            f"  FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+            f") {where} ORDER BY score, id LIMIT %s",
+            params + [limit],
+        )
+        return cursor.fetchall()
+
+
+def _highlights(match, image_ids):
+    """{image id: (highlighted title, description snippet)}"""
+    placeholders = ", ".join(["%s"] * len(image_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid,"
+            f"  highlight({SEARCH_TABLE}, 0, %s, %s),"
+            f"  snippet({SEARCH_TABLE}, 1, %s, %s, '…', %s)"
+            f" FROM {SEARCH_TABLE}"
+            f" WHERE {SEARCH_TABLE} MATCH %s AND rowid IN ({placeholders})",
+            [MARK_START, MARK_END, MARK_START, MARK_END, SNIPPET_TOKENS,
+             match, *image_ids],
+        )
+        return {
+            image_id: (_marked(title), _marked(snippet))
+            for image_id, title, snippet in cursor.fetchall()
+        }
+
+
+def _search_fts(query, state, per_page):
+    match = match_expression(query)
+    if match is None:
+        return [], None
+    seen = state.get("seen", [])
+    deep = len(seen) >= SEARCH_SEEN_LIMIT
+    rows = _ranked_ids(match, state.get("after") if deep else None, seen,
+                       per_page + 1)
+    page = rows[:per_page]
+    ids = [image_id for _, image_id in page]
+    images = Image.objects.select_related("user").in_bulk(ids)
+    highlights = _highlights(match, ids) if ids else {}
+    results = []
+    for image_id in ids:
+        if image_id in images:
+            image = images[image_id]
+            image.search_title, image.search_snippet = highlights.get(
+                image_id, (None, None)
+            )
+            results.append(image)
+    if len(rows) <= per_page:
+        return results, None
+    if not deep:
+        seen = seen + ids
+    return results, {"after": list(page[-1]), "seen": seen}
+
+
+def _search_database(query, state, per_page):
+    """Newest images first, matching query if there is one"""
+    images = Image.objects.select_related("user").order_by("-created", "-id")
+    if query:
+        for word in query.split():
+            images = images.filter(
+                Q(title__icontains=word)
+                | Q(description__icontains=word)
+                | Q(user__username__icontains=word)
+                | Q(user__first_name__icontains=word)
+                | Q(user__last_name__icontains=word)
+            )
+    images = _older_than(images, state.get("after"))
+    results = list(images[:per_page + 1])
+    state = None
+    if len(results) > per_page:
+        last = results[per_page - 1]
+        state = {"after": [0, last.created.isoformat(), last.id]}
+    return results[:per_page], state
+
+
+def search_images(query, cursor=None, per_page=SEARCH_PAGE_SIZE):
+    """
+    Return a FeedPage of images matching query, best first, or of the
+    newest images when there is no query. The cursor of a page is only
+    valid for the query it was made for.
+    """
+    query = (query or "").strip()
+    state = decode_cursor(cursor) or {}
+    if state.get("q") != query:
+        state = {}
+    if query and _fts():
+        results, state = _search_fts(query, state, per_page)
+    else:
+        results, state = _search_database(query, state, per_page)
+    next_cursor = encode_cursor({"q": query, **state}) if state else None
+    return FeedPage(results, next_cursor)
@@ -1,9 +1,117 @@
-from django.db.models.signals import m2m_changed
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
 from django.dispatch import receiver
-from .models import Image
+from account.counters import adjust_profile_counts
+from account.models import Profile
+from bookmarks.celery import delay_on_commit
+from .cards import bump_image_version, bump_user_version
+from .likes import adjust_total_likes, update_liked_sets
+from .models import Image, Comment
+from . import search, timeline
+from .tasks import fanout_image, remove_image_from_timelines
 
 
 @receiver(m2m_changed, sender=Image.users_like.through)
-def users_like_changed(sender, instance, **kwargs):
-    instance.total_likes = instance.users_like.count()
-    instance.save()
+def users_like_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Work out which (image id, user id) likes really change, then apply
+    # them to the like counters and the users' liked sets
+    if reverse:
+        # user.images_liked was changed, pk_set holds image ids
+        likes = sender.objects.filter(user_id=instance.id)
+        pairs = [(image_id, instance.id) for image_id in pk_set or ()]
+        lookup = "image_id__in"
+    else:
+        likes = sender.objects.filter(image_id=instance.id)
+        pairs = [(instance.id, user_id) for user_id in pk_set or ()]
+        lookup = "user_id__in"
+
+    if action in ("pre_remove", "pre_clear"):
+        if action == "pre_remove":
+            # remove() reports every requested id, not only existing likes
+            likes = likes.filter(**{lookup: pk_set})
+        instance._removed_likes = list(
+            likes.values_list("image_id", "user_id")
+        )
+    elif action == "post_add":
+        adjust_total_likes(Counter(image_id for image_id, _ in pairs))
+        transaction.on_commit(lambda: update_liked_sets(pairs, True))
+    elif action in ("post_remove", "post_clear"):
+        removed = instance._removed_likes
+        adjust_total_likes(
+            {i: -n for i, n in Counter(i for i, _ in removed).items()}
+        )
+        transaction.on_commit(lambda: update_liked_sets(removed, False))
+
+
+@receiver(post_save, sender=Image)
+def image_created(sender, instance, created, **kwargs):
+    if created:
+        adjust_profile_counts(instance.user_id, posts_count=1)
+        # push the new post to followers' timelines once it is committed
+        if timeline.enabled():
+            delay_on_commit(fanout_image, instance.id)
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance, **kwargs):
+    adjust_profile_counts(instance.user_id, posts_count=-1)
+    search.unindex_image(instance.id)
+    if timeline.enabled():
+        delay_on_commit(remove_image_from_timelines, instance.id,
+                        instance.user_id)
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, **kwargs):
+    search.index_image(instance.id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # images are searched by author name, a new user has no images yet
+    if created or (update_fields and set(update_fields) <= {"last_login"}):
+        return
+    search.index_user_images(instance.id)
+
+
+# Feed card cache invalidation
+
+@receiver(m2m_changed, sender=Image.users_like.through)
+def like_changed_card(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            bump_image_version(instance.id)
+        return
+    # user.images_liked was changed, pk_set holds image ids
+    if action == "post_clear":
+        # clear() does not report ids, users_like_changed collected them
+        bump_image_version(*[i for i, _ in instance._removed_likes])
+    elif action.startswith("post_"):
+        bump_image_version(*pk_set)
+
+
+@receiver(post_save, sender=Image)
+def image_changed_card(sender, instance, created, **kwargs):
+    if not created:
+        bump_image_version(instance.id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed_card(sender, instance, **kwargs):
+    bump_image_version(instance.image_id)
+
+
+@receiver(post_save, sender=Profile)
+def profile_changed_card(sender, instance, **kwargs):
+    bump_user_version(instance.user_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_changed_card(sender, instance, update_fields=None, **kwargs):
+    # logging in only touches last_login, which cards do not show
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    bump_user_version(instance.id)
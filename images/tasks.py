@@ -1,7 +1,12 @@
 from celery import shared_task
 from django.utils import timezone
 from datetime import timedelta
-from .models import Story
+from .models import Story, Image
+from . import timeline
+from .likes import flush_pending_likes as flush_likes
+from .viewcounts import flush_views, import_view_counters, \
+    rollup_unique_viewers as rollup_viewers
+from .leaderboard import refresh_leaderboards as refresh
 
 
 @shared_task
@@ -10,3 +15,49 @@ def delete_expired_stories():
     count = expired.count()
     expired.delete()
     return f"{count} expired stories deleted."
+
+
+@shared_task(ignore_result=True)
+def fanout_image(image_id):
+    try:
+        image = Image.objects.get(id=image_id)
+    except Image.DoesNotExist:
+        return "Image no longer exists."
+    pushed = timeline.fanout(image)
+    return f"Image {image_id} pushed to {pushed} timelines."
+
+
+@shared_task(ignore_result=True)
+def remove_image_from_timelines(image_id, author_id):
+    timeline.remove(image_id, author_id)
+    return f"Image {image_id} removed from timelines."
+
+
+@shared_task
+def flush_pending_likes():
+    flushed = flush_likes()
+    return f"Pending likes of {flushed} images flushed."
+
+
+@shared_task
+def flush_image_views():
+    flushed = flush_views()
+    return f"Views of {flushed} images flushed."
+
+
+@shared_task
+def import_image_views():
+    imported = import_view_counters()
+    return f"View counters of {imported} images imported."
+
+
+@shared_task
+def refresh_leaderboards():
+    refresh()
+    return "Leaderboards refreshed."
+
+
+@shared_task
+def rollup_unique_viewers():
+    rolled_up = rollup_viewers()
+    return f"Unique viewers of {rolled_up} images rolled up."
@@ -1,3 +1,712 @@
-from django.test import TestCase
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+from kombu.exceptions import OperationalError
+from PIL import Image as PILImage
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from account.models import Contact, Profile
+from account.tests import QueryPlanTestCase
+from bookmarks.tests import (
+    UNREACHABLE_CACHES, MemoryRedisTestCase, down_redis, use_redis,
+)
+from . import leaderboard, likes, ranking, search, timeline, viewcounts
+from .feed import attach_social_context, explore_page, home_page
+from .models import Comment, Image, Story, StoryImage
+from .tasks import fanout_image, remove_image_from_timelines
 
-# Create your tests here.
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageQueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([
+            User(username=f"user{i}") for i in range(20)
+        ])
+        Profile.objects.bulk_create([
+            Profile(user=user, photo="users/photo.png") for user in cls.users
+        ])
+        cls.user = cls.users[0]
+        cls.images = Image.objects.bulk_create([
+            Image(user=user, title=f"Image {i}", slug=f"image-{i}")
+            for i, user in enumerate(cls.users * 5)
+        ])
+        photo = BytesIO()
+        PILImage.new("RGB", (10, 10)).save(photo, "PNG")
+        cls.image = Image.objects.create(
+            user=cls.users[1], title="Photo",
+            image=ContentFile(photo.getvalue(), "photo.png"),
+        )
+        stories = Story.objects.bulk_create([
+            Story(user=user) for user in cls.users
+        ])
+        cls.story_images = StoryImage.objects.bulk_create([
+            StoryImage(story=story, image=f"stories/story-{i}-{j}.jpg")
+            for i, story in enumerate(stories)
+            for j in range(3)
+        ])
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_image_detail(self):
+        response = self.assertNoFullScans(self.client.get,
+                                          self.image.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+
+    def test_image_like(self):
+        for action in ["like", "unlike"]:
+            with self.subTest(action=action):
+                response = self.assertNoFullScans(
+                    self.client.post, reverse("images:like"),
+                    {"id": self.images[3].id, "action": action},
+                )
+                self.assertEqual(response.json()["status"], "ok")
+
+    def test_story_views(self):
+        story_image = self.story_images[1]
+        response = self.assertNoFullScans(
+            self.client.post, reverse("images:log_story_view"),
+            {"image_url": story_image.image.name},
+        )
+        self.assertEqual(response.json()["status"], "ok")
+        response = self.assertNoFullScans(
+            self.client.get, reverse("images:story_viewers"),
+            {"image_url": story_image.image.name},
+        )
+        self.assertEqual(response.json()["status"], "ok")
+
+    def test_search(self):
+        url = reverse("images:search")
+        for query in ["", "image 1", "user3"]:
+            with self.subTest(query=query):
+                response = self.assertNoFullScans(self.client.get, url,
+                                                  {"q": query})
+                self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, {"q": "photo"})
+        self.assertEqual(list(response.context["images"]), [self.image])
+        self.assertContains(response, "<mark>Photo</mark>")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TimelineSignalTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="author")
+
+    @mock.patch("actions.signals.refresh_action_snapshots.apply_async")
+    def create_and_delete(self, refresh):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(user=self.user, title="Post")
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+    @override_settings(HOME_FEED_MODE="shuffle")
+    @mock.patch.object(remove_image_from_timelines, "apply_async")
+    @mock.patch.object(fanout_image, "apply_async")
+    def test_no_tasks_outside_timeline_mode(self, fanout, remove):
+        self.create_and_delete()
+        fanout.assert_not_called()
+        remove.assert_not_called()
+
+    @override_settings(HOME_FEED_MODE="timeline")
+    @mock.patch.object(remove_image_from_timelines, "apply_async",
+                       side_effect=OperationalError("broker down"))
+    @mock.patch.object(fanout_image, "apply_async",
+                       side_effect=OperationalError("broker down"))
+    def test_broker_outage_is_logged(self, fanout, remove):
+        with self.assertLogs("bookmarks.celery", "ERROR"):
+            self.create_and_delete()
+        # published once, without retrying against the broker
+        fanout.assert_called_once_with((mock.ANY,), retry=False)
+        remove.assert_called_once_with((mock.ANY, self.user.id), retry=False)
+        self.assertFalse(Image.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TimelineFanoutTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, cls.author, cls.other = User.objects.bulk_create([
+            User(username=f"user{i}") for i in range(3)
+        ])
+        Contact.objects.bulk_create([
+            Contact(user_from=cls.viewer, user_to=cls.author),
+            Contact(user_from=cls.viewer, user_to=cls.other),
+        ])
+
+    def post(self, user, fanout_limit):
+        image = Image.objects.create(user=user, title="Post")
+        with self.settings(TIMELINE_FANOUT_LIMIT=fanout_limit):
+            timeline.fanout(image)
+        return image.id
+
+    def read(self):
+        return timeline.read(self.viewer.id, [self.author.id, self.other.id])
+
+    def test_pulled_posts_pushed_when_back_under_limit(self):
+        first = self.post(self.other, 10)
+        self.assertEqual(self.read(), [first])
+        pulled = self.post(self.author, 0)
+        self.assertEqual(self.read(), [pulled, first])
+        pushed = self.post(self.author, 10)
+        self.assertFalse(self.redis.sismember(timeline.PULL_AUTHORS_KEY,
+                                              self.author.id))
+        self.assertEqual(self.read(), [pushed, pulled, first])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FeedPaginationTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, *cls.authors = User.objects.bulk_create([
+            User(username=f"user{i}") for i in range(4)
+        ])
+        cls.images = Image.objects.bulk_create([
+            Image(user=author, title=f"Image {i}", slug=f"image-{i}")
+            for i, author in enumerate(cls.authors * 8)
+        ])
+
+    def setUp(self):
+        super().setUp()
+        ranking._candidates.update(arrays=None, expires=0)
+
+    def pages(self, per_page, followed_ids=()):
+        cursor = None
+        while True:
+            page = home_page(self.viewer, list(followed_ids), cursor,
+                             per_page)
+            yield page.object_list
+            if not page.has_next():
+                return
+            cursor = page.next_cursor
+
+    def assertAllOnce(self, ids):
+        self.assertEqual(sorted(ids), sorted(image.id for image in self.images))
+
+    @override_settings(HOME_FEED_MODE="ranked")
+    def test_ranked_scores_change_between_pages(self):
+        shown = []
+        for ids in self.pages(3, [self.authors[0].id]):
+            shown += ids
+            # the oldest image not shown yet jumps ahead of all the others
+            unseen = {image.id for image in self.images} - set(shown)
+            if unseen:
+                Image.objects.filter(id=min(unseen)).update(
+                    total_likes=100 + len(shown)
+                )
+            ranking._candidates.update(arrays=None, expires=0)
+        self.assertAllOnce(shown)
+
+    @override_settings(HOME_FEED_MODE="ranked", FEED_RANKING_SEEN_LIMIT=6)
+    def test_ranked_past_seen_limit(self):
+        self.assertAllOnce(sum(self.pages(4, [self.authors[0].id]), []))
+
+    @override_settings(HOME_FEED_MODE="shuffle")
+    def test_shuffle_pages(self):
+        followed = self.authors[0]
+        pages = list(self.pages(5, [followed.id]))
+        shown = sum(pages, [])
+        self.assertAllOnce(shown)
+        authors = dict(Image.objects.values_list("id", "user_id"))
+        # followed posts first, then the suggested ones
+        self.assertEqual([authors[i] == followed.id for i in shown],
+                         [True] * 8 + [False] * 16)
+        # the first page keeps its order within a shuffle period
+        self.assertEqual(next(self.pages(5, [followed.id])), pages[0])
+
+    def test_explore_pages(self):
+        followed = self.authors[1]
+        shown, cursor = [], None
+        while True:
+            page = explore_page([followed.id], cursor, per_page=5)
+            shown += [image.id for image in page]
+            # newer posts do not shift the pages after the cursor
+            Image.objects.create(user=followed, title="New")
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertAllOnce(shown)
+        authors = dict(Image.objects.values_list("id", "user_id"))
+        self.assertEqual([authors[i] == followed.id for i in shown],
+                         [True] * 8 + [False] * 16)
+
+    def test_explore_page_is_one_bounded_query(self):
+        followed = self.authors[1]
+        cursor = explore_page([followed.id], per_page=6).next_cursor
+        # the page crossing from followed users to the others
+        with CaptureQueriesContext(connection) as queries:
+            page = explore_page([followed.id], cursor, per_page=6)
+        [query] = queries.captured_queries
+        self.assertIn("UNION ALL", query["sql"])
+        self.assertIn("LIMIT 7", query["sql"])
+        self.assertEqual(len(page.object_list), 6)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SocialContextTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, *cls.users = User.objects.bulk_create([
+            User(username=f"user{i}") for i in range(4)
+        ])
+        cls.images = Image.objects.bulk_create([
+            Image(user=user, title=f"Image {i}", slug=f"image-{i}")
+            for i, user in enumerate(cls.users * 2)
+        ])
+        liked, commented = cls.images[:2]
+        for user in [cls.users[1], cls.viewer, cls.users[2]]:
+            liked.users_like.add(user)
+        Image.objects.filter(id=liked.id).update(total_likes=3)
+        start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        cls.comments = Comment.objects.bulk_create([
+            Comment(image=commented, user=cls.users[0], text=f"Comment {i}")
+            for i in range(5)
+        ])
+        for i, comment in enumerate(cls.comments):
+            Comment.objects.filter(id=comment.id).update(
+                created=start + timedelta(minutes=i)
+            )
+
+    def attach(self, count):
+        images = list(Image.objects.filter(id__in=[
+            image.id for image in self.images[:count]
+        ]).order_by("id"))
+        with CaptureQueriesContext(connection) as queries:
+            attach_social_context(images, self.viewer)
+        return images, len(queries)
+
+    def test_queries_do_not_grow_with_the_page(self):
+        # the first call loads the viewer's liked set
+        self.attach(1)
+        _, few = self.attach(2)
+        images, many = self.attach(len(self.images))
+        self.assertEqual(few, many)
+
+        liked, commented, plain = images[:3]
+        self.assertEqual((liked.liked_by_me, liked.like_count,
+                          liked.first_liker), (True, 3, self.users[1]))
+        self.assertEqual((plain.liked_by_me, plain.like_count,
+                          plain.first_liker), (False, 0, None))
+        self.assertEqual(
+            [comment.text for comment in commented.comment_preview],
+            ["Comment 4", "Comment 3", "Comment 2"],
+        )
+        self.assertEqual(commented.comment_count, 5)
+        self.assertEqual((plain.comment_preview, plain.comment_count),
+                         ([], 0))
+
+
+@override_settings(CACHES=UNREACHABLE_CACHES)
+class RedisDownTests(MemoryRedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(use_redis(down_redis()))
+
+    def test_register_comment_and_like(self):
+        response = self.client.post(reverse("register"), {
+            "username": "new", "first_name": "New",
+            "email": "new@example.com",
+            "password": "secret", "password2": "secret",
+        })
+        self.assertRedirects(response, reverse("my_profile"),
+                             fetch_redirect_response=False)
+        user = User.objects.get(username="new")
+        image = Image.objects.create(user=user, title="Post")
+        Comment.objects.create(image=image, user=user, text="Nice")
+        self.client.force_login(user)
+        response = self.client.post(reverse("images:like"),
+                                    {"id": image.id, "action": "like"})
+        self.assertEqual(response.json()["status"], "ok")
+        image.refresh_from_db()
+        self.assertEqual(image.total_likes, 1)
+
+    def test_ranking_page(self):
+        user = User.objects.create(username="viewer")
+        Image.objects.create(user=user, title="Post", total_views=3)
+        self.client.force_login(user)
+        response = self.client.get(reverse("images:ranking"),
+                                   {"window": "hour"})
+        self.assertContains(response, "Post")
+
+    def test_home_renders_uncached_cards(self):
+        user = User.objects.create(username="viewer")
+        Profile.objects.filter(user=user).update(photo="users/photo.png")
+        Image.objects.create(user=user, title="Post")
+        self.client.force_login(user)
+        response = self.client.get(reverse("home"))
+        self.assertContains(response, "Post")
+
+
+@skipUnless(connection.vendor == "sqlite", "uses SQLite's FTS5")
+class SearchPaginationTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="author")
+        cls.images = [
+            Image.objects.create(user=cls.user, title=f"Cat {i}",
+                                 description="word " * i)
+            for i in range(6)
+        ]
+
+    def pages(self, change=lambda shown: None, per_page=2):
+        shown, cursor = [], None
+        for _ in range(10):
+            page = search.search_images("cat", cursor, per_page)
+            shown += [image.id for image in page]
+            cursor = page.next_cursor
+            if cursor is None:
+                return shown
+            change(shown)
+        self.fail("search did not end")
+
+    def assertAllOnce(self, shown):
+        self.assertEqual(len(shown), len(set(shown)))
+        self.assertLessEqual({image.id for image in self.images}, set(shown))
+
+    def test_scores_drift_between_pages(self):
+        def change(shown):
+            # new matches change every BM25 score, an unseen one jumps
+            Image.objects.create(user=self.user, title="Dog",
+                                 description=f"cat {len(shown)}")
+            unseen = Image.objects.exclude(id__in=shown).filter(
+                title__startswith="Cat "
+            ).last()
+            if unseen:
+                unseen.title = "Cat cat cat"
+                unseen.save()
+
+        self.assertAllOnce(self.pages(change))
+
+    @mock.patch.object(search, "SEARCH_SEEN_LIMIT", 2)
+    def test_past_seen_limit(self):
+        self.assertAllOnce(self.pages())
+
+    def test_open_to_visitors(self):
+        response = self.client.get(reverse("images:search"), {"q": "cat"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.images[0].get_absolute_url())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LeaderboardTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username="author")
+        cls.old, cls.new = [
+            Image.objects.create(user=user, title=title)
+            for title in ("Old", "New")
+        ]
+
+    def view(self, image, when, count):
+        with mock.patch("django.utils.timezone.now", return_value=when):
+            for _ in range(count):
+                leaderboard.track_view(self.redis, image.id)
+
+    def test_hour_window_slides(self):
+        self.view(self.old, datetime(2026, 1, 1, 9, 50, tzinfo=timezone.utc), 8)
+        self.view(self.new, datetime(2026, 1, 1, 10, 5, tzinfo=timezone.utc), 3)
+        now = datetime(2026, 1, 1, 10, 15, tzinfo=timezone.utc)
+        entries = leaderboard.build_leaderboard("hour", now)
+        # three quarters of 09:00 are still inside the last hour
+        self.assertEqual(
+            [(entry["title"], entry["views"]) for entry in entries],
+            [("Old", 6), ("New", 3)],
+        )
+        entries = leaderboard.build_leaderboard("hour", now.replace(hour=11))
+        self.assertEqual([entry["title"] for entry in entries], ["New"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ViewCountTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="author")
+        Profile.objects.filter(user=cls.user).update(photo="users/photo.png")
+        cls.images = [
+            Image.objects.create(user=cls.user, title=f"Image {i}")
+            for i in range(2)
+        ]
+
+    def total_views(self):
+        return list(Image.objects.order_by("id")
+                    .values_list("total_views", flat=True))
+
+    def test_one_round_trip(self):
+        image = self.images[0]
+        with mock.patch.object(self.redis, "pipeline",
+                               wraps=self.redis.pipeline) as pipeline:
+            response = self.client.get(image.get_absolute_url())
+        pipeline.assert_called_once()
+        self.assertEqual(response.context["total_views"], 1)
+
+    def test_flush(self):
+        first, second = self.images
+        for image in [first, first, second]:
+            viewcounts.record_view(image.id, "u:1")
+        self.assertEqual(viewcounts.flush_views(), 2)
+        self.assertEqual(self.total_views(), [2, 1])
+        self.assertEqual(viewcounts.flush_views(), 0)
+        self.assertEqual(self.total_views(), [2, 1])
+
+    def test_failed_flush_is_retried(self):
+        image = self.images[0]
+        viewcounts.record_view(image.id, "u:1")
+        self.redis.rename(viewcounts.PENDING_KEY, viewcounts.FLUSHING_KEY)
+        # counted while the failed flush's hash is still around
+        viewcounts.record_view(image.id, "u:1")
+        viewcounts.flush_views()
+        self.assertEqual(self.total_views(), [1, 0])
+        viewcounts.flush_views()
+        self.assertEqual(self.total_views(), [2, 0])
+
+    def view_on(self, day, viewer):
+        when = datetime.combine(day, datetime.min.time(), timezone.utc)
+        with mock.patch("django.utils.timezone.now", return_value=when):
+            return viewcounts.record_view(self.images[0].id, viewer)
+
+    def test_unique_viewers(self):
+        day = datetime(2026, 1, 1).date()
+        next_day = day + timedelta(days=1)
+        self.assertEqual(self.view_on(day, "u:1"), (1, 1))
+        self.assertEqual(self.view_on(day, "u:1"), (2, 1))
+        self.assertEqual(self.view_on(day, "s:visitor"), (3, 2))
+        # the previous day counts until it is rolled up
+        self.assertEqual(self.view_on(next_day, "u:1"), (4, 2))
+
+        for _ in range(2):
+            self.assertEqual(viewcounts.rollup_unique_viewers(day), 1)
+            self.assertEqual(
+                list(Image.objects.order_by("id")
+                     .values_list("unique_viewers", flat=True)),
+                [2, 0],
+            )
+        self.assertEqual(self.view_on(next_day, "u:2"), (5, 3))
+        viewcounts.rollup_unique_viewers(next_day)
+        self.assertEqual(Image.objects.get(id=self.images[0].id)
+                         .unique_viewers, 3)
+
+    def test_viewer_token(self):
+        self.client.get(self.images[0].get_absolute_url(),
+                        HTTP_USER_AGENT="browser")
+        self.client.get(self.images[0].get_absolute_url(),
+                        HTTP_USER_AGENT="browser")
+        self.client.force_login(self.user)
+        response = self.client.get(self.images[0].get_absolute_url())
+        self.assertEqual(response.context["total_views"], 3)
+        self.assertEqual(response.context["unique_viewers"], 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FeedApiTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create(username="viewer")
+        cls.author = User.objects.create(username="author")
+        cls.images = [
+            Image.objects.create(user=cls.author, title=f"Image {i}")
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.viewer)
+
+    def test_etag(self):
+        url = reverse("images:feed_api")
+        response = self.client.get(url, {"fields": "id,likes,liked"})
+        etag = response["ETag"]
+        self.assertCountEqual(response.json()["cards"], [
+            {"id": image.id, "likes": 0, "liked": False}
+            for image in self.images
+        ])
+        # the first page keeps its order, unchanged cards are not rebuilt
+        with self.assertNumQueries(5):
+            response = self.client.get(url, {"fields": "id,likes,liked"},
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.images[1].users_like.add(self.viewer)
+        response = self.client.get(url, {"fields": "id,likes,liked"},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIn({"id": self.images[1].id, "likes": 1, "liked": True},
+                      response.json()["cards"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, LIKES_WRITE_BEHIND=True)
+class WriteBehindLikeTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, *cls.users = [
+            User.objects.create(username=f"user{i}") for i in range(3)
+        ]
+        Profile.objects.filter(user=cls.author).update(
+            photo="users/photo.png"
+        )
+        cls.image = Image.objects.create(user=cls.author, title="Post")
+        cls.image.users_like.add(cls.users[1])
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.users[0])
+
+    def assertLikes(self, count, liked):
+        response = self.client.get(self.image.get_absolute_url())
+        self.assertEqual(response.context["image"].like_count, count)
+        self.assertEqual(response.context["image"].liked_by_me, liked)
+
+    def test_flush(self):
+        self.assertTrue(likes.record_like(self.image.id, self.users[0].id,
+                                          True))
+        self.assertFalse(likes.record_like(self.image.id, self.users[0].id,
+                                           True))
+        self.assertTrue(likes.record_like(self.image.id, self.users[1].id,
+                                          False))
+        self.assertEqual(likes.pending_likes([self.image.id],
+                                             self.users[0].id),
+                         {self.image.id: (True, 0)})
+        self.assertLikes(1, True)
+
+        self.assertEqual(likes.flush_pending_likes(), 1)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.total_likes, 1)
+        self.assertQuerySetEqual(self.image.users_like.all(), [self.users[0]])
+        self.assertEqual(self.redis.keys("likes:*"), [])
+        self.assertLikes(1, True)
+
+    def test_flush_while_liking(self):
+        likes.record_like(self.image.id, self.users[0].id, True)
+        likes.background_r.rename(likes.pending_key(self.image.id),
+                                  likes.flushing_key(self.image.id))
+        # a like arriving during the flush goes to a new pending hash
+        likes.record_like(self.image.id, self.users[1].id, False)
+        likes.flush_pending_likes()
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.total_likes, 1)
+        self.assertEqual(likes.pending_likes([self.image.id]),
+                         {self.image.id: (None, 0)})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LikeCounterTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, *cls.users = [
+            User.objects.create(username=f"user{i}") for i in range(4)
+        ]
+        cls.images = [
+            Image.objects.create(user=cls.author, title=f"Image {i}")
+            for i in range(2)
+        ]
+
+    def totals(self):
+        return list(Image.objects.order_by("id")
+                    .values_list("total_likes", flat=True))
+
+    def test_add_remove_and_clear(self):
+        image, other = self.images
+        first, second, third = self.users
+        Image.objects.filter(id=image.id).update(title="Renamed")
+        with CaptureQueriesContext(connection) as queries:
+            image.users_like.add(first, second)
+        updates = [q["sql"] for q in queries.captured_queries
+                   if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertRegex(updates[0], r'SET "total_likes" = \(?"images_image"')
+        # the stale instance did not write its other columns back
+        self.assertEqual(Image.objects.get(id=image.id).title, "Renamed")
+
+        image.users_like.add(first)
+        third.images_liked.add(image, other)
+        self.assertEqual(self.totals(), [3, 1])
+        image.users_like.remove(first, first)
+        other.users_like.remove(second)
+        self.assertEqual(self.totals(), [2, 1])
+        image.users_like.clear()
+        self.assertEqual(self.totals(), [0, 1])
+
+    def test_bulk_removal(self):
+        image, other = self.images
+        for user in self.users:
+            user.images_liked.add(image, other)
+        liked = likes.liked_image_ids(self.users[0].id, [image.id, other.id])
+        self.assertEqual(liked, {image.id, other.id})
+        removed = likes.remove_likes(
+            likes.Like.objects.filter(user__in=self.users[:2])
+        )
+        self.assertEqual(removed, 4)
+        self.assertEqual(self.totals(), [1, 1])
+        self.assertEqual(
+            likes.liked_image_ids(self.users[0].id, [image.id, other.id]),
+            set(),
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LikedSetTests(MemoryRedisTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="user")
+        cls.images = [
+            Image.objects.create(user=cls.user, title=f"Image {i}")
+            for i in range(3)
+        ]
+
+    def liked(self):
+        return likes.liked_image_ids(self.user.id,
+                                     [image.id for image in self.images])
+
+    def test_load_keeps_concurrent_likes(self):
+        first, second, third = self.images
+        with self.captureOnCommitCallbacks(execute=True):
+            first.users_like.add(self.user)
+        # liked while the set was being loaded, not read from the database
+        likes.update_liked_sets([(second.id, self.user.id)], True)
+        self.assertEqual(self.liked(), {first.id, second.id})
+        self.assertTrue(self.redis.sismember(likes.liked_key(self.user.id),
+                                             likes.LOADED))
+
+    def test_unlike_forces_reload(self):
+        first, second, third = self.images
+        with self.captureOnCommitCallbacks(execute=True):
+            first.users_like.add(self.user)
+            third.users_like.add(self.user)
+        self.assertEqual(self.liked(), {first.id, third.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            first.users_like.remove(self.user)
+        self.assertFalse(self.redis.sismember(likes.liked_key(self.user.id),
+                                              likes.LOADED))
+        self.assertEqual(self.liked(), {third.id})
+
+    @override_settings(LIKES_WRITE_BEHIND=True)
+    def test_load_applies_pending_likes(self):
+        first, second, third = self.images
+        with self.captureOnCommitCallbacks(execute=True):
+            first.users_like.add(self.user)
+        likes.record_like(first.id, self.user.id, False)
+        likes.record_like(second.id, self.user.id, True)
+        self.redis.delete(likes.liked_key(self.user.id))
+        self.assertEqual(self.liked(), {second.id})
@@ -0,0 +1,246 @@
+"""
+Follower timelines stored as capped Redis sorted sets.
+
+Every timeline holds the newest image ids posted by the users someone
+follows, scored by image id so newer posts sort first. A timeline always
+contains every followed post newer than its oldest entry; anything older
+is read from the database. Authors with more than TIMELINE_FANOUT_LIMIT
+followers are not pushed to timelines and are merged in at read time,
+until a post of theirs finds them back under the limit and pushes their
+recent posts along with it.
+
+Timelines are only kept up to date while HOME_FEED_MODE is "timeline".
+Delete the timeline:* keys when switching the mode on, so that stale
+timelines are rebuilt on read instead of missing the posts made meanwhile.
+"""
+from django.conf import settings
+from account.models import Contact
+from bookmarks.redis_client import UNAVAILABLE, r, background_r
+from .models import Image
+
+
+PULL_AUTHORS_KEY = "timeline:pull_authors"
+
+
+def enabled():
+    return settings.HOME_FEED_MODE == "timeline"
+
+
+def timeline_key(user_id):
+    return f"timeline:{user_id}"
+
+
+def follower_ids(author_id):
+    return (
+        Contact.objects.filter(user_to_id=author_id)
+        .exclude(user_from_id=author_id)
+        .values_list("user_from_id", flat=True)
+    )
+
+
+def fanout(image):
+    """Push a new image into the timelines of its author's followers"""
+    followers = follower_ids(image.user_id)
+    if followers.count() > settings.TIMELINE_FANOUT_LIMIT:
+        # Too many followers: readers pull this author's posts instead
+        background_r.sadd(PULL_AUTHORS_KEY, image.user_id)
+        return 0
+    image_ids = [image.id]
+    if background_r.srem(PULL_AUTHORS_KEY, image.user_id):
+        # Back under the limit: the posts readers used to pull are in no
+        # timeline, push them along with the new one
+        image_ids = list(
+            Image.objects.filter(user_id=image.user_id)
+            .order_by("-id")
+            .values_list("id", flat=True)[: settings.TIMELINE_LENGTH]
+        )
+    pushed = 0
+    batch = []
+    for follower_id in followers.iterator(chunk_size=1000):
+        batch.append(follower_id)
+        if len(batch) == 1000:
+            pushed += _push(batch, image_ids)
+            batch = []
+    if batch:
+        pushed += _push(batch, image_ids)
+    return pushed
+
+
+def _push(follower_ids, image_ids):
+    keys = [timeline_key(follower_id) for follower_id in follower_ids]
+    tails = [None] * len(keys)
+    if len(image_ids) > 1:
+        pipe = background_r.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrange(key, 0, 0, withscores=True)
+        tails = [
+            int(oldest[0][1]) if oldest else None for oldest in pipe.execute()
+        ]
+    pipe = background_r.pipeline(transaction=False)
+    for key, tail in zip(keys, tails):
+        # Posts older than the tail are read from the database already,
+        # adding them would hide the other authors' posts missing there
+        ids = [i for i in image_ids if tail is not None and i >= tail]
+        ids = ids or image_ids[:1]
+        pipe.zadd(key, {image_id: image_id for image_id in ids})
+        pipe.zremrangebyrank(key, 0, -settings.TIMELINE_LENGTH - 1)
+    pipe.execute()
+    return len(keys)
+
+
+def remove(image_id, author_id):
+    """Remove a deleted image from its author's followers' timelines"""
+    pipe = background_r.pipeline(transaction=False)
+    for i, follower_id in enumerate(
+        follower_ids(author_id).iterator(chunk_size=1000), 1
+    ):
+        pipe.zrem(timeline_key(follower_id), image_id)
+        if i % 1000 == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def _tail(user_id):
+    oldest = r.zrange(timeline_key(user_id), 0, 0, withscores=True)
+    return int(oldest[0][1]) if oldest else None
+
+
+def _discard(user_id):
+    """Drop a timeline that could not be updated, it is rebuilt on read"""
+    r.buffer.delete(timeline_key(user_id))
+
+
+def backfill(follower_id, *followee_ids):
+    """Add newly followed users' recent posts to a follower's timeline"""
+    if not enabled():
+        return
+    try:
+        _backfill(follower_id, followee_ids)
+    except UNAVAILABLE:
+        _discard(follower_id)
+
+
+def _backfill(follower_id, followee_ids):
+    pulled = r.smismember(PULL_AUTHORS_KEY, followee_ids)
+    followee_ids = [i for i, p in zip(followee_ids, pulled) if not p]
+    if not followee_ids:
+        return
+    tail = _tail(follower_id)
+    if tail is None:
+        # No timeline yet, it is built on the next read
+        return
+    ids = list(
+        Image.objects.filter(user_id__in=followee_ids, id__gt=tail)
+        .order_by("-id")
+        .values_list("id", flat=True)[: settings.TIMELINE_LENGTH]
+    )
+    if ids:
+        key = timeline_key(follower_id)
+        pipe = r.pipeline()
+        pipe.zadd(key, {image_id: image_id for image_id in ids})
+        pipe.zremrangebyrank(key, 0, -settings.TIMELINE_LENGTH - 1)
+        pipe.execute()
+
+
+def purge(follower_id, *followee_ids):
+    """Drop unfollowed users' posts from a follower's timeline"""
+    if not enabled():
+        return
+    try:
+        _purge(follower_id, followee_ids)
+    except UNAVAILABLE:
+        _discard(follower_id)
+
+
+def _purge(follower_id, followee_ids):
+    tail = _tail(follower_id)
+    if tail is None:
+        return
+    ids = list(
+        Image.objects.filter(user_id__in=followee_ids, id__gte=tail)
+        .values_list("id", flat=True)
+    )
+    if ids:
+        r.zrem(timeline_key(follower_id), *ids)
+
+
+def rebuild(user_id, followed_ids):
+    """Fill a missing timeline from the database and return its tail"""
+    pull_authors = {int(a) for a in r.smembers(PULL_AUTHORS_KEY)}
+    ids = list(
+        Image.objects.filter(user_id__in=followed_ids)
+        .exclude(user_id__in=pull_authors)
+        .order_by("-id")
+        .values_list("id", flat=True)[: settings.TIMELINE_LENGTH]
+    )
+    if ids:
+        r.zadd(timeline_key(user_id), {image_id: image_id for image_id in ids})
+        return ids[-1]
+    return None
+
+
+def read(user_id, followed_ids, before=None, count=20):
+    """
+    Return up to `count` followed image ids older than `before`, newest
+    first. The common case is a single Redis round trip; without Redis
+    everything is read from the database.
+    """
+    key = timeline_key(user_id)
+    pipe = r.pipeline(transaction=False)
+    pipe.exists(key)
+    pipe.zrevrangebyscore(
+        key, f"({before}" if before else "+inf", "-inf", start=0, num=count
+    )
+    pipe.zrange(key, 0, 0, withscores=True)
+    pipe.smembers(PULL_AUTHORS_KEY)
+    try:
+        exists, ids, oldest, pull_authors = pipe.execute()
+    except UNAVAILABLE:
+        return _read_database(followed_ids, [], None, before, count)
+
+    if exists:
+        ids = [int(image_id) for image_id in ids]
+        tail = int(oldest[0][1]) if oldest else None
+    else:
+        try:
+            tail = rebuild(user_id, followed_ids)
+            ids = []
+            if tail is not None:
+                ids = [
+                    int(image_id) for image_id in r.zrevrangebyscore(
+                        key, f"({before}" if before else "+inf", "-inf",
+                        start=0, num=count,
+                    )
+                ]
+        except UNAVAILABLE:
+            return _read_database(followed_ids, [], None, before, count)
+
+    # Fan-out-on-read for authors that are too big to push
+    pulled = set(followed_ids) & {int(a) for a in pull_authors}
+    if pulled and tail is not None:
+        recent = Image.objects.filter(user_id__in=pulled, id__gte=tail)
+        if before:
+            recent = recent.filter(id__lt=before)
+        ids = sorted(
+            set(ids) | set(
+                recent.order_by("-id").values_list("id", flat=True)[:count]
+            ),
+            reverse=True,
+        )[:count]
+
+    return _read_database(followed_ids, ids, tail, before, count)
+
+
+def _read_database(followed_ids, ids, tail, before, count):
+    """Posts older than the timeline's oldest entry come from the database"""
+    if len(ids) < count:
+        bounds = [x for x in (tail, before) if x is not None]
+        older = Image.objects.filter(user_id__in=followed_ids)
+        if bounds:
+            older = older.filter(id__lt=min(bounds))
+        ids += list(
+            older.order_by("-id").values_list("id", flat=True)[
+                : count - len(ids)
+            ]
+        )
+    return ids
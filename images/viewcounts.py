@@ -0,0 +1,182 @@
+"""
+Image view counting.
+
+A view is recorded with a single pipelined round trip: the per-image
+counter shown on the detail page, the hourly ranking bucket and a
+pending delta.
+flush_views() periodically adds the pending deltas to Image.total_views,
+so views can be sorted and filtered on in the database.
+
+Unique viewers are counted in one HyperLogLog per image and day (about
+12 KB each at most, whatever the number of viewers).
+rollup_unique_viewers() merges each day into the image's all-time
+HyperLogLog and stores the estimate in Image.unique_viewers.
+"""
+from datetime import timedelta
+import hashlib
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from bookmarks.redis_client import r, background_r, execute_or_buffer
+from .leaderboard import track_view
+from .models import Image
+
+
+PENDING_KEY = "image_views:pending"
+FLUSHING_KEY = "image_views:flushing"
+FLUSH_BATCH_SIZE = 500
+# daily unique viewers are kept for a month after the day ends
+DAILY_VIEWERS_TIMEOUT = 31 * 24 * 3600
+
+
+def counter_key(image_id):
+    return f"image:{image_id}:views"
+
+
+def viewers_key(image_id, day=None):
+    """All-time unique viewers of an image, or one day's"""
+    if day is None:
+        return f"image:{image_id}:viewers"
+    return f"image:{image_id}:viewers:{day:%Y%m%d}"
+
+
+def viewed_images_key(day):
+    return f"image_viewers:images:{day:%Y%m%d}"
+
+
+def viewer_token(request):
+    """Identify a viewer by user id, or by a hash of their session"""
+    if request.user.is_authenticated:
+        return f"u:{request.user.id}"
+    session = request.session.session_key or "{}|{}".format(
+        request.META.get("REMOTE_ADDR", ""),
+        request.META.get("HTTP_USER_AGENT", ""),
+    )
+    return "s:" + hashlib.sha256(session.encode()).hexdigest()[:16]
+
+
+def record_view(image_id, viewer):
+    """
+    Count one view of an image by `viewer` (see viewer_token) and return
+    (total views, unique viewers), or (None, None) if Redis is unavailable
+    and the view was buffered locally.
+    """
+    today = timezone.now().date()
+    daily = viewers_key(image_id, today)
+
+    def queue(pipe):
+        pipe.incr(counter_key(image_id))
+        pipe.hincrby(PENDING_KEY, image_id, 1)
+        track_view(pipe, image_id)
+        pipe.pfadd(daily, viewer)
+        pipe.expire(daily, DAILY_VIEWERS_TIMEOUT)
+        pipe.sadd(viewed_images_key(today), image_id)
+        pipe.expire(viewed_images_key(today), DAILY_VIEWERS_TIMEOUT)
+        # yesterday may not be rolled up yet
+        pipe.pfcount(viewers_key(image_id), daily,
+                     viewers_key(image_id, today - timedelta(days=1)))
+
+    results = execute_or_buffer(r, queue)
+    if not results:
+        return None, None
+    return results[0], results[-1]
+
+
+def _update_counts(field, values, combine):
+    """Set `field` to combine(F(field), value) per image id"""
+    items = list(values.items())
+    for start in range(0, len(items), FLUSH_BATCH_SIZE):
+        batch = dict(items[start:start + FLUSH_BATCH_SIZE])
+        Image.objects.filter(id__in=batch).update(**{
+            field: Case(
+                *[
+                    When(id=image_id, then=combine(F(field), value))
+                    for image_id, value in batch.items()
+                ],
+                default=F(field),
+                output_field=PositiveIntegerField(),
+            )
+        })
+
+
+def flush_views():
+    """Add pending view deltas to Image.total_views, return images updated"""
+    # Views recorded from now on go to a fresh hash. A hash left over by
+    # a failed flush is kept and flushed first.
+    if background_r.exists(PENDING_KEY):
+        background_r.renamenx(PENDING_KEY, FLUSHING_KEY)
+    deltas = {
+        int(image_id): int(delta)
+        for image_id, delta in background_r.hgetall(FLUSHING_KEY).items()
+    }
+    with transaction.atomic():
+        _update_counts("total_views", deltas,
+                       lambda total, delta: total + delta)
+    background_r.delete(FLUSHING_KEY)
+    return len(deltas)
+
+
+def import_view_counters():
+    """
+    Copy counts recorded before total_views existed from the per-image
+    Redis counters. Safe to run more than once.
+    """
+    imported = 0
+    keys = []
+    for key in background_r.scan_iter(match="image:*:views", count=1000):
+        keys.append(key)
+        if len(keys) == FLUSH_BATCH_SIZE:
+            imported += _import_counters(keys)
+            keys = []
+    return imported + _import_counters(keys)
+
+
+def _import_counters(keys):
+    if not keys:
+        return 0
+    counts = {
+        int(key.split(b":")[1]): int(count)
+        for key, count in zip(keys, background_r.mget(keys))
+        if count is not None
+    }
+    _update_counts(
+        "total_views",
+        counts,
+        lambda total, count: Greatest(total, count,
+                                      output_field=PositiveIntegerField()),
+    )
+    return len(counts)
+
+
+def rollup_unique_viewers(day=None):
+    """
+    Merge one day's unique viewers (by default yesterday's) into the
+    all-time counts and store the estimates in Image.unique_viewers.
+    Safe to run more than once for the same day.
+    """
+    day = day or timezone.now().date() - timedelta(days=1)
+    image_ids = []
+    rolled_up = 0
+    for image_id in background_r.sscan_iter(viewed_images_key(day),
+                                            count=1000):
+        image_ids.append(int(image_id))
+        if len(image_ids) == FLUSH_BATCH_SIZE:
+            rolled_up += _rollup(image_ids, day)
+            image_ids = []
+    return rolled_up + _rollup(image_ids, day)
+
+
+def _rollup(image_ids, day):
+    if not image_ids:
+        return 0
+    pipe = background_r.pipeline(transaction=False)
+    for image_id in image_ids:
+        total = viewers_key(image_id)
+        pipe.pfmerge(total, total, viewers_key(image_id, day))
+    for image_id in image_ids:
+        pipe.pfcount(viewers_key(image_id))
+    counts = pipe.execute()[len(image_ids):]
+    _update_counts("unique_viewers", dict(zip(image_ids, counts)),
+                   lambda current, count: Value(count))
+    return len(image_ids)
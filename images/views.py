@@ -5,27 +5,28 @@ from django.shortcuts import get_object_or_404
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.http import HttpResponse
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from .forms import ImageCreateForm
 from .models import Image, Comment
+from .cards import card_keys
+from .feed import explore_page, home_page, load_page_images, \
+    attach_like_counts, attach_liked_by_me, serialize_cards, CARD_FIELDS
+from .likes import record_like
+from .viewcounts import record_view, viewer_token
+from .leaderboard import get_leaderboard, WINDOWS, ALL_TIME
+from .search import search_images
 from actions.utils import create_action
 from django.conf import settings
-import redis
-from django.db.models import Q
-from django.contrib.auth.models import User
 from .models import Story, StoryImage
 from django.utils import timezone
 from datetime import timedelta
 from collections import defaultdict
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import get_conditional_response
+import hashlib
 import json
 
 
-r = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-)
+RANKING_WINDOWS = [*WINDOWS, ALL_TIME]
 
 
 @login_required
@@ -63,14 +64,25 @@ def image_create(request):
 
 def image_detail(request, id, slug):
     image = get_object_or_404(Image, id=id, slug=slug)
-    # increment total image views by 1
-    total_views = r.incr(f"image:{image.id}:views")
-    # increment image ranking by 1
-    r.zincrby("image_ranking", 1, image.id)
+    total_views, unique_viewers = record_view(image.id,
+                                              viewer_token(request))
+    if total_views is None:
+        # Redis is unavailable, the view is counted once it is back
+        total_views = image.total_views
+        unique_viewers = image.unique_viewers
+    attach_like_counts([image])
+    image.liked_by_me = False
+    if request.user.is_authenticated:
+        attach_liked_by_me([image], request.user)
     return render(
         request,
         "images/image/detail.html",
-        {"section": "images", "image": image, "total_views": total_views},
+        {
+            "section": "images",
+            "image": image,
+            "total_views": total_views,
+            "unique_viewers": unique_viewers,
+        },
     )
 
 
@@ -82,7 +94,12 @@ def image_like(request):
     if image_id and action:
         try:
             image = Image.objects.get(id=image_id)
-            if action == "like":
+            if settings.LIKES_WRITE_BEHIND and record_like(
+                image.id, request.user.id, action == "like"
+            ) is not None:
+                # written to the database by flush_pending_likes
+                pass
+            elif action == "like":
                 image.users_like.add(request.user)
                 create_action(request.user, "likes", image)
             else:
@@ -96,26 +113,15 @@ def image_like(request):
 @login_required
 def image_list(request):
     followed_ids = request.user.following.values_list("id", flat=True)
-    followed_images = Image.objects.filter(user__in=followed_ids).order_by("-created")
-    other_images = Image.objects.exclude(user__in=followed_ids).order_by("-created")
-
-    all_images = list(followed_images) + list(other_images)
-
-    paginator = Paginator(all_images, 50)
-    page = request.GET.get("page")
     images_only = request.GET.get("images_only")
 
-    try:
-        images = paginator.page(page)
-    except PageNotAnInteger:
-        images = paginator.page(1)
-    except EmptyPage:
-        if images_only:
-            return HttpResponse("")
-        images = paginator.page(paginator.num_pages)
+    # Followed users' images first, then everyone else's, one page at a time
+    images = explore_page(followed_ids, request.GET.get("cursor"))
+    if images_only and not images.object_list:
+        return HttpResponse("")
 
     new_user = (
-        not followed_images.exists()
+        not Image.objects.filter(user__in=followed_ids).exists()
         and not Image.objects.filter(user=request.user).exists()
     )
 
@@ -129,24 +135,84 @@ def image_list(request):
     }
 
     if images_only:
-        return render(request, "images/image/list_images.html", context)
+        response = render(request, "images/image/list_images.html", context)
+        response["X-Next-Cursor"] = images.next_cursor or ""
+        return response
     print("Grouped stories:", grouped_stories)
 
     return render(request, "images/image/list.html", context)
 
 
+FEED_API_VERSION = 1
+
+
+@login_required
+def feed_api(request):
+    """
+    Compact JSON version of the home feed.
+
+    ?cursor= continues from a previous page, ?fields=id,thumbnail,...
+    limits each card to the listed fields. Responses carry a strong ETag
+    computed from the page's image ids, cursor and card versions and the
+    viewer's like and follow state, before any card is built, so
+    If-None-Match requests for unchanged pages get a cheap 304.
+    """
+    user = request.user
+    followed_users = list(
+        user.following.exclude(id=user.id).values_list("id", flat=True)
+    )
+    page = home_page(user, followed_users, request.GET.get("cursor"))
+    images = attach_liked_by_me(load_page_images(page, followed_users), user)
+    fields = [f for f in request.GET.get("fields", "").split(",")
+              if f in CARD_FIELDS]
+
+    keys = card_keys(images) if images else {}
+    etag = None
+    if keys is not None:
+        validator = json.dumps([
+            FEED_API_VERSION, fields, page.next_cursor,
+            [(keys[image.id], image.liked_by_me, image.is_following)
+             for image in images],
+        ])
+        etag = '"%s"' % hashlib.sha1(validator.encode()).hexdigest()
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return _feed_api_headers(response, etag)
+
+    body = json.dumps(
+        {
+            "version": FEED_API_VERSION,
+            "cards": serialize_cards(images, keys, fields),
+            "next_cursor": page.next_cursor,
+            "has_more": page.has_next(),
+        },
+        separators=(",", ":"),
+    )
+    response = HttpResponse(body, content_type="application/json")
+    return _feed_api_headers(response, etag)
+
+
+def _feed_api_headers(response, etag):
+    if etag:
+        response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
 @login_required
 def image_ranking(request):
-    # get image ranking dictionary
-    image_ranking = r.zrange("image_ranking", 0, -1, desc=True)[:10]
-    image_ranking_ids = [int(id) for id in image_ranking]
-    # get most viewed images
-    most_viewed = list(Image.objects.filter(id__in=image_ranking_ids))
-    most_viewed.sort(key=lambda x: image_ranking_ids.index(x.id))
+    window = request.GET.get("window", "day")
+    if window not in RANKING_WINDOWS:
+        window = "day"
     return render(
         request,
         "images/image/ranking.html",
-        {"section": "images", "most_viewed": most_viewed},
+        {
+            "section": "images",
+            "most_viewed": get_leaderboard(window),
+            "window": window,
+            "windows": RANKING_WINDOWS,
+        },
     )
 
 
@@ -169,23 +235,21 @@ def image_comment(request):
 
 
 def image_list_view(request):
-    query = request.GET.get("q")
-    if query:
-        users = User.objects.filter(
-            Q(username__icontains=query)
-            | Q(first_name__icontains=query)
-            | Q(last_name__icontains=query)
-        )
-        images = Image.objects.filter(user__in=users).select_related("user")
-    else:
-        images = Image.objects.all()
-
+    query = request.GET.get("q", "").strip()
+    images = search_images(query, request.GET.get("cursor"))
     context = {
+        "section": "images",
+        "query": query,
         "images": images,
     }
     if request.GET.get("images_only"):
-        return render(request, "images/image/list_images.html", context)
-    return render(request, "images/image/bookmarked.html", context)
+        if not images.object_list:
+            return HttpResponse("")
+        response = render(request, "images/image/search_results.html",
+                          context)
+        response["X-Next-Cursor"] = images.next_cursor or ""
+        return response
+    return render(request, "images/image/search.html", context)
 
 
 @require_POST